@@ -1,8 +1,12 @@
 from CFUtil import CFUtil
 from PyUtil import printf
+from SwarmState import SwarmState
+from CommandPool import CommandPool
+from LatencyTracer import LatencyTracer
+from TocCacheManager import ManagedTocCache
 
 from functools import partial
-import copy
+import numpy as np
 import time
 
 import cflib.crtp
@@ -37,12 +41,18 @@ class CfFactory:
 
     # Generate SyncCrazyflies with loggers according to base swarm setup
     def __init__(self, ro_cache=None, rw_cache=None):
+        """
+        :param ro_cache: Optional read-only TOC cache folder
+        :param rw_cache: Optional TOC cache folder, downloaded TOCs are saved here
+        """
         self.ro_cache = ro_cache
         self.rw_cache = rw_cache
+        # All Crazyflies share one cache, identical firmware is only read from disk once
+        self.toc_cache = ManagedTocCache.get_shared(ro_cache=ro_cache, rw_cache=rw_cache)
 
     # Construct individual Crazyflie
     def construct(self, uri):
-        cf = Crazyflie(ro_cache=self.ro_cache, rw_cache=self.rw_cache)
+        cf = self.toc_cache.attach(Crazyflie())
         return SyncCrazyflie(uri, cf)
 
 
@@ -71,26 +81,43 @@ class AsyncSwarm(Swarm):
     }
 
     self.sequential(my_function, args_dict)
+
+    Setpoints sent every control cycle go through self.broadcast, which enqueues the command on a long lived worker
+    per drone instead of starting a thread per drone and call.
     """
 
-    def __init__(self, uri_indices, log=None, GUI_callback = None):
-        uris = []
-        for i in uri_indices:
-            uris.append(uris_default[i])
+    def __init__(self, uri_indices, log=None, GUI_callback = None, uris=None, factory=None):
+        """
+        :param uri_indices: Indices in CFUtil.URIS_DEFAULT of the drones to use
+        :param log: Optional LogManager
+        :param GUI_callback: Optional function receiving connection status updates
+        :param uris: Optional list of uris used instead of uri_indices
+        :param factory: Optional factory constructing the SyncCrazyflies, ex: SimSwarm for drones without radio
+        """
+        if uris is None:
+            uris = []
+            for i in uri_indices:
+                uris.append(uris_default[i])
+        uris = list(uris)
 
         cflib.crtp.init_drivers(enable_debug_driver=False)
 
         self.GUI_callback = GUI_callback
         self.controller_active = False
 
-        self._factory = CfFactory(rw_cache=CFUtil.RW_CACHE)
+        self._factory = factory if factory is not None else CfFactory(ro_cache=CFUtil.RO_CACHE,
+                                                                      rw_cache=CFUtil.RW_CACHE)
         super(AsyncSwarm, self).__init__(uris, self._factory)
 
-        self.state = {}
-        self.last_seen = {}
-        for uri in uris:
-            self.state[uri] = [None] * 6
-            self.last_seen[uri] = [0, time.time()]
+        self.state = SwarmState(uris)
+        self.tracer = None
+        self.estimator_times = {}
+        # Convergence check of the estimators when the links are opened, see CFUtil.wait_for_position_estimator
+        self.estimator_timeout = 10
+        self.estimator_window = 10
+        self.estimator_threshold = 0.01
+        self.estimator_criterion = None
+        self._commands = CommandPool()
 
         self.log = log
         self.cb_log = None
@@ -110,11 +137,15 @@ class AsyncSwarm(Swarm):
         starttime = time.time()
         self.open_links_sequence()
         printf('Links opened after: %d seconds\n', int(time.time()-starttime))
+        if hasattr(self._factory, 'toc_cache'):
+            print('TOC cache ' + str(self._factory.toc_cache))
         print('Starting all loggers...')
         self.parallel(partial(CFUtil.start_default_log_config, self.log_callback))
         printf('All logs initiated after: %d seconds\n', int(time.time() - starttime))
+        self._commands.start(self._cfs)
 
     def stop(self):
+        self._commands.stop()
         self.close_links()
         status = {}
         for uri in CFUtil.URIS_DEFAULT:
@@ -131,37 +162,79 @@ class AsyncSwarm(Swarm):
             return
         try:
             self.parallel(self.connect_and_param)
-            args_dict = {}
-            uris = self.get_uris()
-            for uri in uris:
-                args_dict[uri] = [self.GUI_callback]
-            self.parallel(CFUtil.reset_estimator, args_dict=args_dict)
-            #self.parallel(CFUtil.reset_estimator)
+            times = self.reset_estimators(timeout=self.estimator_timeout, window=self.estimator_window,
+                                          threshold=self.estimator_threshold, criterion=self.estimator_criterion)
+
+            # Drones without a converged position estimate must not fly
+            for uri in [uri for uri in times if times[uri] is None]:
+                self._remove_unready(uri)
+            if len(self._cfs) == 0:
+                raise ConnectionError('No drone with a converged position estimator')
             self._is_open = True
         except Exception as e:
             print(e)
             self.close_links()
             raise e
 
+    def reset_estimators(self, timeout=10, period_ms=100, window=10, threshold=0.01, criterion=None):
+        """
+        Reset the estimators of all drones in parallel and wait until every position estimate has converged, the
+        swarm is ready when this returns. Time to converge of every drone is printed, slowest first.
+        :param timeout: Maximum wait for each drone in seconds
+        :param period_ms, window, threshold, criterion: Convergence check, see CFUtil.wait_for_position_estimator
+        :return: dict{uri: seconds until converged, None if not converged}, also kept in self.estimator_times
+        """
+        times = {uri: None for uri in self.get_uris()}
+
+        def reset(scf):
+            times[scf._link_uri] = CFUtil.reset_estimator(scf, self.GUI_callback, timeout=timeout, period_ms=period_ms,
+                                                          window=window, threshold=threshold, criterion=criterion)
+
+        self.parallel(reset)
+        self.estimator_times = times
+
+        for uri in sorted(times, key=lambda uri: -1 if times[uri] is None else -times[uri]):
+            if times[uri] is None:
+                print('Estimator not converged: ' + uri)
+            else:
+                printf('Estimator converged after %.2f seconds: %s\n', times[uri], uri)
+        return times
+
+    def _remove_unready(self, uri):
+        """
+        Close the link of a drone that failed to get ready and remove it from the swarm, before the links are open
+        """
+        print('Removing ' + uri + ' from the swarm')
+        try:
+            self._cfs[uri].close_link()
+        except Exception as e:
+            print('Error closing link of ' + uri + ': ' + str(e))
+        del self._cfs[uri]
+        self._commands.remove(uri)
+        self.state.remove(uri)
+        self.GUI_update({uri: {CFUtil.KEY_CONNECTION: CFStates.DISCONNECTED}})
+
     def connect_and_param(self, scf):
         """
         Open link to specified drone and wait for parameters to download.
         Calls external function that resets logging and tries again if first attempt unsuccessful.
+        Waits on the callbacks of cflib, all drones of self.parallel connect concurrently.
         """
         uri = scf._link_uri
         self.GUI_update({uri: {CFUtil.KEY_CONNECTION: CFStates.INITIALIZED}})
-        time.sleep(1)
         try:
-            CFUtil.ext_open_link_cf(scf, timeout=3, retries=2)
+            CFUtil.ext_open_link_cf(scf, timeout=3, retries=2, factory=self._factory)
         except AttributeError as e:
             print('Attribute Error caught: ' + ' '.join(e.args))
             self.GUI_update({uri: {CFUtil.KEY_CONNECTION: CFStates.DISCONNECTED}})
             return
         except Exception as e:
-            print('Aborting connection')
+            print('Aborting connection: ' + str(e))
+            self.GUI_update({uri: {CFUtil.KEY_CONNECTION: CFStates.DISCONNECTED}})
+            return
+        if not CFUtil.wait_for_param_download(scf, timeout=10):
             self.GUI_update({uri: {CFUtil.KEY_CONNECTION: CFStates.DISCONNECTED}})
             return
-        CFUtil.wait_for_param_download(scf)
         CFUtil.stop_all_logging(scf)
         self.GUI_update({uri: {CFUtil.KEY_CONNECTION: CFStates.CONNECTED}})
 
@@ -171,10 +244,10 @@ class AsyncSwarm(Swarm):
             return
         scf = self._factory.construct(uri)
         self._cfs[uri] = scf
-        self.state[uri] = [None] * 6
-        self.last_seen[uri] = [0, time.time()]
+        self.state.add(uri)
         if self._is_open:
             self.connect_and_param(scf)
+            self._commands.add(uri, scf)
 
     def remove_drone(self, uri):
         if uri not in self._cfs:
@@ -183,8 +256,8 @@ class AsyncSwarm(Swarm):
             print("Cannot remove drone while connected")
             return
         del self._cfs[uri]
-        del self.state[uri]
-        del self.last_seen[uri]
+        self._commands.remove(uri)
+        self.state.remove(uri)
 
     def take_off_and_hover(self):
         """
@@ -197,32 +270,104 @@ class AsyncSwarm(Swarm):
 
     def follow_controller(self, controller):
         """
-        Retrieve velocity setpoints from controller and send to drones. Uses controllers get_u_list() function.
-        :param controller: Object with get_u_list function as defined in Controllers file
-        :param ignore_list: List of URIs to ignore. Any URI in list will not receive setpoint
+        Retrieve velocity setpoints from controller and send to drones. Uses controllers get_u() function.
+        Drones on the ignore list of the controller do not receive a setpoint.
+        :param controller: Controller as defined in Controllers file
         :return:
         """
         # TODO Change to function parameter instead of controller reference
         if self.controller_active:
-            u = controller.get_u_list()
+            output = controller.get_u()
 
-            self.parallel(CFUtil.set_world_vel_no_yaw, args_dict=u)
+            self.send_velocity_batch(output.uris, output.array, output.ignore)
         else:
             return
 
+    def send_velocity_batch(self, uris, u, ignore=()):
+        """
+        Send velocity setpoints with desired yaw 0, one row of u per uri.
+        Enqueued on the command workers if running, otherwise sent in one pass from the calling thread.
+        :param uris: list of uris
+        :param u: numpy array of size n-3
+        :param ignore: Collection of uris that should not receive a setpoint
+        """
+        if self.tracer is not None:
+            self._send_velocity_traced(uris, u, ignore)
+        elif self._commands.is_running():
+            for uri, vel in zip(uris, u):
+                if uri not in ignore and uri in self._cfs:
+                    self._commands.submit(uri, CFUtil.set_world_vel_no_yaw, (vel,))
+        else:
+            CFUtil.send_velocity_batch(self._cfs, uris, u, ignore)
+
+    def _send_velocity_traced(self, uris, u, ignore):
+        """
+        Same as send_velocity_batch, with dispatch and send times recorded in self.tracer
+        """
+        tracer = self.tracer
+        tick = tracer.dispatch()
+        running = self._commands.is_running()
+        for uri, vel in zip(uris, u):
+            if uri in ignore or uri not in self._cfs:
+                continue
+            if running:
+                self._commands.submit(uri, AsyncSwarm._send_traced, (vel, tracer, tick))
+            else:
+                AsyncSwarm._send_traced(self._cfs[uri], vel, tracer, tick)
+
+    @staticmethod
+    def _send_traced(scf, vel, tracer, tick):
+        CFUtil.set_world_vel_no_yaw(scf, vel)
+        tracer.sent(tick, scf._link_uri)
+
+    def enable_tracing(self, capacity=10000):
+        """
+        Record the latency of every controller tick from log callback to sent setpoint, see LatencyTracer.
+        Tracing covers the drones in the swarm when enabled.
+        :param capacity: Number of ticks kept
+        :return: LatencyTracer
+        """
+        self.tracer = LatencyTracer(self.state.uris, capacity=capacity)
+        return self.tracer
+
+    def disable_tracing(self):
+        self.tracer = None
+
+    def broadcast(self, func, args_dict=None, futures=False):
+        """
+        Send command to all drones without blocking, using the same arguments as self.parallel.
+        Falls back to self.parallel if the command workers have not been started.
+        :param futures: True to return dict{uri: Future} completed when each drone has executed the command.
+        Always None when falling back to self.parallel, which blocks until all drones are done.
+        """
+        if self._commands.is_running():
+            return self._commands.broadcast(func, args_dict=args_dict, futures=futures)
+        self.parallel(func, args_dict=args_dict)
+
     def log_callback(self, uri, timestamp, data, logconf):
-        """Callback from the log API when data arrives"""
-        self.state[uri] = data
-        self.last_seen[uri] = [timestamp, time.time()]
+        """Callback from the log API when data arrives, writes data into the row of the drone in place"""
+        if self.tracer is not None:
+            self.tracer.callback(uri)
+        self.state.write(uri, timestamp, data)
         if self.cb_log is not None:
-            self.cb_log.push_data(copy.copy(self.last_seen))
+            self.cb_log.push_data(self.state.get_last_seen())
+
+    def get_state(self, out=None):
+        """
+        Get consistent snapshot of swarm state as SwarmState containing [x, y, z, vx, vy, vz, vbat] for each drone.
+        Can still be indexed as dictionary of dictionary, ex: x = state[URI1]['kalman.stateX']
+        :param out: Optional previous snapshot to reuse, see SwarmState.snapshot
+        """
+        return self.state.snapshot(out)
 
-    def get_state(self):
+    def wait_for_state(self, since, timeout):
         """
-        Get state of swarm as dictionary of dictionary containing [x, y, z, vx, vy, vz]
-        ex: x = state[URI1]['kalman.stateX']
+        Block until all drones have delivered new log data since a previous snapshot, or until timeout
+        :param since: Sequence numbers of previous snapshot (state.seq), None to return immediately
+        :param timeout: Maximum time to wait in seconds
+        :return: True if all drones have new data, False on timeout
         """
-        return copy.copy(self.state)
+        return self.state.wait_for_update(since, timeout)
 
     def get_state_list(self):
         """
@@ -237,12 +382,12 @@ class AsyncSwarm(Swarm):
         :return: 3 element list containing list of active uris sorted by ascending position in x/y/z direction
         """
 
-        uris = list(self.state.keys())
+        state = self.get_state()
 
         output = []
-        output.append(sorted(uris, key=lambda uri: self.state[uri][CFUtil.KEY_X]))
-        output.append(sorted(uris, key=lambda uri: self.state[uri][CFUtil.KEY_Y]))
-        output.append(sorted(uris, key=lambda uri: self.state[uri][CFUtil.KEY_Z]))
+        for axis in range(3):
+            order = np.argsort(state.array[:, axis], kind='stable')
+            output.append([state.uris[row] for row in order])
 
         return output
 
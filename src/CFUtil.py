@@ -1,13 +1,12 @@
 import time
+import queue
 from functools import partial
-from threading import Thread
+from threading import Event
 import numpy as np
 from copy import deepcopy as copy
 import math
 
 from cflib.crazyflie.log import LogConfig
-from cflib.crazyflie.syncLogger import SyncLogger
-from cflib.crazyflie.commander import Commander
 from cflib.crtp.crtpstack import CRTPPacket
 from cflib.crazyflie import Crazyflie
 from cflib.crazyflie import State as CFStates
@@ -24,10 +23,13 @@ class CFUtil:
     KEY_DZ = 'kalman.statePZ'
     KEY_BAT = 'pm.vbatMV'
 
+    KEYS_STATE = (KEY_X, KEY_Y, KEY_Z, KEY_DX, KEY_DY, KEY_DZ)
+
     KEY_CONNECTION = 0
     KEY_BATTERY = KEY_BAT   # Fugly, please fix
 
     RW_CACHE = "./cache"
+    RO_CACHE = None     # Optional read-only TOC cache shared by a fleet with identical firmware, see TocCacheManager
 
     # Drone URIs, set manually through client
     URI1 = 'radio://0/120/2M/E7E7E7E701'
@@ -82,18 +84,32 @@ class CFUtil:
     def state_dict_to_numpy_matrix(state):
         """
         Changes dict{uri: dict{key: value}} to dict{uri: numpy[x, y ... dy, dz]}
-        :param state: dictionary of dictionaries containing state information
+        :param state: dictionary of dictionaries containing state information, or SwarmState
         :returns: dictionary of arrays containing x-y-z-dx-dy-dz
         """
-        state = copy(state)
-        for uri in state:
-            state[uri] = np.array([state[uri][CFUtil.KEY_X],
-                                   state[uri][CFUtil.KEY_Y],
-                                   state[uri][CFUtil.KEY_Z],
-                                   state[uri][CFUtil.KEY_DX],
-                                   state[uri][CFUtil.KEY_DY],
-                                   state[uri][CFUtil.KEY_DZ]])
-        return state
+        uris, array = CFUtil.state_dict_to_array(state)
+        return dict(zip(uris, array))
+
+    @staticmethod
+    def state_dict_to_array(state):
+        """
+        Changes dict{uri: dict{key: value}} to a single numpy matrix with one row per drone
+        :param state: dictionary of dictionaries containing state information, or SwarmState
+        :returns: list of uris, numpy array of size n-6 containing x-y-z-dx-dy-dz in the same order as the uris.
+        Drones without a complete state, ex: before their first log sample, are left out. For a SwarmState where every
+        drone has reported the array is a view of its state matrix.
+        """
+        if hasattr(state, 'get_matrix'):
+            valid = state.get_valid()
+            if valid.all():
+                return list(state.uris), state.get_matrix()
+            return [uri for uri, seen in zip(state.uris, valid) if seen], state.get_matrix()[valid]
+
+        uris = [uri for uri in state.keys() if all(key in state[uri] for key in CFUtil.KEYS_STATE)]
+        array = np.empty((len(uris), len(CFUtil.KEYS_STATE)), dtype=float)
+        for i, uri in enumerate(uris):
+            array[i] = [state[uri][key] for key in CFUtil.KEYS_STATE]
+        return uris, array
 
     @staticmethod
     def default_log_config(sample_time_ms=10):
@@ -108,90 +124,159 @@ class CFUtil:
         return config
 
     @staticmethod
-    def start_default_log_config(callback, scf, sample_time=50):
+    def start_default_log_config(callback, scf, sample_time=50, timeout=5):
+        """
+        Start logging the state of a drone, returns as soon as the drone has confirmed the log block
+        :param callback: Function receiving (uri, timestamp, data, logconf) for every sample
+        :param timeout: Maximum wait for the confirmation in seconds
+        :return: True if the log block was started
+        """
         log_config = CFUtil.default_log_config(sample_time_ms=sample_time)
         log_config.data_received_cb.add_callback(partial(callback, scf.cf.link_uri))
         scf.cf.log.add_config(log_config)
-        log_config.start()
-        while log_config._started is False:
-            time.sleep(0.1)
-        print('Logger started for ' + scf.cf.link_uri + ', sleep 0.5 seconds for stability.')
-        time.sleep(0.5)
+        started = CFUtil.wait_for_callback(log_config.started_cb, timeout=timeout, condition=lambda: log_config.started,
+                                           start=log_config.start)
+        if started:
+            print('Logger started for ' + scf.cf.link_uri)
+        else:
+            print('Logger not confirmed for ' + scf.cf.link_uri + ' after ' + str(timeout) + ' seconds')
+        return started
 
     @staticmethod
-    def wait_for_position_estimator(scf):
+    def wait_for_position_estimator(scf, period_ms=100, window=10, threshold=0.01, timeout=None, criterion=None):
+        """
+        Wait until the position variances reported by the Kalman estimator have settled
+        :param scf: SyncCrazyflie
+        :param period_ms: Log period of the variances
+        :param window: Number of latest samples the criterion is evaluated on
+        :param threshold: Largest spread, max - min, of each variance within the window counted as settled
+        :param timeout: Maximum wait in seconds, None to wait until converged
+        :param criterion: Optional function taking a numpy array of size window-3 with the latest variances of x, y and
+        z, in no particular order, returning True when converged. Defaults to CFUtil.spread_settled
+        :return: Seconds until converged, None on timeout
+        """
         print('Waiting for estimator to find position...')
+        if criterion is None:
+            criterion = partial(CFUtil.spread_settled, threshold=threshold)
 
-        log_config = LogConfig(name='Kalman Variance', period_in_ms=500)
+        log_config = LogConfig(name='Kalman Variance', period_in_ms=period_ms)
         log_config.add_variable('kalman.varPX', 'float')
         log_config.add_variable('kalman.varPY', 'float')
         log_config.add_variable('kalman.varPZ', 'float')
 
-        var_y_history = [1000] * 10
-        var_x_history = [1000] * 10
-        var_z_history = [1000] * 10
-
-        threshold = 0.01
-
-        with SyncLogger(scf, log_config) as logger:
-            for log_entry in logger:
-                data = log_entry[1]
-
-                var_x_history.append(data['kalman.varPX'])
-                var_x_history.pop(0)
-                var_y_history.append(data['kalman.varPY'])
-                var_y_history.pop(0)
-                var_z_history.append(data['kalman.varPZ'])
-                var_z_history.pop(0)
-
-                min_x = min(var_x_history)
-                max_x = max(var_x_history)
-                min_y = min(var_y_history)
-                max_y = max(var_y_history)
-                min_z = min(var_z_history)
-                max_z = max(var_z_history)
+        samples = queue.Queue()
+        log_config.data_received_cb.add_callback(lambda timestamp, data, logconf: samples.put(data))
+        history = np.empty((window, 3))
+        count = 0
 
-                # print("{} {} {}".
-                #       format(max_x - min_x, max_y - min_y, max_z - min_z))
+        starttime = time.time()
+        scf.cf.log.add_config(log_config)
+        log_config.start()
+        try:
+            while True:
+                remaining = None if timeout is None else starttime + timeout - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                try:
+                    data = samples.get(timeout=remaining)
+                except queue.Empty:
+                    return None
+
+                # Rolling window, the oldest sample is overwritten
+                history[count % window] = (data['kalman.varPX'], data['kalman.varPY'], data['kalman.varPZ'])
+                count = count + 1
+                if count >= window and criterion(history):
+                    return time.time() - starttime
+        finally:
+            log_config.stop()
+            log_config.delete()
 
-                if (max_x - min_x) < threshold and (
-                        max_y - min_y) < threshold and (
-                        max_z - min_z) < threshold:
-                    break
+    @staticmethod
+    def spread_settled(history, threshold=0.01):
+        """
+        Default convergence criterion, the spread max - min of every estimator variance within the window is below
+        threshold
+        :param history: numpy array of size window-3
+        """
+        return bool(np.all(history.max(axis=0) - history.min(axis=0) < threshold))
 
     @staticmethod
-    def wait_for_param_download(scf):
-        while not scf.cf.param.is_updated:
-            time.sleep(0.5)
-        print('Parameters downloaded for', scf.cf.link_uri)
+    def wait_for_param_download(scf, timeout=None):
+        """
+        Wait for the all_updated callback of the parameters
+        :param timeout: Maximum wait in seconds, None to wait until done
+        :return: True if all parameters have been downloaded
+        """
+        param = scf.cf.param
+        updated = CFUtil.wait_for_callback(param.all_updated, timeout=timeout, condition=lambda: param.is_updated)
+        if updated:
+            print('Parameters downloaded for', scf.cf.link_uri)
+        else:
+            print('Parameter download timed out for', scf.cf.link_uri)
+        return updated
 
     @staticmethod
-    def reset_estimator(scf, callback=None):
+    def reset_estimator(scf, callback=None, timeout=None, period_ms=100, window=10, threshold=0.01, criterion=None):
+        """
+        Reset the Kalman estimator and wait for the position estimate to converge
+        :param callback: Optional function receiving the connection status once converged
+        :param timeout: Maximum wait for convergence in seconds, None to wait until converged
+        :param period_ms, window, threshold, criterion: Convergence check, see wait_for_position_estimator
+        :return: Seconds from reset until converged, None on timeout
+        """
+        starttime = time.time()
         cf = scf.cf
         cf.param.set_value('kalman.resetEstimation', '1')
         time.sleep(0.1)
         cf.param.set_value('kalman.resetEstimation', '0')
 
-        CFUtil.wait_for_position_estimator(scf)
+        if CFUtil.wait_for_position_estimator(scf, period_ms=period_ms, window=window, threshold=threshold,
+                                              timeout=timeout, criterion=criterion) is None:
+            print('Estimator of ' + scf._link_uri + ' did not converge within ' + str(timeout) + ' seconds')
+            return None
         if callback:
             callback({scf._link_uri: {CFUtil.KEY_CONNECTION: CFStates.SETUP_FINISHED}})
+        return time.time() - starttime
+
+    @staticmethod
+    def get_commander(scf):
+        """
+        Commander of the drone. Every Crazyflie keeps its own Commander, reusing it avoids constructing a new one for
+        each setpoint. Looked up through scf on every call as the Crazyflie is replaced on reconnection attempts.
+        :param scf: SyncCrazyflie
+        :return: Commander
+        """
+        return scf.cf.commander
+
+    @staticmethod
+    def send_velocity_batch(cfs, uris, u, ignore=()):
+        """
+        Send velocity setpoints with desired yaw 0 to many drones in one pass
+        :param cfs: dict{uri: SyncCrazyflie}
+        :param uris: list of uris, one per row of u
+        :param u: numpy array of size n-3 containing [vx, vy, vz] for each drone
+        :param ignore: Collection of uris that should not receive a setpoint
+        :return:
+        """
+        for uri, vel in zip(uris, u.tolist()):
+            if uri in ignore or uri not in cfs:
+                continue
+            CFUtil.get_commander(cfs[uri]).send_velocity_world_setpoint(vel[0], vel[1], vel[2], 0)
 
     @staticmethod
     def set_abs_pos(scf, pos):
         if len(pos) < 4:
             pos = pos + (0,)
-        cf = scf.cf
-        mc = Commander(cf)
+        mc = CFUtil.get_commander(scf)
         mc.send_position_setpoint(pos[0], pos[1], pos[2], pos[3])
 
     @staticmethod
     def set_abs_pos_blocking(scf, pos, duration=5):
-        cf = scf.cf
         hover_time = duration
         sleep_time = 0.2
         length = int(hover_time / sleep_time)
 
-        mc = Commander(cf)
+        mc = CFUtil.get_commander(scf)
 
         for i in range(length):
             mc.send_position_setpoint(pos[0], pos[1], pos[2], pos[3])
@@ -199,8 +284,7 @@ class CFUtil:
 
     @staticmethod
     def set_world_vel(scf, vel):
-        cf = scf.cf
-        mc = Commander(cf)
+        mc = CFUtil.get_commander(scf)
         mc.send_velocity_world_setpoint(vel[0], vel[1], vel[2], vel[3])
 
     @staticmethod
@@ -214,17 +298,15 @@ class CFUtil:
         """
         if ignore:
             return
-        cf = scf.cf
-        mc = Commander(cf)
+        mc = CFUtil.get_commander(scf)
         mc.send_velocity_world_setpoint(vel[0], vel[1], vel[2], 0)
 
     @staticmethod
     def set_world_vel_blocking(scf, vel, duration=5):
-        cf = scf.cf
         hover_time = duration
         sleep_time = 0.2
         length = int(hover_time / sleep_time)
-        mc = Commander(cf)
+        mc = CFUtil.get_commander(scf)
 
         for i in range(length):
             mc.send_velocity_world_setpoint(vel[0], vel[1], vel[2], vel[3])
@@ -292,26 +374,72 @@ class CFUtil:
         cf.connection_lost.add_callback(callback)
 
     @staticmethod
-    def ext_open_link_cf(scf, timeout=0, retries=5):
-        cf = scf.cf
-        tries = 0
-        while tries < retries and cf.is_connected() is not True:
-            tries = tries + 1
-            print('Connection attempt ' + str(tries) + ' for ' + scf._link_uri)
-            thread = Thread(target=partial(cf.open_link, scf._link_uri))
-            thread.start()
-            if timeout > 0:
-                timestep = 0.1
-                steps = timeout/timestep
-                for i in range(int(steps)):
-                    time.sleep(timestep)
-                    if cf.is_connected():
-                        break
-            else:
-                thread.join()
+    def wait_for_callback(caller, timeout=None, condition=None, failure=None, start=None):
+        """
+        Block until a cflib callback is called, without polling
+        :param caller: cflib Caller to wait for, ex: cf.connected
+        :param timeout: Maximum wait in seconds, None to wait forever
+        :param condition: Optional function returning True once the awaited state is reached. Checked before waiting,
+        in case the callback was called before registering, and after the callback
+        :param failure: Optional Caller ending the wait unsuccessfully, ex: cf.connection_failed
+        :param start: Optional function called once the callbacks are registered, ex: opening the link
+        :return: True if caller was called and condition holds, False on failure or timeout
+        """
+        event = Event()
+        failed = []
+
+        def on_call(*args):
+            event.set()
+
+        def on_failure(*args):
+            failed.append(args)
+            event.set()
+
+        caller.add_callback(on_call)
+        if failure is not None:
+            failure.add_callback(on_failure)
+        try:
+            if start is not None:
+                start()
+            if condition is not None and condition():
+                return True
+            if not event.wait(timeout) or failed:
+                return False
+            return condition() if condition is not None else True
+        finally:
+            caller.remove_callback(on_call)
+            if failure is not None:
+                failure.remove_callback(on_failure)
 
+    @staticmethod
+    def ext_open_link_cf(scf, timeout=0, retries=5, backoff=0.5, factory=None):
+        """
+        Open link and wait for the connected callback of cflib, called once the TOCs have been downloaded.
+        Failed attempts are retried on a new Crazyflie with exponential backoff.
+        :param scf: SyncCrazyflie
+        :param timeout: Maximum wait of each attempt in seconds, 0 to wait until connected or failed
+        :param retries: Number of attempts
+        :param backoff: Wait before the second attempt in seconds, doubled for every further attempt
+        :param factory: Factory the swarm was built with, see AsyncSwarm.CfFactory. Used to build the new Crazyflie so
+        it keeps the TOC cache, or the simulation
+        :raises ConnectionError: if no attempt succeeded
+        """
+        cf = scf.cf
+        for attempt in range(retries):
             if cf.is_connected():
+                return
+            if attempt > 0:
+                time.sleep(backoff*2**(attempt - 1))
+            print('Connection attempt ' + str(attempt + 1) + ' for ' + scf._link_uri)
+            connected = CFUtil.wait_for_callback(cf.connected, timeout=timeout or None, condition=cf.is_connected,
+                                                 failure=cf.connection_failed,
+                                                 start=partial(cf.open_link, scf._link_uri))
+
+            if connected:
                 scf._is_link_open = True
+                # SyncCrazyflie.close_link waits for this callback in newer versions of cflib
+                if hasattr(scf, '_disconnected'):
+                    cf.disconnected.add_callback(scf._disconnected)
                 return
             else:
                 try:
@@ -320,18 +448,43 @@ class CFUtil:
                 except Exception as e:
                     print(e)
 
-                cf = Crazyflie(rw_cache=CFUtil.RW_CACHE)
-                scf.cf = cf
+                cf = CFUtil.rebuild_cf(scf, factory)
                 scf._is_link_open = False
                 print('Connection attempt failed...')
 
+        if not cf.is_connected():
+            raise ConnectionError('Could not connect to ' + scf._link_uri + ' after ' + str(retries) + ' attempts')
+
+    @staticmethod
+    def rebuild_cf(scf, factory=None):
+        """
+        Replace the Crazyflie of scf after a failed connection attempt
+        :param factory: Optional factory constructing the new Crazyflie, otherwise the TOC cache of the old one is kept
+        :return: New Crazyflie
+        """
+        if factory is not None:
+            cf = factory.construct(scf._link_uri).cf
+        elif hasattr(scf.cf, '_toc_cache'):
+            cf = Crazyflie()
+            cf._toc_cache = scf.cf._toc_cache
+        else:
+            cf = Crazyflie(ro_cache=CFUtil.RO_CACHE, rw_cache=CFUtil.RW_CACHE)
+        scf.cf = cf
+        return cf
+
     @staticmethod
     def send_stop_signal(scf):
-        cf = scf.cf
-        mc = Commander(cf)
+        mc = CFUtil.get_commander(scf)
         mc.send_stop_setpoint()
         time.sleep(0.1)
 
+    @staticmethod
+    def send_stop_setpoint(scf):
+        """
+        Stop all motors without waiting, for loops sending setpoints every tick
+        """
+        CFUtil.get_commander(scf).send_stop_setpoint()
+
     @staticmethod
     def stop_all_logging(scf):
         print('Stopping all loggers for: ' + scf.cf.link_uri)
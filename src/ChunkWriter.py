@@ -0,0 +1,170 @@
+import os
+import json
+import glob
+import queue
+import threading
+import numpy as np
+
+
+class ChunkWriter:
+    """
+    Append only columnar storage of float64 rows, streamed to disk in fixed size chunks while logging.
+
+    Rows are written into a preallocated chunk buffer. Full chunks are handed to a background thread which saves them
+    as numbered .npy segments, so the logging thread never waits for the disk. Every segment is written to a temporary
+    file and renamed once complete, a crash loses at most the rows of the chunks not yet saved.
+
+    Files in the directory for a writer named 'state':
+        state.json          Header with column names and user supplied metadata
+        state.000000.npy    First chunk, array of size chunk_size-columns
+        state.000001.npy    ...
+
+    Example:
+        writer = ChunkWriter('output/flight', 'state', ['t', 'x', 'y'])
+        writer.append([0.01, 1.0, 2.0])
+        writer.close()
+        data, header = ChunkWriter.read('output/flight', 'state')
+    """
+
+    def __init__(self, directory, name, columns, chunk_size=1000, meta=None, buffers=3):
+        """
+        :param directory: Output directory, created if missing
+        :param name: Prefix of all files of this writer
+        :param columns: List of column names, defines the row width
+        :param chunk_size: Number of rows per saved segment
+        :param meta: Optional JSON serializable dict stored in the header
+        :param buffers: Number of preallocated chunk buffers. Appending blocks only if all of them wait for the disk
+        """
+        self.directory = directory
+        self.name = name
+        self.columns = list(columns)
+        self.meta = meta or {}
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.chunks = 0
+
+        os.makedirs(directory, exist_ok=True)
+        header = {'name': name, 'columns': self.columns, 'chunk_size': chunk_size, 'meta': self.meta}
+        ChunkWriter._save(os.path.join(directory, name + '.json'), lambda file: json.dump(header, file), mode='w')
+
+        self._free = queue.Queue()
+        for i in range(buffers):
+            self._free.put(np.empty((chunk_size, len(self.columns))))
+        self._buffer = self._free.get()
+        self._fill = 0
+
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(name='ChunkWriter ' + name, target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(self, row):
+        """
+        Append a single row
+        :param row: Sequence of floats with one value per column
+        """
+        self._check_open()
+        self._buffer[self._fill] = row
+        self._fill = self._fill + 1
+        self.rows = self.rows + 1
+        if self._fill == self.chunk_size:
+            self._submit()
+
+    def get_row(self):
+        """
+        Next row of the chunk buffer, filled in place by the caller and committed with commit_row()
+        :return: numpy array view with one element per column
+        """
+        self._check_open()
+        return self._buffer[self._fill]
+
+    def _check_open(self):
+        # Without the background thread full chunks are never saved and appending would wait for a free buffer forever
+        if self._thread is None:
+            raise ValueError('ChunkWriter ' + self.name + ' is closed')
+
+    def commit_row(self):
+        self._fill = self._fill + 1
+        self.rows = self.rows + 1
+        if self._fill == self.chunk_size:
+            self._submit()
+
+    def _submit(self):
+        self._pending.put((self.chunks, self._buffer, self._fill))
+        self.chunks = self.chunks + 1
+        self._buffer = self._free.get()
+        self._fill = 0
+
+    def _run(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                self._pending.task_done()
+                return
+            index, buffer, fill = item
+            try:
+                ChunkWriter._save(self._segment_path(index), lambda file: np.save(file, buffer[0:fill]))
+            except Exception as e:
+                print('Failed to write log chunk ' + self._segment_path(index) + ': ' + str(e))
+            self._free.put(buffer)
+            self._pending.task_done()
+
+    def _segment_path(self, index):
+        return os.path.join(self.directory, '%s.%06d.npy' % (self.name, index))
+
+    @staticmethod
+    def _save(path, write, mode='wb'):
+        """
+        Write file through a temporary file so readers never see a partially written file
+        """
+        tmp = path + '.tmp'
+        with open(tmp, mode) as file:
+            write(file)
+        os.replace(tmp, path)
+
+    def flush(self):
+        """
+        Save the partially filled chunk as a segment of its own and wait until everything is on disk
+        """
+        if self._thread is None:
+            return
+        if self._fill > 0:
+            self._submit()
+        self._pending.join()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self.flush()
+        self._pending.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def get_data(self):
+        """
+        All rows written so far, read back from disk
+        :return: numpy array of size rows-columns
+        """
+        self._pending.join()
+        data, header = ChunkWriter.read(self.directory, self.name)
+        return np.concatenate((data, self._buffer[0:self._fill]))
+
+    @staticmethod
+    def read(directory, name):
+        """
+        Read all saved segments of a writer, does not require the writer to be closed
+        :return: numpy array of size rows-columns, header dict
+        """
+        with open(os.path.join(directory, name + '.json')) as file:
+            header = json.load(file)
+        paths = sorted(glob.glob(os.path.join(glob.escape(directory), glob.escape(name) + '.[0-9]*.npy')))
+        chunks = [np.load(path) for path in paths]
+        if len(chunks) == 0:
+            return np.zeros((0, len(header['columns']))), header
+        return np.concatenate(chunks), header
+
+    @staticmethod
+    def list_names(directory):
+        """
+        :return: Names of all writers with a header in directory
+        """
+        return sorted(os.path.basename(path)[:-len('.json')] for path in glob.glob(os.path.join(directory, '*.json')))
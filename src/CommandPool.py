@@ -0,0 +1,152 @@
+from threading import Thread
+from concurrent.futures import Future
+import queue
+
+
+class CommandWorker(Thread):
+
+    _STOP = object()
+
+    def __init__(self, scf, maxsize=4):
+        """
+        Long lived thread executing commands for a single drone, fed by a bounded queue.
+        When the queue is full the oldest command is dropped, setpoints are only valid until the next one arrives.
+        :param scf: SyncCrazyflie passed as first argument to every command
+        :param maxsize: Maximum number of queued commands
+        """
+        Thread.__init__(self, name='CommandWorker ' + str(scf._link_uri), daemon=True)
+        self.scf = scf
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is CommandWorker._STOP:
+                return
+            func, args, future = item
+            if future is not None and not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = func(self.scf, *args)
+            except Exception as e:
+                if future is None:
+                    print('Exception in command for ' + str(self.scf._link_uri) + ': ' + str(e))
+                else:
+                    future.set_exception(e)
+            else:
+                if future is not None:
+                    future.set_result(result)
+
+    def put(self, item):
+        """
+        Non-blocking enqueue, drops the oldest queued command if the queue is full
+        """
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    dropped = self.queue.get_nowait()
+                except queue.Empty:
+                    continue
+                self.dropped = self.dropped + 1
+                if dropped is not CommandWorker._STOP and dropped[2] is not None:
+                    dropped[2].cancel()
+
+    def stop(self):
+        self.put(CommandWorker._STOP)
+        try:
+            self.join()
+        except RuntimeError as e:
+            print('Attempted join on unstarted CommandWorker')
+
+
+class CommandPool:
+
+    def __init__(self, maxsize=4):
+        """
+        Keeps one CommandWorker per connected drone, replacing the thread per call of Swarm.parallel.
+
+        Commands follow the same conventions as Swarm.parallel, the first argument of the function is the
+        SyncCrazyflie followed by the optional per drone arguments of args_dict.
+        :param maxsize: Queue size of each worker
+        """
+        self.maxsize = maxsize
+        self._workers = {}
+        # Commands for drones without a worker, ex: removed from the swarm or failed to connect
+        self.missing = 0
+
+    def start(self, cfs):
+        """
+        Start workers for all drones
+        :param cfs: dict{uri: SyncCrazyflie}
+        """
+        for uri, scf in cfs.items():
+            self.add(uri, scf)
+
+    def add(self, uri, scf):
+        if uri in self._workers:
+            return
+        worker = CommandWorker(scf, maxsize=self.maxsize)
+        worker.start()
+        self._workers[uri] = worker
+
+    def remove(self, uri):
+        """
+        Stop the worker of a drone leaving the swarm, later commands for it are skipped
+        """
+        worker = self._workers.pop(uri, None)
+        if worker is not None:
+            worker.stop()
+
+    def stop(self):
+        workers = self._workers
+        self._workers = {}
+        for uri in workers:
+            workers[uri].stop()
+
+    def is_running(self):
+        return len(self._workers) > 0
+
+    def submit(self, uri, func, args=(), future=False):
+        """
+        Enqueue command for a single drone without blocking
+        :param uri: Drone to execute command for
+        :param func: Function taking SyncCrazyflie as first argument
+        :param args: List of additional arguments
+        :param future: True to return a Future completed when the command has been executed
+        :return: Future or None, always None if the drone has no worker
+        """
+        worker = self._workers.get(uri)
+        if worker is None:
+            self.missing = self.missing + 1
+            return None
+        future = Future() if future else None
+        worker.put((func, args, future))
+        return future
+
+    def broadcast(self, func, args_dict=None, futures=False):
+        """
+        Enqueue command for all drones without blocking, same arguments as Swarm.parallel
+        :param func: Function taking SyncCrazyflie as first argument
+        :param args_dict: Optional dict{uri: [args]}, only drones in args_dict receive the command
+        :param futures: True to return completion futures
+        :return: dict{uri: Future} if futures is True, otherwise None
+        """
+        uris = self._workers.keys() if args_dict is None else args_dict.keys()
+        result = {}
+        for uri in uris:
+            if uri not in self._workers:
+                continue
+            args = () if args_dict is None else args_dict[uri]
+            result[uri] = self.submit(uri, func, args, future=futures)
+        return result if futures else None
+
+    def get_dropped(self):
+        """
+        Number of commands dropped because a worker could not keep up
+        :return: dict{uri: count}
+        """
+        return {uri: worker.dropped for uri, worker in self._workers.items()}
@@ -1,34 +1,93 @@
 from threading import Thread
+from collections import deque
 import time
+import numpy as np
+
+from PyUtil import Periodic, LoopStats
+from LatencyTracer import LatencyTracer
 
 
 class ControllerThread(Thread):
 
-    def __init__(self, swarm, controller_func=None, period_ms=20):
+    TRIGGER_TIMER = 'timer'
+    TRIGGER_FRESH = 'fresh'
+
+    def __init__(self, swarm, controller_func=None, period_ms=20, trigger=TRIGGER_TIMER, quorum_timeout_ms=None,
+                 output_func=None, latency_samples=1000):
         """
         Calls function on swarm at specified intervals when running.
         :param swarm: AsyncSwarm object to retrieve state from
         :param controller_func: Controller function to execute, passes swarm state as parameter
         :param period_ms: Period at which to call function, in milliseconds
+        :param trigger: TRIGGER_TIMER to run every period, TRIGGER_FRESH to run as soon as every drone has delivered
+        new state, or when quorum_timeout_ms has passed without a full set
+        :param quorum_timeout_ms: Maximum wait for a full set of fresh state in TRIGGER_FRESH mode, defaults to period_ms
+        :param output_func: Optional function without parameters called right after controller_func, ex. sending the
+        new setpoints to the swarm
+        :param latency_samples: Number of latency samples kept, see get_latency
         """
         Thread.__init__(self)
         self._swarm = swarm
         self._controller_func = controller_func
+        self._output_func = output_func
         self._period_ms = period_ms
+        self._trigger = trigger
+        self._quorum_timeout_ms = quorum_timeout_ms if quorum_timeout_ms is not None else period_ms
         self.running = True
         self.starttime = None
+        self.stats = LoopStats()
+        self.timeouts = 0
+        self.latency = deque(maxlen=latency_samples)
+        self._state = None
 
     def run(self):
         self.starttime = time.time()
+        if self._trigger == ControllerThread.TRIGGER_FRESH:
+            self._run_fresh()
+        else:
+            self._run_timer()
+
+    def _run_timer(self):
+        for cycle in Periodic(duration=None, period=self._period_ms/1000, overrun=Periodic.SKIP, stats=self.stats):
+            if not self.running or self._controller_func is None:
+                break
+            self._tick()
+
+    def _run_fresh(self):
         while self.running and self._controller_func is not None:
-            state = self._swarm.get_state()
-            self._controller_func(state)
-
-            # Sleep until next call interval happens
-            current_time = time.time()
-            d_time = (current_time - self.starttime)
-            sleeptime = (self._period_ms - ((d_time * 1000.0) % self._period_ms)) / 1000.0
-            time.sleep(sleeptime)
+            since = self._state.seq if self._state is not None else None
+            if not self._swarm.wait_for_state(since, timeout=self._quorum_timeout_ms/1000):
+                self.timeouts = self.timeouts + 1
+            if self.running:
+                self._tick()
+
+    def _tick(self):
+        # Stages are only timestamped while the swarm has a LatencyTracer, see AsyncSwarm.enable_tracing
+        tracer = getattr(self._swarm, 'tracer', None)
+        tick = tracer.begin() if tracer is not None else -1
+
+        # Snapshot buffer is reused between cycles, controllers do not keep references to the state
+        self._state = self._swarm.get_state(out=self._state)
+        if tracer is not None:
+            tracer.snapshot(tick)
+            tracer.mark(tick, LatencyTracer.COMPUTE_START)
+        self._controller_func(self._state)
+        if tracer is not None:
+            tracer.mark(tick, LatencyTracer.COMPUTE_END)
+            tracer.commit(tick)
+        if self._output_func is not None:
+            self._output_func()
+
+        # Sensing to actuation latency, from arrival of the newest sample used
+        if len(self._state.arrival) > 0:
+            self.latency.append(time.time() - np.max(self._state.arrival))
+
+    def get_latency(self):
+        """
+        Latency between arrival of the newest state sample and the end of each tick, oldest tick first
+        :return: numpy array of latencies in seconds
+        """
+        return np.array(self.latency)
 
     def stop(self):
         self.running = False
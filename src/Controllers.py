@@ -4,154 +4,158 @@ Library of available swarm controllers
 Each controller is defined by single function to be passed to the controller thread
 that takes the state and returns a velocity setpoint as result.
 
-ExampleController:
-
-    def __init__(self):
-        self.ref = [0 0 0]
+ExampleController(Controller):
 
     def compute(self, state):
-        output = {}
-        for uri in state:
-            x_error = self.ref[0] - state[uri][0]
-            y_error = self.ref[1] - state[uri][1]
-            z_error = self.ref[2] - state[uri][2]
-            output[uri] = (x_error, y_error, z_error)
-
-        return output
+        uris, states = CFUtil.state_dict_to_array(state)
+        return self._set_output(uris, self.ref - states[:, 0:3])
 
 """
 import numpy as np
-from copy import deepcopy as copy
+from collections import OrderedDict
 import math
 from Formation import Formation
+from SpatialGrid import SpatialGrid
 
 from CFUtil import CFUtil
 import PyUtil
 
 
-class FlockingController:
-    # TODO Make this whole thing thread safe, multiple holes in implementation
+def neighbour_pairs(positions, grid=None):
+    """
+    Index pairs of interacting drones
+    :param positions: numpy array of size n-3
+    :param grid: SpatialGrid limiting interactions to its cutoff radius, None for all pairs
+    :return: index arrays i, j with i < j
+    """
+    if grid is None:
+        return np.triu_indices(len(positions), 1)
+    grid.rebuild(positions)
+    return grid.pairs()
+
+
+class ControlOutput:
+    """
+    Control signal of one controller step, shared with the send path and logging without copying.
 
-    def __init__(self, ref=(0, 0, 1), k=1, weight=(1, 0, 0.1, 0.05)):
+    The arrays are read-only and a new ControlOutput is created every step, so readers on other threads always see a
+    complete step. Behaves like the previous dict{uri: np.array[vx, vy, vz]} output, ex: u = output[URI1].
+    """
+    KEYS = ('vx', 'vy', 'vz')
+
+    def __init__(self, uris, array, active, index, ignore):
         """
-        Weighed swarm controller balancing relative positions and velocities of drones
-        :param ref: List of swarm center reference point (x, y, z)
-        :param k: Overall controller gain
-        :param weight: List of weighted gains. (pos_ref, vel_ref, pos_rel, vel_rel)
+        :param uris: Tuple of uris, one per row of array
+        :param array: Read-only numpy array of size n-3 containing [vx, vy, vz] for each drone
+        :param active: Read-only boolean numpy array, False for drones on the ignore list
+        :param index: dict{uri: row}
+        :param ignore: frozenset of ignored uris
         """
-        #weight = weight/np.linalg.norm(weight)
-        self.r_ref = k*weight[0]
-        self.rdot_ref = k*weight[1]
-        self.r_rel = k*weight[2]
-        self.rdot_rel = k*weight[3]
+        self.uris = uris
+        self.array = array
+        self.active = active
+        self.index = index
+        self.ignore = ignore
 
-        self.angle_cap = 15 * math.pi / 180
-        self.angle_k = 0.2
-        self.angle_k = 0  # Nullifies rejection calculations
+    def __getitem__(self, uri):
+        return self.array[self.index[uri]]
 
-        self.distance_offset = 0
-        self.distance_minimum = 0.01
+    def __contains__(self, uri):
+        return uri in self.index
 
-        self.ref = np.array(ref, dtype=float)
-        self.output = {}
+    def __iter__(self):
+        return iter(self.uris)
+
+    def __len__(self):
+        return len(self.uris)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def keys(self):
+        return list(self.uris)
+
+    def values(self):
+        return list(self.array)
 
-        self._ignore_list = []
+    def items(self):
+        return list(zip(self.uris, self.array))
+
+
+class Controller:
+    """
+    Base class of the swarm controllers, handles references, the ignore list and the control output.
+
+    compute(state) is implemented by every controller and publishes its result with _set_output.
+    """
+
+    def __init__(self, ref=(0, 0, 1)):
+        """
+        :param ref: List of swarm center reference point (x, y, z)
+        """
+        self.ref = np.array(ref, dtype=float)
+        self._ignore = frozenset()
+        empty = np.zeros((0, 3))
+        empty.setflags(write=False)
+        self._output = ControlOutput((), empty, np.zeros(0, dtype=bool), {}, self._ignore)
 
     def compute(self, state):
         """
-        Compute control signal based on supplied swarm state. Stores output in self.output
-        :param state: dict{URI: dict{kalman.stateX: x, ..., kalman.statePZ: vz}}
-        :return: Control signal, dict{URI: np.array[u_vx, u_vy, u_vz]}
-        """
-
-        uris = list(state.keys())
-        # Convert individual state information from dict to numpy vector
-        state = CFUtil.state_dict_to_numpy_matrix(state)
-        count = len(uris)
-
-        #state[CFUtil.URI1][1] = state[CFUtil.URI1][1] - 0.3
-
-        # Set initial outputs to 0
-        output = {}
-        for uri in uris:
-            output[uri] = np.zeros(3)
-
-        # Loop all active drones
-        for i in range(count):
-            uri = uris[i]
-            error_ref = self.ref[0:3] - state[uri][0:3]
-            output[uri] = output[uri] + error_ref*self.r_ref
-
-            # Loop unseen drones for relative avoidance
-            for j in range(i+1, count):
-
-                uri2 = uris[j]
-                _sum = np.zeros(3)
-
-                error_rel = state[uri][:] - state[uri2][:]
-                error_position = error_rel[0:3]
-                error_velocity = -error_rel[3:6]
-
-                distance = np.linalg.norm(error_position)
-                if distance < self.distance_minimum:  # Fail safe for tiny distances (crashes)
-                    distance = self.distance_minimum
-
-                # Relative positions and velocities
-                # if uri is CFUtil.URI1 or uri2 is CFUtil.URI1:
-                #     sum_pos = error_position * self.r_rel
-                # else:
-                #     sum_pos = error_position * self.r_rel
-
-                sum_pos = error_position * self.r_rel / (distance - self.distance_offset)
-                sum_vel = error_velocity * self.rdot_rel
-
-                # "Shadowing" protection
-                angle, rej_1, rej_2 = PyUtil.compute_rejections(state[uri][0:3] - self.ref, state[uri2][0:3] - self.ref)
-                angle_cap = self.angle_cap
-                angle_k = self.angle_k
-                if angle < angle_cap:
-                    angle_ratio = (angle_cap - angle)/angle_cap
-                    angle_ampl = angle_k*min([1, angle_ratio/(distance - self.distance_offset)])
-                    rej_1 = rej_1 * angle_ampl
-                    rej_2 = rej_2 * angle_ampl
-                else:
-                    rej_1 = rej_1 * 0
-                    rej_2 = rej_2 * 0
-
-                # Sum all components
-                _sum = _sum + sum_pos + sum_vel
-                _sum = _sum / (distance - self.distance_offset)
-
-                output[uri] = output[uri] + _sum + rej_1
-                output[uri2] = output[uri2] - _sum + rej_2
-
-        self.output = output
-        return output
+        Compute control signal based on supplied swarm state
+        :param state: SwarmState or dict{URI: dict{kalman.stateX: x, ..., kalman.statePZ: vz}}
+        :return: ControlOutput
+        """
+        raise NotImplementedError
+
+    def _set_output(self, uris, u):
+        """
+        Publish control signal, u is made read-only and must not be modified afterwards
+        :param uris: uris, one per row of u
+        :param u: numpy array of size n-3
+        :return: ControlOutput
+        """
+        uris = tuple(uris)
+        previous = self._output
+        if previous.uris == uris and previous.ignore is self._ignore:
+            index, active = previous.index, previous.active
+        else:
+            index = {uri: row for row, uri in enumerate(uris)}
+            active = np.array([uri not in self._ignore for uri in uris], dtype=bool)
+            active.setflags(write=False)
+        u.setflags(write=False)
+        self._output = ControlOutput(uris, u, active, index, self._ignore)
+        return self._output
+
+    @property
+    def output(self):
+        return self._output
 
     def get_u(self):
-        return copy(self.output)
+        """
+        :return: ControlOutput of the latest step, no copy is made
+        """
+        return self._output
 
     def get_u_list(self):
         """
         Retrieves references in nested lists. Required for swarm.parallel and swarm.sequence
-        :return: dict{uri: [[vx, vy, vz]]}
+        :return: dict{uri: [[vx, vy, vz]]}, ignored drones get an additional True
         """
-        # TODO Move into get_u?
-        u = self.get_u()
-        for uri in u:
-            u[uri] = [u[uri]]
-
-        for uri in self._ignore_list:
-            if uri in u:
-                u[uri].append(True)
+        output = self._output
+        return {uri: [u] if active else [u, True] for uri, u, active in zip(output.uris, output.array, output.active)}
 
-        return u
+    def get_u_batch(self):
+        """
+        Retrieves control signal as a single matrix, used for sending all setpoints in one pass
+        :return: tuple of uris, read-only numpy array of size n-3 with rows ordered as uris, frozenset of ignored uris
+        """
+        output = self._output
+        return output.uris, output.array, output.ignore
 
     def set_ref(self, new_ref):
         """
         Update swarm center reference to new_ref
         :param new_ref: list[x, y, z]
-        :return:
         """
         self.ref = np.array(new_ref, dtype=float)
 
@@ -165,36 +169,120 @@ class FlockingController:
     def reset(self):
         pass
 
+    def get_ignore(self):
+        """
+        :return: frozenset of ignored uris
+        """
+        return self._ignore
+
     def add_ignore(self, uri):
         """
         Adds drone uri to the ignore list
-        :param uri: list[uri]
+        :param uri: uri or list[uri]
         """
-        if isinstance(uri, list):
-            for i in uri:
-                if i not in self._ignore_list:
-                    self._ignore_list.append(i)
-        else:
-            if uri not in self._ignore_list:
-                self._ignore_list.append(uri)
+        self._ignore = self._ignore.union(uri if isinstance(uri, list) else [uri])
 
     def remove_ignore(self, uri):
         """
         Removes drone uris from the ignore list
-        :param uri: list[uri]
+        :param uri: uri or list[uri]
         """
-        if isinstance(uri, list):
-            for i in uri:
-                if i in self._ignore_list:
-                    self._ignore_list.remove(i)
-        else:
-            if uri in self._ignore_list:
-                self._ignore_list.remove(uri)
+        self._ignore = self._ignore.difference(uri if isinstance(uri, list) else [uri])
+
+
+class FlockingController(Controller):
+
+    def __init__(self, ref=(0, 0, 1), k=1, weight=(1, 0, 0.1, 0.05), cutoff=None):
+        """
+        Weighed swarm controller balancing relative positions and velocities of drones
+        :param ref: List of swarm center reference point (x, y, z)
+        :param k: Overall controller gain
+        :param weight: List of weighted gains. (pos_ref, vel_ref, pos_rel, vel_rel)
+        :param cutoff: Optional interaction radius in meters, drones further apart than this do not affect each other
+        """
+        super().__init__(ref)
+        #weight = weight/np.linalg.norm(weight)
+        self.r_ref = k*weight[0]
+        self.rdot_ref = k*weight[1]
+        self.r_rel = k*weight[2]
+        self.rdot_rel = k*weight[3]
+
+        self.angle_cap = 15 * math.pi / 180
+        self.angle_k = 0.2
+        self.angle_k = 0  # Nullifies rejection calculations
+
+        self.distance_offset = 0
+        self.distance_minimum = 0.01
+
+        self._grid = SpatialGrid(cutoff) if cutoff is not None else None
+
+    def compute(self, state):
+        """
+        Compute control signal based on supplied swarm state. Stores output in self.output
+        :param state: SwarmState or dict{URI: dict{kalman.stateX: x, ..., kalman.statePZ: vz}}
+        :return: Control signal as ControlOutput, ex: u = output[URI1]
+        """
+
+        # Convert swarm state from dict to a single numpy matrix
+        uris, states = CFUtil.state_dict_to_array(state)
+        return self._set_output(uris, self.compute_array(states))
+
+    def compute_array(self, states):
+        """
+        Compute control signal for the whole swarm at once using broadcast array operations
+        :param states: numpy array of size n-6, one row [x, y, z, vx, vy, vz] per drone
+        :return: Control signal as numpy array of size n-3, rows ordered as in states
+        """
+        # Control signal from swarm center reference
+        output = (self.ref[0:3] - states[:, 0:3])*self.r_ref
+
+        # Drone pairs (i < j) for relative avoidance, all pairs or only neighbours within cutoff
+        i, j = neighbour_pairs(states[:, 0:3], self._grid)
+        if len(i) == 0:
+            return output
+
+        error_rel = states[i] - states[j]
+        error_position = error_rel[:, 0:3]
+        error_velocity = -error_rel[:, 3:6]
+
+        # Fail safe for tiny distances (crashes)
+        distance = np.maximum(np.linalg.norm(error_position, axis=1), self.distance_minimum)
+        distance = (distance - self.distance_offset)[:, np.newaxis]
+
+        # Relative positions and velocities
+        sum_pos = error_position * self.r_rel / distance
+        sum_vel = error_velocity * self.rdot_rel
+        _sum = (sum_pos + sum_vel) / distance
+
+        # "Shadowing" protection
+        angle, rej_1, rej_2 = PyUtil.compute_rejections_array(states[i, 0:3] - self.ref, states[j, 0:3] - self.ref)
+        angle_ratio = (self.angle_cap - angle)/self.angle_cap
+        angle_ampl = self.angle_k*np.minimum(1, angle_ratio/distance[:, 0])
+        angle_ampl = np.where(angle < self.angle_cap, angle_ampl, 0)[:, np.newaxis]
 
+        # Sum all components onto both drones of each pair
+        np.add.at(output, i, _sum + rej_1*angle_ampl)
+        np.add.at(output, j, -_sum + rej_2*angle_ampl)
 
-class DistanceController:
+        return output
+
+
+class DistanceController(Controller):
 
-    def __init__(self, ref=(0, 0, 1), period_ms=50):
+    # Number of formation layouts kept, see _calc_adjacency
+    LAYOUT_CACHE_SIZE = 32
+
+    def __init__(self, ref=(0, 0, 1), period_ms=50, cutoff=None, formation=Formation.TETRAHEDRON, assign=True):
+        """
+        Formation controller keeping predefined distances between all drones in the swarm
+        :param ref: List of swarm center reference point (x, y, z)
+        :param period_ms: Controller period, used for integral and derivative parts
+        :param cutoff: Optional interaction radius in meters, drones further apart than this do not affect each other
+        :param formation: Formation option, see Formation.gen_formation
+        :param assign: True to give drones the formation slots closest to their positions, otherwise slots are given in
+        state order
+        """
+        super().__init__(ref)
         self.kp = 1.2
         self.ki = 0
         self.kd = 0.1
@@ -204,8 +292,8 @@ class DistanceController:
         self.k_disturb = 0.1
 
         self.dist = 0.5     # defined distance between each drone.
-        self.ref = np.array(ref, dtype=float)
-        self.output = {}
+        self.formation = formation
+        self.assign = assign
 
         self.integ = 0
         self.deriv = 0
@@ -213,58 +301,110 @@ class DistanceController:
         self.prev_swarm_e = 0
 
         self.adj = None
-        self._ignore_list = []
+        self.slots = None
+        self._layout_key = None
+        self._layouts = OrderedDict()
+        self._grid = SpatialGrid(cutoff) if cutoff is not None else None
 
         self.k1 = -0.3
         self.k2 = 0.9
         self.k3 = 0
 
     # Generate the adjacency matrix, defining the swarm formation
-    def _calc_adjacency(self, uris, count):
+    def _calc_adjacency(self, uris, positions=None):
 
         """Generate formation
-        :Option: Parameter to set formation:
+        :Option: Parameter to set formation, self.formation, any of the formations of Formation:
         0: Tetrahedron
         1: Circle
         2: Line
+        3: Grid
+        4: Sphere
+        5: Lattice
+
+        Every drone is given a slot in the formation, self.slots, and self.adj holds the distances between all slots.
+        Layouts are cached by formation option, distance and the ordered uris of the active drones, evicting the least
+        recently used. When drones leave or join, the remaining drones keep their slots and only the rows and columns
+        of joining drones are computed.
+        :param uris: Active drones, defines the order of slots and adj
+        :param positions: Optional numpy array of size n-3 with drone positions, used to assign the closest slots
         """
+        key = (self.formation, self.dist, tuple(uris))
+        if key in self._layouts:
+            self._layouts.move_to_end(key)
+        else:
+            layout = None
+            if self._layout_key is not None and self._layout_key[0:2] == key[0:2]:
+                layout = self._update_layout(uris, positions)
+            if layout is None:
+                layout = self._build_layout(uris, positions)
+            self._layouts[key] = layout
+            if len(self._layouts) > DistanceController.LAYOUT_CACHE_SIZE:
+                self._layouts.popitem(last=False)
+
+        self.slots, self.adj = self._layouts[key]
+        self._layout_key = key
+
+    def _gen_slots(self, count):
+        formation = np.array(Formation.gen_formation(dist=self.dist, drone_count=count, option=self.formation),
+                             dtype=float).reshape(-1, 3)
+        if len(formation) < count:
+            raise ValueError('Formation option ' + str(self.formation) + ' supports at most ' + str(len(formation)) +
+                             ' drones, got ' + str(count))
+        return formation
+
+    def _build_layout(self, uris, positions=None):
+        slots = self._gen_slots(len(uris))[0:len(uris)]
+        if self.assign and positions is not None:
+            slots = slots[Formation.assign(positions, slots)]
+        return slots, DistanceController._distances(slots, slots)
+
+    def _update_layout(self, uris, positions=None):
+        """
+        Layout for uris based on the current layout, None if the drones joining can not be placed
+        """
+        old_index = {uri: row for row, uri in enumerate(self._layout_key[2])}
+        kept = [row for row, uri in enumerate(uris) if uri in old_index]
+        joined = [row for row, uri in enumerate(uris) if uri not in old_index]
+        if len(kept) == 0:
+            return None
+        old = [old_index[uris[row]] for row in kept]
+
+        slots = np.empty((len(uris), 3))
+        slots[kept] = self.slots[old]
+        adj = np.empty((len(uris), len(uris)))
+        adj[np.ix_(kept, kept)] = self.adj[np.ix_(old, old)]
+
+        if len(joined) > 0:
+            # Place joining drones in the first formation slots not taken by any remaining drone
+            formation = self._gen_slots(len(uris))
+            taken = np.any(DistanceController._distances(formation, slots[kept]) < 1e-6, axis=1)
+            free = formation[~taken]
+            if len(free) < len(joined):
+                return None
+            if self.assign and positions is not None:
+                # Formation placed where the remaining drones are
+                offset = positions[kept].mean(axis=0) - slots[kept].mean(axis=0)
+                slots[joined] = free[Formation.assign(positions[joined], free + offset, center=False)]
+            else:
+                slots[joined] = free[0:len(joined)]
+            distances = DistanceController._distances(slots[joined], slots)
+            adj[joined, :] = distances
+            adj[:, joined] = distances.T
+
+        return slots, adj
+
+    @staticmethod
+    def _distances(a, b):
+        """
+        :return: Matrix of distances between all rows of a and all rows of b
+        """
+        return np.linalg.norm(a[:, np.newaxis, :] - b[np.newaxis, :, :], axis=2)
 
-        # Remove ignored drone from uris list
-        # for uri in uris:
-        #     if uri in self._ignore_list:
-        #         uris.remove(uri)
-
-        formation_list = Formation.gen_formation(dist=self.dist, drone_count=count, option=0)
-
-        formation = {}
-        for i in range(count):
-            uri = uris[i]
-            formation[uri] = formation_list[i]
-
-        self.adj = np.zeros((count, count))
-
-        # Create adjacency matrix, defining the distance between each drone
-        for i in range(count):
-            uri1 = uris[i]
-            for j in range(count):
-                uri2 = uris[j]
-                self.adj[i][j] = math.sqrt((formation[uri1][0] - formation[uri2][0]) ** 2 +
-                                           (formation[uri1][1] - formation[uri2][1]) ** 2 +
-                                           (formation[uri1][2] - formation[uri2][2]) ** 2)
-
-    def _update_params(self, states, uris, count):
-
-        swarm_pos = np.zeros(3, dtype=float)
-
-        # Remove detached drone from swarm calculation
-        # for uri in uris:
-        #     if uri in self._ignore_list:
-        #         uris.remove(uri)
+    def _update_params(self, positions, count):
 
         # Center position of swarm
-        for i in range(count):
-            uri = uris[i]
-            swarm_pos = swarm_pos + states[uri][0:3]/count
+        swarm_pos = np.sum(positions, axis=0)/count
 
         # Swarm position error
         self.swarm_e = self.ref - swarm_pos
@@ -274,77 +414,70 @@ class DistanceController:
         self.deriv = (self.swarm_e-self.prev_swarm_e)*self.kd/self.h
 
     def compute(self, states):
-        uris = list(states.keys())
-
-        # Save number of drones of the actual swarm, not including disturbances.
-        count = self.get_drone_count(states)
-        uris_disturbance = list(set(self._ignore_list))
-
-        # Create numpy matrices out of the state dictionaries
-        states = CFUtil.state_dict_to_numpy_matrix(states)
-
-        # Initialize velocity vector
-        pdot = {}
-        for uri in uris:
-            pdot[uri] = np.zeros(3, dtype=float)
-
-        # Save active drones separately
-        uris_active = list(set(uris) - set(self._ignore_list))
-
-        # Calculate adjacency matrix if empty or if drone count changes.
-        if self.adj is None or count != len(self.adj):
-            self._calc_adjacency(copy(uris_active), count)
-
-        self._update_params(states, copy(uris_active), count)
-
-        # Loop over uris and states to generate velocity vector
-        for i in range(count):
-            uri1 = uris_active[i]
-
-            for j in range(i+1, count):
-                uri2 = uris_active[j]
-                # Normalize distance vector, initialize at 5 cm to avoid dividing by zero
-                pos_norm = max(np.linalg.norm(states[uri1][0:3]-states[uri2][0:3]), 0.05)
-
-                # Precalculate
-                pos_norm2 = (pos_norm-self.adj[i][j])/pos_norm
-                _sum = (states[uri1][0:3] - states[uri2][0:3])*pos_norm2*self.kp_swarm
-
-                pdot[uri1][0:3] = pdot[uri1][0:3] - _sum
-                pdot[uri2][0:3] = pdot[uri2][0:3] + _sum
-
-            # Control signal from trajectory ref
-            pdot[uri1][0:3] = pdot[uri1][0:3] + self.kp * self.swarm_e + self.integ + self.deriv
-
-            # Disturbance/detached drone contribution
-            for k in range(len(uris_disturbance)):
-                uri3 = uris_disturbance[k]
-
-                # Calculate distance between drone and disturbance, get direction on where to go
-                disturbance_dist = states[uri1][0:3] - states[uri3][0:3]
-                direction, magn = self.calculate_disturbance(disturbance_dist)
-
-                pdot[uri1][0:3] = pdot[uri1][0:3] + self.k_disturb*magn*direction
+        # Create numpy matrix out of the state dictionaries, rows ordered as uris
+        uris, states = CFUtil.state_dict_to_array(states)
+        rows = {uri: row for row, uri in enumerate(uris)}
+
+        # Save active drones separately, in state order. Disturbances are not part of the actual swarm.
+        ignore = self._ignore
+        uris_active = [uri for uri in uris if uri not in ignore]
+        uris_disturbance = [uri for uri in uris if uri in ignore]
+        count = len(uris_active)
+        if count == 0:
+            return self._set_output(uris, np.zeros((len(uris), 3), dtype=float))
+        active = [rows[uri] for uri in uris_active]
+        positions = states[active, 0:3]
+
+        # Look up formation if the set or order of active drones changes
+        if self._layout_key != (self.formation, self.dist, tuple(uris_active)):
+            self._calc_adjacency(uris_active, positions)
+
+        self._update_params(positions, count)
+
+        # Formation keeping between active drone pairs
+        i, j = neighbour_pairs(positions, self._grid)
+        error_position = positions[i] - positions[j]
+
+        # Normalize distance vector, initialize at 5 cm to avoid dividing by zero
+        pos_norm = np.maximum(np.linalg.norm(error_position, axis=1), 0.05)
+        pos_norm2 = (pos_norm - self.adj[i, j])/pos_norm
+        _sum = error_position*(pos_norm2*self.kp_swarm)[:, np.newaxis]
+
+        u = np.zeros((count, 3), dtype=float)
+        np.add.at(u, i, -_sum)
+        np.add.at(u, j, _sum)
+
+        # Control signal from trajectory ref
+        u = u + self.kp * self.swarm_e + self.integ + self.deriv
+
+        # Disturbance/detached drone contribution, distance vectors between all active drones and all disturbances
+        if len(uris_disturbance) > 0 and count > 0:
+            disturbances = states[[rows[uri] for uri in uris_disturbance], 0:3]
+            disturbance_dist = positions[:, np.newaxis, :] - disturbances[np.newaxis, :, :]
+            direction, magn = self.calculate_disturbance(disturbance_dist)
+            u = u + self.k_disturb*np.einsum('ij,ijk->ik', magn, direction)
+
+        # Velocity vector for all drones, detached drones get zero
+        u_all = np.zeros((len(uris), 3), dtype=float)
+        u_all[active] = u
 
         self.prev_swarm_e = self.swarm_e
-        self.output = pdot
-
-        return pdot
+        return self._set_output(uris, u_all)
 
     def calculate_disturbance(self, disturbance_dist):
         """
         Calculates the impact the disturbance has on each drone, following a non-linear curve with cut-off
-        :param disturbance_dist: Array containing distance vector between drone and disturbance
-        :return: direction, magn: direction for drone to take, magn of direction
+        :param disturbance_dist: Array containing distance vector between drone and disturbance, or numpy array of
+        size ...-3 with any number of distance vectors
+        :return: direction, magn: direction for drone to take, magn of direction. One magn per distance vector
         """
-        distance = np.linalg.norm(disturbance_dist)
+        disturbance_dist = np.asarray(disturbance_dist, dtype=float)
 
         # Set distance to 5 cm to avoid dividing by zero
-        if distance < 0.05:
-            distance = 0.05
-        direction = disturbance_dist/distance
+        distance = np.maximum(np.linalg.norm(disturbance_dist, axis=-1), 0.05)
+        direction = disturbance_dist/distance[..., np.newaxis]
 
-        magn = max(0, self.k1*distance + self.k2/distance + self.k3)
+        magn = np.maximum(0, self.k1*distance + self.k2/distance + self.k3)
 
         return direction, magn
 
@@ -354,67 +487,10 @@ class DistanceController:
         :param states:
         :return:
         """
-        return len(list(states.keys())) - len(self._ignore_list)
-
-    def get_u(self):
-        return copy(self.output)
-
-    def get_u_list(self):
-        """
-        Retrieves references in nested lists. Required for swarm.parallel and swarm.sequence
-        :return: dict{uri: [[vx, vy, vz]]}
-        """
-        # TODO Move into get_u?
-        u = self.get_u()
-        for uri in u:
-            u[uri] = [u[uri]]
-
-        for uri in self._ignore_list:
-            if uri in u:
-                u[uri].append(True)
-
-        return u
-
-    def set_ref(self, new_ref):
-        self.ref = np.array(new_ref, dtype=float)
-
-    def get_ref(self):
-        """
-        For logging purposes
-        :return:
-        """
-        return {'flock': list(self.ref)}
+        return len([uri for uri in states if uri not in self._ignore])
 
     def reset(self):
         self.integ = 0
         self.deriv = 0
         self.swarm_e = np.zeros(3, dtype=float)
         self.prev_swarm_e = np.zeros(3, dtype=float)
-
-    def add_ignore(self, uri):
-        """
-        Adds drone uri to the ignore list
-        :param uri: list[uri]
-        """
-        if isinstance(uri, list):
-            for i in uri:
-                if i not in self._ignore_list:
-                    self._ignore_list.append(i)
-        else:
-            if uri not in self._ignore_list:
-                self._ignore_list.append(uri)
-
-    def remove_ignore(self, uri):
-        """
-        Removes drone uris from the ignore list
-        :param uri: list[uri]
-        """
-        if isinstance(uri, list):
-            for i in uri:
-                if i in self._ignore_list:
-                    self._ignore_list.remove(i)
-        else:
-            if uri in self._ignore_list:
-                self._ignore_list.remove(uri)
-
-
@@ -0,0 +1,236 @@
+import os
+import json
+import struct
+import threading
+import time
+import numpy as np
+
+
+class FlightRecorder:
+    """
+    Memory mapped flight recorder storing samples as fixed width records in a preallocated file.
+
+    Writing a sample is a copy into the mapped file, no system calls are made on the control loop. The operating
+    system writes the pages back on its own, so everything recorded survives if the process is killed. flush() also
+    protects against losing the machine.
+
+    File layout:
+        Header      HEADER_SIZE bytes. Magic, record geometry and the channel index as one JSON line per channel.
+                    Lines are only appended and the index length is updated last, so readers always see whole lines.
+        Records     capacity records of dtype get_dtype(width):
+                    commit  Sample sequence number, written last. Zero for unused records.
+                    channel Channel id from the index
+                    part    Samples wider than the record are split over consecutive records, numbered from 0
+                    time    time.time() of the sample
+                    data    width float64 values, unused values are NaN
+
+    Channels are named streams with a fixed number of values per sample, ex: the swarm state, controller outputs and
+    references. Events are channels named 'event:<name>' created on first use.
+
+    Example:
+        recorder = FlightRecorder('output/flight.rec')
+        state = recorder.add_channel('state', ['x', 'y', 'z'])
+        recorder.write(state, (0, 0, 1))
+        recorder.event('take_off')
+        recorder.close()
+        times, data = FlightReader('output/flight.rec').read('state')
+    """
+
+    MAGIC = b'CFREC001'
+    HEADER_SIZE = 1 << 16
+    # Magic, record width, capacity, index length
+    HEADER_FORMAT = '<8sIQI'
+    INDEX_OFFSET = 64
+
+    def __init__(self, path, capacity=200000, width=32, wrap=False):
+        """
+        Create recorder file, existing files are overwritten. The file is sparse, pages are allocated when written.
+        :param path: File path
+        :param capacity: Number of records
+        :param width: Number of float64 values per record
+        :param wrap: True to overwrite the oldest records when full, otherwise new samples are dropped
+        """
+        self.path = path
+        self.capacity = capacity
+        self.width = width
+        self.wrap = wrap
+        self.channels = {}
+        self.dropped = 0
+
+        self._dtype = FlightRecorder.get_dtype(width)
+        self._next = 0
+        self._seq = 0
+        self._index = b''
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'wb') as file:
+            file.truncate(FlightRecorder.HEADER_SIZE + capacity*self._dtype.itemsize)
+
+        self._header = np.memmap(path, dtype=np.uint8, mode='r+', shape=(FlightRecorder.HEADER_SIZE,))
+        self.records = np.memmap(path, dtype=self._dtype, mode='r+', offset=FlightRecorder.HEADER_SIZE,
+                                 shape=(capacity,))
+        self._write_header()
+
+    @staticmethod
+    def get_dtype(width):
+        return np.dtype([('commit', '<u8'), ('channel', '<u4'), ('part', '<u4'), ('time', '<f8'),
+                         ('data', '<f8', (width,))])
+
+    def _write_header(self):
+        header = struct.pack(FlightRecorder.HEADER_FORMAT, FlightRecorder.MAGIC, self.width, self.capacity,
+                             len(self._index))
+        self._header[0:len(header)] = np.frombuffer(header, dtype=np.uint8)
+
+    def add_channel(self, name, columns):
+        """
+        Register a named stream of samples
+        :param name: Unique channel name
+        :param columns: Names of the values of each sample
+        :return: Channel id passed to write()
+        """
+        with self._lock:
+            if name in self.channels:
+                return self.channels[name]
+            channel = len(self.channels)
+            line = json.dumps({'id': channel, 'name': name, 'columns': [str(column) for column in columns]}) + '\n'
+            line = line.encode()
+            start = FlightRecorder.INDEX_OFFSET + len(self._index)
+            if start + len(line) > FlightRecorder.HEADER_SIZE:
+                raise ValueError('Flight recorder index full, can not add channel ' + name)
+
+            # Index line first, then its length
+            self._header[start:start + len(line)] = np.frombuffer(line, dtype=np.uint8)
+            self._index = self._index + line
+            self._write_header()
+            self.channels[name] = channel
+            return channel
+
+    def write(self, channel, values, timestamp=None):
+        """
+        Record one sample without blocking on the disk
+        :param channel: Channel id from add_channel
+        :param values: Sequence of floats, one per column of the channel
+        :param timestamp: Sample time, defaults to time.time()
+        :return: False if the sample was dropped because the recorder is full
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        values = np.asarray(values, dtype=float).ravel()
+        parts = max(1, -(-len(values) // self.width))
+
+        with self._lock:
+            if not self.wrap and self._next + parts > self.capacity:
+                self.dropped = self.dropped + 1
+                return False
+            self._seq = self._seq + 1
+            for part in range(parts):
+                index = self._next % self.capacity
+                self._next = self._next + 1
+                record = self.records[index:index + 1]
+
+                # Invalidate before overwriting, commit after all other fields are written
+                record['commit'] = 0
+                record['channel'] = channel
+                record['part'] = part
+                record['time'] = timestamp
+                chunk = values[part*self.width:(part + 1)*self.width]
+                data = record['data'][0]
+                data[0:len(chunk)] = chunk
+                data[len(chunk):] = np.nan
+                record['commit'] = self._seq
+            return True
+
+    def event(self, name, values=()):
+        """
+        Record an event, ex: start of a sequence
+        :param name: Event name, a channel 'event:<name>' is created on first use
+        :param values: Optional values describing the event, same length for every event of the same name
+        """
+        values = list(values)
+        channel = self.channels.get('event:' + name)
+        if channel is None:
+            channel = self.add_channel('event:' + name, [str(i) for i in range(len(values))])
+        return self.write(channel, values)
+
+    def flush(self):
+        """
+        Write all records to disk, protects against power loss. Not needed if only the process dies.
+        """
+        self._header.flush()
+        self.records.flush()
+
+    def close(self):
+        self.flush()
+
+
+class FlightReader:
+    """
+    Zero-copy reader of a FlightRecorder file, may be opened while the recorder is still writing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.refresh()
+
+    def refresh(self):
+        """
+        Map the file again and reload the channel index, picks up channels added after opening
+        """
+        header = np.memmap(self.path, dtype=np.uint8, mode='r', shape=(FlightRecorder.HEADER_SIZE,))
+        magic, width, capacity, index_length = struct.unpack_from(FlightRecorder.HEADER_FORMAT, header.tobytes())
+        if magic != FlightRecorder.MAGIC:
+            raise ValueError(self.path + ' is not a flight recorder file')
+
+        index = header[FlightRecorder.INDEX_OFFSET:FlightRecorder.INDEX_OFFSET + index_length].tobytes().decode()
+        self.channels = {}
+        for line in index.splitlines():
+            channel = json.loads(line)
+            self.channels[channel['name']] = channel
+
+        self.width = width
+        self.capacity = capacity
+        self.records = np.memmap(self.path, dtype=FlightRecorder.get_dtype(width), mode='r',
+                                 offset=FlightRecorder.HEADER_SIZE, shape=(capacity,))
+
+    def get_names(self):
+        return list(self.channels.keys())
+
+    def get_events(self):
+        """
+        :return: list of (time, event name, values) ordered by time
+        """
+        events = []
+        for name in self.get_names():
+            if name.startswith('event:'):
+                times, data = self.read(name)
+                events.extend((t, name[len('event:'):], list(values)) for t, values in zip(times, data))
+        return sorted(events, key=lambda event: event[0])
+
+    def read(self, name):
+        """
+        All complete samples of a channel ordered by recording order. Samples written during the call may be missing.
+        :param name: Channel name
+        :return: numpy array of sample times, numpy array of size samples-columns
+        """
+        channel = self.channels[name]
+        columns = len(channel['columns'])
+        parts = max(1, -(-columns // self.width))
+
+        selected = np.flatnonzero((self.records['commit'] != 0) & (self.records['channel'] == channel['id']))
+        records = self.records[selected]
+        # Drop records that were overwritten while copying
+        valid = self.records['commit'][selected] == records['commit']
+        records = records[valid]
+
+        # Order by sample, then part
+        records = records[np.lexsort((records['part'], records['commit']))]
+        commits, starts, counts = np.unique(records['commit'], return_index=True, return_counts=True)
+        complete = counts == parts
+        starts = starts[complete]
+
+        data = np.empty((len(starts), parts*self.width))
+        for part in range(parts):
+            data[:, part*self.width:(part + 1)*self.width] = records['data'][starts + part]
+        return records['time'][starts], data[:, 0:columns]
@@ -1,35 +1,127 @@
 import math
+import itertools
 import numpy as np
+from scipy.optimize import linear_sum_assignment
 
 
 class Formation:
+    """
+    Formation generators for any number of drones. Every formation is a numpy array of size n-3 of slot positions
+    relative to the formation origin, neighbouring slots are dist apart.
+
+    Formations marked prefix stable keep the positions of their first slots when drone_count grows, which lets drones
+    keep their slots when others join.
+    """
+
+    TETRAHEDRON = 0     # Original five point shape, larger swarms continue on a lattice around it. Prefix stable
+    CIRCLE = 1          # Ring in the xy plane
+    LINE = 2            # Along the x axis. Prefix stable
+    GRID = 3            # Square grid in the xy plane, filled row by row
+    SPHERE = 4          # Fibonacci sphere
+    LATTICE = 5         # Cubic lattice, filled by distance to the origin. Prefix stable
 
     @staticmethod
     def gen_formation(dist=0.5, drone_count=0, option=0):
+        """
+        Generate formation
+        :param dist: Distance between neighbouring slots
+        :param drone_count: Number of slots
+        :param option: Formation, see constants of Formation
+        :return: numpy array of size drone_count-3
+        """
+        if option == Formation.TETRAHEDRON:
+            tetrahedron = np.array([(0, 0, 0),
+                                    (dist, 0, 0),
+                                    (dist/2, dist, 0),
+                                    (dist/2, dist/2, dist),
+                                    (dist/2, dist/2, -dist)])
+            return Formation.extend(tetrahedron, drone_count, dist)
+
+        elif option == Formation.CIRCLE:
+            if drone_count < 2:
+                return np.zeros((drone_count, 3))
+            angle = 2*math.pi*np.arange(drone_count)/drone_count
+            radius = dist/(2*math.sin(math.pi/drone_count))
+            return np.stack((radius*np.cos(angle), radius*np.sin(angle), np.zeros(drone_count)), axis=1)
+
+        elif option == Formation.LINE:
+            return np.stack((dist*np.arange(drone_count), np.zeros(drone_count), np.zeros(drone_count)), axis=1)
+
+        elif option == Formation.GRID:
+            side = max(1, math.ceil(math.sqrt(drone_count)))
+            index = np.arange(drone_count)
+            return np.stack((dist*(index % side), dist*(index // side), np.zeros(drone_count)), axis=1)
+
+        elif option == Formation.SPHERE:
+            if drone_count < 2:
+                return np.zeros((drone_count, 3))
+            # Neighbouring points of a unit Fibonacci sphere are about 3.09/sqrt(n) apart
+            radius = dist*math.sqrt(drone_count)/3.09
+            index = np.arange(drone_count) + 0.5
+            z = 1 - 2*index/drone_count
+            r = np.sqrt(1 - z**2)
+            theta = math.pi*(1 + math.sqrt(5))*index
+            return radius*np.stack((r*np.cos(theta), r*np.sin(theta), z), axis=1)
+
+        elif option == Formation.LATTICE:
+            return Formation.lattice(drone_count)*dist
 
-        if option == 0:
-            tetrahedron = [(0, 0, 0),
-                           (dist, 0, 0),
-                           (dist/2, dist, 0),
-                           (dist/2, dist/2, dist),
-                           (dist/2, dist/2, -dist)]
-
-            return tetrahedron
-        elif option == 1:
-            angle = 2*math.pi/drone_count
-
-            circle = [(0, 0, 0),
-                      (math.cos(angle), math.sin(angle), 0),
-                      (math.cos(2*angle), math.sin(2*angle), 0),
-                      (math.cos(3*angle), math.sin(3*angle), 0),
-                      (math.cos(4*angle), math.sin(4*angle), 0)]
-            return circle
-
-        elif option == 2:
-
-            line = [(0, 0, 0),
-                    (dist, 0, 0),
-                    (2*dist, 0, 0),
-                    (3*dist, 0, 0),
-                    (4*dist, 0, 0)]
-            return line
+        raise ValueError('Unknown formation option ' + str(option))
+
+    @staticmethod
+    def lattice(count, center=(0, 0, 0)):
+        """
+        First count points of the unit cubic lattice ordered by distance to center, ties broken by coordinates
+        :return: numpy array of size count-3
+        """
+        if count == 0:
+            return np.zeros((0, 3))
+        side = math.ceil(count**(1/3)) + 1
+        points = np.array(list(itertools.product(range(-side, side + 1), repeat=3)), dtype=float)
+        distance = np.linalg.norm(points - center, axis=1)
+        order = np.lexsort((points[:, 2], points[:, 1], points[:, 0], np.round(distance, 9)))
+        return points[order[0:count]]
+
+    @staticmethod
+    def extend(points, count, dist):
+        """
+        Extend a shape to count slots. Lattice points are added by distance to the centroid of the shape, skipping
+        those closer than dist to any slot already taken.
+        :param points: numpy array of size m-3
+        :param count: Number of slots wanted
+        :param dist: Lattice spacing and minimum distance to other slots
+        :return: numpy array of size count-3, starting with the first points of the shape
+        """
+        if count <= len(points):
+            return points[0:count]
+
+        slots = np.empty((count, 3))
+        slots[0:len(points)] = points
+        taken = len(points)
+        candidates = Formation.lattice(4*count, center=np.round(points.mean(axis=0)/dist))*dist
+        for candidate in candidates:
+            if np.min(np.linalg.norm(slots[0:taken] - candidate, axis=1)) > dist*(1 - 1e-9):
+                slots[taken] = candidate
+                taken = taken + 1
+                if taken == count:
+                    break
+        return slots[0:taken]
+
+    @staticmethod
+    def assign(positions, slots, center=True):
+        """
+        Optimal assignment of drones to formation slots, minimizing the sum of squared distances (Hungarian method)
+        :param positions: numpy array of size n-3 with current drone positions
+        :param slots: numpy array of size m-3 with m >= n formation slots
+        :param center: True to move the formation to the center of the drones first, slots are relative positions
+        :return: numpy array of n slot indices, one per drone
+        """
+        slots = np.asarray(slots, dtype=float)
+        positions = np.asarray(positions, dtype=float)
+        if center and len(positions) > 0:
+            slots = slots - slots[0:len(positions)].mean(axis=0) + positions.mean(axis=0)
+        cost = np.sum((positions[:, np.newaxis, :] - slots[np.newaxis, :, :])**2, axis=2)
+        drones, assigned = linear_sum_assignment(cost)
+        result = np.empty(len(positions), dtype=int)
+        result[drones] = assigned
+        return result
@@ -255,21 +255,24 @@ class GUI:
             if bat <= self.BAT_MIN_TAKE_OFF:
                 print('Battery level of ' + uri + ' too low to start flight. (' + str(bat) + ')')
                 #return
-        self._swarm_thread._seq.run(swarm=self.swarm, controller=self.controller, sequence=Sequences.TAKE_OFF_STANDARD)
+        # Flown by the swarm thread started below, which follows the controller once the take off is done
+        if not self._swarm_thread.submit(Sequences.TAKE_OFF_STANDARD, name='Take off'):
+            print('Sequence queue full, take off not started')
+            return
         self.start_flight()
         #self.print_state()
         pass
 
     def land_unsafe(self):
         self.swarm.controller_active = False
-        try:
-            self._swarm_thread.pause()
-        except Exception as e:
-            print('Exception when pausing swarm thread')
+        # Queued sequences are dropped and the landing preempts the running one on the next tick of the swarm thread,
+        # the landing ends by stopping the motors
+        self._swarm_thread.clear()
+        if not self._swarm_thread.submit(Sequences.LAND_UNSAFE, priority=SwarmThread.EMERGENCY, name='Land unsafe'):
+            print('Sequence queue full, landing not started')
+        self._swarm_thread.resume()
         #self.print_state()
-        self._swarm_thread._seq.run(swarm=self.swarm, controller=self.controller, sequence=Sequences.LAND_UNSAFE)
-        self.stop_flight()
-        pass
+        self.show_landed()
 
     def start_flight(self):
         self.swarm.controller_active = True
@@ -299,6 +302,9 @@ class GUI:
         except Exception as e:
             print('Error during flight stop')
             print(e)
+        self.show_landed()
+
+    def show_landed(self):
         self.btn_connect.config(state='disabled')
         self.btn_disconnect.config(state='normal')
         self.btn_take_off.config(state='normal')
@@ -315,7 +321,8 @@ class GUI:
     def start_sequence(self):
         seq = self.sequence_picker.get(self.sequence_picker.curselection())
         print(seq + ": " + str(self.sequences[seq]))
-        self._swarm_thread.queue.put({'seq': self.sequences[seq], 'seq_name': seq})
+        if not self._swarm_thread.submit(self.sequences[seq], name=seq):
+            print('Sequence queue full, ' + seq + ' not started')
 
     def test(self):
         self.test_status = (self.test_status + 1) % CFStates.SETUP_FINISHED
@@ -0,0 +1,213 @@
+import time
+import numpy as np
+
+from ChunkWriter import ChunkWriter
+
+
+class LatencyTracer:
+    """
+    Timestamps of every controller tick along the sense-compute-send pipeline, kept in preallocated ring buffers.
+
+    Stages of a tick, all time.monotonic_ns():
+        callback        Arrival of the newest log sample included in the snapshot
+        snapshot        Swarm state snapshot taken
+        compute_start   Controller compute called
+        compute_end     Controller compute returned
+        dispatch        Setpoints of the tick handed to the send path, first time only
+        send            Setpoint sent, one per drone
+
+    Nothing is locked. Every stage is written by a single thread: callbacks by the log callback of each drone, the
+    stages up to compute_end by the controller thread, dispatch by the thread sending setpoints and sends by the
+    command worker of each drone. Readers copy the rings and discard ticks overwritten during the copy.
+
+    The tracer is only called when enabled, see AsyncSwarm.enable_tracing, so it costs nothing when disabled.
+
+    Example:
+        tracer = swarm.enable_tracing()
+        ...
+        print(tracer.get_percentiles()['total'])
+        log.add_tracer(tracer)
+    """
+
+    CALLBACK = 0
+    SNAPSHOT = 1
+    COMPUTE_START = 2
+    COMPUTE_END = 3
+    DISPATCH = 4
+    STAGES = ('callback', 'snapshot', 'compute_start', 'compute_end', 'dispatch')
+
+    # Durations between stages, see get_latency
+    SEGMENTS = ('callback_to_snapshot', 'snapshot_to_compute', 'compute', 'compute_to_dispatch', 'dispatch_to_send',
+                'total')
+
+    def __init__(self, uris, capacity=10000):
+        """
+        :param uris: Traced drones, others are ignored
+        :param capacity: Number of ticks kept
+        """
+        self.uris = tuple(uris)
+        self.index = {uri: row for row, uri in enumerate(self.uris)}
+        self.capacity = capacity
+        self.ticks = 0
+        self.latest = -1
+        self.starttime = time.time()
+        self._start_ns = time.monotonic_ns()
+
+        self._callback = np.zeros(len(self.uris), dtype=np.int64)
+        self._stages = np.zeros((capacity, len(LatencyTracer.STAGES)), dtype=np.int64)
+        self._sends = np.zeros((capacity, len(self.uris)), dtype=np.int64)
+        # Tick stored in each slot, -1 while the slot is being written
+        self._tick = np.full(capacity, -1, dtype=np.int64)
+
+    def callback(self, uri):
+        """
+        Log sample of a drone arrived
+        """
+        row = self.index.get(uri)
+        if row is not None:
+            self._callback[row] = time.monotonic_ns()
+
+    def begin(self):
+        """
+        Start a new tick, the oldest tick is overwritten
+        :return: Tick number passed to the other calls
+        """
+        tick = self.ticks
+        slot = tick % self.capacity
+        self._tick[slot] = -1
+        self._stages[slot] = 0
+        self._sends[slot] = 0
+        self.ticks = tick + 1
+        return tick
+
+    def snapshot(self, tick):
+        """
+        Swarm state snapshot taken, also stores the arrival of the newest sample it contains
+        """
+        now = time.monotonic_ns()
+        stages = self._stages[tick % self.capacity]
+        arrived = self._callback[self._callback <= now]
+        stages[LatencyTracer.CALLBACK] = arrived.max() if len(arrived) > 0 else 0
+        stages[LatencyTracer.SNAPSHOT] = now
+
+    def mark(self, tick, stage):
+        """
+        :param stage: LatencyTracer.COMPUTE_START or LatencyTracer.COMPUTE_END
+        """
+        self._stages[tick % self.capacity, stage] = time.monotonic_ns()
+
+    def commit(self, tick):
+        """
+        Controller output of the tick is available to the send path
+        """
+        self._tick[tick % self.capacity] = tick
+        self.latest = tick
+
+    def dispatch(self):
+        """
+        Setpoints of the latest committed tick handed to the send path
+        :return: Tick number passed to sent(), -1 if there is none
+        """
+        tick = self.latest
+        if tick < 0:
+            return -1
+        stages = self._stages[tick % self.capacity]
+        if stages[LatencyTracer.DISPATCH] == 0:
+            stages[LatencyTracer.DISPATCH] = time.monotonic_ns()
+        return tick
+
+    def sent(self, tick, uri):
+        """
+        Setpoint of tick sent to a drone, only the first send of every tick is stored
+        """
+        row = self.index.get(uri)
+        if row is None or tick < max(0, self.ticks - self.capacity):
+            return
+        sends = self._sends[tick % self.capacity]
+        if sends[row] == 0:
+            sends[row] = time.monotonic_ns()
+
+    def get_ticks(self, n=None):
+        """
+        Copy of the latest committed ticks, oldest first
+        :param n: Number of ticks, None for all kept
+        :return: numpy array of tick numbers, numpy array of size ticks-stages, numpy array of size ticks-drones
+        with send times. Stages not reached are 0.
+        """
+        count = min(self.ticks, self.capacity)
+        n = count if n is None else min(n, count)
+        slots = (np.arange(self.ticks - n, self.ticks) % self.capacity)
+        ticks = self._tick[slots]
+        stages = self._stages[slots]
+        sends = self._sends[slots]
+        # Slots restarted during the copy
+        valid = (ticks >= 0) & (self._tick[slots] == ticks)
+        return ticks[valid], stages[valid], sends[valid]
+
+    def get_latency(self, n=None):
+        """
+        Durations of the latest ticks in seconds, NaN where a stage was not reached
+        :param n: Number of ticks, None for all kept
+        :return: dict{segment: numpy array}, see SEGMENTS. dispatch_to_send is of size ticks-drones, total ends with
+        the last send of each tick.
+        """
+        ticks, stages, sends = self.get_ticks(n)
+        stages = np.where(stages > 0, stages, np.nan)/1e9
+        sends = np.where(sends > 0, sends, np.nan)/1e9
+
+        latency = {'callback_to_snapshot': stages[:, 1] - stages[:, 0],
+                   'snapshot_to_compute': stages[:, 2] - stages[:, 1],
+                   'compute': stages[:, 3] - stages[:, 2],
+                   'compute_to_dispatch': stages[:, 4] - stages[:, 3],
+                   'dispatch_to_send': sends - stages[:, 4:5]}
+        last = np.full(len(ticks), np.nan)
+        sent = np.any(np.isfinite(sends), axis=1)
+        last[sent] = np.nanmax(sends[sent], axis=1)
+        latency['total'] = last - stages[:, 0]
+        return latency
+
+    def get_percentiles(self, percentiles=(50, 90, 99), n=None):
+        """
+        Live latency percentiles, may be called while tracing
+        :param percentiles: Percentiles to compute
+        :param n: Number of latest ticks to include, None for all kept
+        :return: dict{segment: dict{percentile: seconds}}, NaN for segments without data
+        """
+        result = {}
+        for segment, values in self.get_latency(n).items():
+            values = values[np.isfinite(values)]
+            if len(values) > 0:
+                result[segment] = dict(zip(percentiles, np.percentile(values, percentiles).tolist()))
+            else:
+                result[segment] = {p: np.nan for p in percentiles}
+        return result
+
+    def export(self, directory, name='latency'):
+        """
+        Write the kept ticks as a log readable by LogManager.export_mat and ChunkWriter.read. Each row holds the
+        snapshot time followed by the segment durations of one tick in seconds and the dispatch_to_send of every drone.
+        :param directory: Log folder, ex: LogManager.directory
+        :param name: Log name
+        """
+        ticks, stages, sends = self.get_ticks()
+        latency = self.get_latency()
+        segments = [segment for segment in LatencyTracer.SEGMENTS if segment != 'dispatch_to_send']
+
+        array = np.empty((len(ticks), 1 + len(segments) + len(self.uris)))
+        array[:, 0] = (stages[:, LatencyTracer.SNAPSHOT] - self._start_ns)/1e9
+        for column, segment in enumerate(segments):
+            array[:, 1 + column] = latency[segment]
+        array[:, 1 + len(segments):] = latency['dispatch_to_send']
+
+        objects = [['pipeline', segments]] + [[str(uri), ['dispatch_to_send']] for uri in self.uris]
+        columns = ['timestamp'] + [obj + ':' + param for obj, params in objects for param in params]
+        meta = {'starttime': self.starttime, 'period_ms': None, 'objects': objects}
+        writer = ChunkWriter(directory, name, columns, chunk_size=max(1, len(array)), meta=meta, buffers=1)
+        for row in array:
+            writer.append(row)
+        writer.close()
+
+    def __str__(self):
+        total = self.get_percentiles((50, 99))['total']
+        return 'ticks: %d, total latency median: %.3f ms, 99th percentile: %.3f ms' % \
+               (self.ticks, total[50]*1000, total[99]*1000)
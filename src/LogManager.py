@@ -1,17 +1,32 @@
+import os
 import time
 import threading
 from functools import partial
 import scipy.io
 import numpy as np
 
+from ChunkWriter import ChunkWriter
+from PyUtil import Periodic, LoopStats, RingBuffer
+
 
 class LogManager:
 
-    def __init__(self):
+    def __init__(self, directory='output', chunk_size=1000, memory=6000, recorder=None):
         """
-        Manages multiple logging threads and creates .mat files for Matlab imports
+        Manages multiple logging threads. Logged data is streamed to disk in chunks during flight, see ChunkWriter,
+        and can be exported to .mat files for Matlab imports afterwards.
+        :param directory: Output folder, every LogManager streams to its own subfolder named by date and time
+        :param chunk_size: Number of samples per chunk written to disk
+        :param memory: Number of latest samples of each log kept in memory
+        :param recorder: Optional FlightRecorder receiving every sample of every log as well as events
         """
         self.callers = {}
+        self.output = directory
+        self.directory = os.path.join(directory, 'log_' + time.strftime("%Y-%m-%d_T%H%M%S"))
+        self.chunk_size = chunk_size
+        self.memory = memory
+        self.recorder = recorder
+        self.tracers = {}
 
     def add_caller(self, name, call, period_ms, start=True):
         """
@@ -22,45 +37,99 @@ class LogManager:
         :param start: Start log or not
         :return: Created Log object
         """
-        log = Log(name, call, period_ms, start)
+        log = Log(name, call, period_ms, start, directory=self.directory, chunk_size=self.chunk_size,
+                  memory=self.memory, recorder=self.recorder)
         self.callers[name] = log
         return log
 
+    def add_tracer(self, tracer, name='latency'):
+        """
+        Export the ticks of a LatencyTracer with the other logs when writing the .mat file
+        :param tracer: LatencyTracer, ex: swarm.enable_tracing()
+        :param name: Log name
+        """
+        self.tracers[name] = tracer
+
     def stop(self):
         for caller in self.callers:
             self.callers[caller].stop()
+        if self.recorder is not None:
+            self.recorder.flush()
+
+    def record_event(self, name, values=()):
+        """
+        Record an event in the flight recorder, if any
+        :param name: Event name
+        :param values: Optional list of values describing the event
+        """
+        if self.recorder is not None:
+            self.recorder.event(name, values)
 
     def write_mat(self):
         """
-        Write all logged data to .mat file in ./output folder using predefined names. Appends date and time.
+        Write all logged data to .mat file in the output folder using predefined names. Appends date and time.
+        All logs are flushed and read back from disk, the samples kept in memory are not used.
         :return:
         """
-        call_time = time.localtime()
-        time_string = time.strftime("%Y-%m-%d_T%H%M%S")
-        data = {}
         for caller in self.callers:
-            data.update(self.callers[caller].get_data())
+            self.callers[caller].flush()
+        for name in self.tracers:
+            self.tracers[name].export(self.directory, name)
 
+        time_string = time.strftime("%Y-%m-%d_T%H%M%S")
         filename = 'log_' + time_string
-        scipy.io.savemat('output/' + filename, mdict=data)
+        LogManager.export_mat(self.directory, os.path.join(self.output, filename))
+
+    @staticmethod
+    def export_mat(directory, filename):
+        """
+        Offline export of a streamed log folder to a .mat file, also works on logs of crashed runs
+        :param directory: Folder written by a LogManager
+        :param filename: Path of the .mat file
+        """
+        data = {}
+        for name in ChunkWriter.list_names(directory):
+            array, header = ChunkWriter.read(directory, name)
+            data.update(Log.to_dict(name, array, header['meta']))
+
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        scipy.io.savemat(filename, mdict=data)
 
 
 class Log:
 
-    def __init__(self, name, call, period_ms, start):
+    def __init__(self, name, call, period_ms, start, directory='output', chunk_size=1000, memory=6000,
+                 recorder=None):
         """
         Create and start periodic log gathering. Function will be used as retrieval point.
+        Samples are streamed to disk through a ChunkWriter, the latest samples are also kept in a RingBuffer.
+        Each sample is one float64 row with a fixed schema: timestamp followed by the parameters of every object.
+        The schema is defined by the first sample containing data for all its objects, earlier samples are dropped.
         :param name: Log name
         :param call: Function to be used for data collection. Should return dict containing dict/list
         :param period_ms:
         :param start:
+        :param directory: Folder to stream the log to
+        :param chunk_size: Number of samples per chunk written to disk
+        :param memory: Number of latest samples kept in memory
+        :param recorder: Optional FlightRecorder, every sample is also written to a channel named as the log
         """
         self.name = name
         self.starttime = time.time()
         self.period_ms = period_ms
-        self.data = []
-        self.timestamps = []
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.memory = memory
+        self.recorder = recorder
+        self.channel = None
+        self.writer = None
+        self.objects = None
+        self.ring = None
+        self._uris = ()
+        self.closed = False
+        self.stats = LoopStats()
         self.thread = threading.Thread(name=name, target=partial(self.run, call))
+        self._lock = threading.Lock()
 
         if call is not None:
             self.running = start
@@ -70,13 +139,12 @@ class Log:
             self.running = False
 
     def run(self, call):
-        while self.running and self.period_ms is not 0:
-            self.data.append(call())
-            current_time = time.time()
-            d_time = (current_time - self.starttime)
-            self.timestamps.append(d_time)
-            sleeptime = (self.period_ms - ((d_time*1000.0) % self.period_ms))/1000.0
-            time.sleep(sleeptime)
+        if not self.period_ms:
+            return
+        for cycle in Periodic(duration=None, period=self.period_ms/1000, overrun=Periodic.SKIP, stats=self.stats):
+            if not self.running:
+                break
+            self.append(call())
 
     def stop(self):
         self.running = False
@@ -84,42 +152,153 @@ class Log:
             self.thread.join()
         except RuntimeError as e:
             print('Attempted join on unstarted Log')
+        with self._lock:
+            self.closed = True
+            if self.writer is not None:
+                self.writer.close()
+
+    def flush(self):
+        """
+        Write all collected samples to disk
+        """
+        with self._lock:
+            if self.writer is not None:
+                self.writer.flush()
 
     def push_data(self, data):
-        self.data.append(data)
-        self.timestamps.append(time.time() - self.starttime)
+        self.append(data)
+
+    def append(self, data):
+        """
+        Write one sample into the next row of the log, may be called from several threads
+        :param data: dict{obj_key: dict{param: value}} or dict{obj_key: list}, or an object with one row of array
+        per uri of uris and column names KEYS, ex: SwarmState or ControlOutput. Ignored once the log is stopped, ex:
+        log callbacks of drones still arriving after stop
+        """
+        timestamp = time.time() - self.starttime
+        with self._lock:
+            if self.closed:
+                return
+            if self.writer is None and not self._create_writer(data):
+                return
+
+            row = self.writer.get_row()
+            row[0] = timestamp
+            if self._is_state(data):
+                # Whole swarm state or control output in one assignment
+                row[1:] = data.array.ravel()
+                self._commit(row)
+                return
+
+            column = 1
+            for obj, params in self.objects:
+                value = data[obj] if obj in data else ()
+                end = column + len(params)
+                if len(value) == 0:
+                    row[column:end] = np.nan
+                elif isinstance(value, dict):
+                    row[column:end] = [value.get(param, np.nan) for param in params]
+                else:
+                    row[column:end] = value
+                column = end
+            self._commit(row)
+
+    def _commit(self, row):
+        self.ring.append(row)
+        if self.recorder is not None:
+            self.recorder.write(self.channel, row[1:], self.starttime + row[0])
+        self.writer.commit_row()
+
+    def _is_state(self, data):
+        """
+        :return: True if data is a SwarmState or ControlOutput laid out as the schema
+        """
+        return hasattr(data, 'array') and data.uris == self._uris and data.array.size == self.ring.width - 1
+
+    def _create_writer(self, data):
+        """
+        Define the columns from a sample, one column per parameter of every object
+        :return: False if the sample is not complete enough to define the columns
+        """
+        objects = []
+        if hasattr(data, 'array'):
+            # SwarmState or ControlOutput, rows without data yet are logged as NaN
+            objects = [(uri, [str(key) for key in data.KEYS]) for uri in data.uris]
+        else:
+            for obj in data:
+                params = data[obj]
+                if len(params) == 0:
+                    return False
+                if isinstance(params, dict):
+                    objects.append((obj, [str(param) for param in params]))
+                else:
+                    objects.append((obj, [str(i) for i in range(len(params))]))
+        if len(objects) == 0:
+            return False
+
+        columns = ['timestamp'] + [str(obj) + ':' + param for obj, params in objects for param in params]
+        meta = {'starttime': self.starttime, 'period_ms': self.period_ms,
+                'objects': [[str(obj), params] for obj, params in objects]}
+        self.objects = objects
+        self._uris = tuple(obj for obj, params in objects)
+        self.ring = RingBuffer(self.memory, len(columns))
+        if self.recorder is not None:
+            self.channel = self.recorder.add_channel(self.name, columns[1:])
+        self.writer = ChunkWriter(self.directory, self.name, columns, chunk_size=self.chunk_size, meta=meta)
+        return True
 
     def get_data(self):
         """
-        Retrieve all collected data
-        :return: dict containing timestamps[], starttime[] and numpy matrices for each object logged.
+        Retrieve the collected data kept in memory, the latest memory samples, as views in constant time. Every sample
+        is kept as long as none has been overwritten, ex: for the first minute of a 100 Hz log with memory=6000. Use
+        read for the complete log.
+        :return: dict containing timestamps[], starttime[], numpy matrices and parameter names for each object logged.
         numpy matrices are of size A-B where A is the number of parameters and B is the number of data points.
         """
-        # TODO keep individual variable names
-        data = {'timestamps' + '_' + self.name: self.timestamps, 'starttime' + '_' + self.name: self.starttime}
-
-        n_points = len(self.data)
-        n_objects = len(self.data[1].items())
-        testing = next(iter(self.data[1].items()))
-        n_params = len(testing[1])
-
-        arrays = {}
-        for obj, params in self.data[0].items():
-            obj = self.generate_name(obj)
-            arrays[obj] = np.zeros((n_params, n_points))
-        for index, point in enumerate(self.data):
-            for obj, params in point.items():
-                obj = self.generate_name(obj)
-                if type(params) is dict:
-                    arrays[obj][:, index] = list(params.values())
-                else:
-                    arrays[obj][:, index] = list(params)
-        data.update(arrays)
+        return self.get_recent()
+
+    def read(self):
+        """
+        Complete log read back from disk, linear in the length of the log
+        :return: dict as returned by get_data
+        """
+        with self._lock:
+            if self.writer is None:
+                return {'timestamps' + '_' + self.name: [], 'starttime' + '_' + self.name: self.starttime}
+            return Log.to_dict(self.name, self.writer.get_data(), self.writer.meta)
 
+    def get_recent(self, n=None):
+        """
+        Latest samples in constant time, views only valid until the samples are overwritten
+        :param n: Number of samples, None for all samples kept in memory
+        """
+        with self._lock:
+            if self.writer is None:
+                return {'timestamps' + '_' + self.name: [], 'starttime' + '_' + self.name: self.starttime}
+            return Log.to_dict(self.name, self.ring.get_view(n), self.writer.meta)
+
+    @staticmethod
+    def to_dict(name, array, meta):
+        """
+        Split log rows into one matrix per object
+        :param name: Log name
+        :param array: numpy array of size samples-columns as written by Log.append
+        :param meta: Log metadata stored in the ChunkWriter header
+        :return: dict as returned by get_data, matrices are views of array
+        """
+        data = {'timestamps' + '_' + name: array[:, 0], 'starttime' + '_' + name: meta['starttime']}
+        column = 1
+        for obj, params in meta['objects']:
+            end = column + len(params)
+            key = Log.generate_name(obj) + '_' + name
+            data[key] = array[:, column:end].T
+            data[key + '_names'] = np.array(params, dtype=object)
+            column = end
         return data
 
-    def generate_name(self, key):
+    @staticmethod
+    def generate_name(key):
         if 'radio' in key:
             key = 'd' + key[-2:]
 
-        return key + '_' + self.name
+        return key
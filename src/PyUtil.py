@@ -1,5 +1,6 @@
 import sys
 import time
+import bisect
 import numpy as np
 import math
 import threading
@@ -9,18 +10,122 @@ def printf(formatting, *args):
     sys.stdout.write(formatting % args)
 
 
+class LoopStats(object):
+
+    # Upper bin edges of the wake up latency histogram in microseconds, the last bin holds everything above
+    HISTOGRAM_US = (50, 100, 250, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+    def __init__(self):
+        """
+        Timing statistics of a periodic loop
+        """
+        self.cycles = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.worst_latency = 0.0
+        self.histogram = [0] * (len(LoopStats.HISTOGRAM_US) + 1)
+
+    def record(self, latency_ns):
+        """
+        Record wake up latency of one cycle
+        :param latency_ns: Time between deadline and actual wake up in nanoseconds
+        """
+        self.cycles = self.cycles + 1
+        latency = latency_ns / 1e9
+        if latency > self.worst_latency:
+            self.worst_latency = latency
+        self.histogram[bisect.bisect_left(LoopStats.HISTOGRAM_US, latency_ns / 1000)] += 1
+
+    def get_data(self):
+        """
+        :return: dict containing all statistics, latencies in seconds
+        """
+        return {'cycles': self.cycles, 'overruns': self.overruns, 'skipped': self.skipped,
+                'worst_latency': self.worst_latency, 'histogram_us': list(LoopStats.HISTOGRAM_US),
+                'histogram': list(self.histogram)}
+
+    def __str__(self):
+        return 'cycles: %d, overruns: %d, skipped: %d, worst latency: %.3f ms' % \
+               (self.cycles, self.overruns, self.skipped, self.worst_latency * 1000)
+
+
+class RingBuffer(object):
+
+    def __init__(self, capacity, width, dtype=float):
+        """
+        Preallocated buffer of the most recent rows of a typed array.
+        Every row is stored twice, capacity rows apart, so the latest rows always form one contiguous slice and can be
+        returned as a view without copying. Rows not written yet are never returned and left uninitialized.
+        :param capacity: Maximum number of rows kept
+        :param width: Number of columns
+        :param dtype: numpy type of all columns
+        """
+        self.capacity = capacity
+        self.width = width
+        self.buffer = np.empty((2*capacity, width), dtype=dtype)
+        self.head = 0
+        self.count = 0
+
+    def append(self, row):
+        """
+        Overwrite the oldest row, O(1) without allocation
+        :param row: Sequence with one value per column
+        """
+        self.buffer[self.head] = row
+        self.buffer[self.head + self.capacity] = self.buffer[self.head]
+        self.head = (self.head + 1) % self.capacity
+        self.count = self.count + 1
+
+    def get_view(self, n=None):
+        """
+        View of the latest rows, oldest first. Only valid until the rows are overwritten.
+        :param n: Number of rows, None for all rows kept
+        :return: numpy array of size n-width
+        """
+        n = len(self) if n is None else min(n, len(self))
+        end = self.head + self.capacity
+        return self.buffer[end - n:end]
+
+    def is_complete(self):
+        """
+        :return: True if no row has been overwritten yet, the buffer then holds every row ever appended
+        """
+        return self.count <= self.capacity
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+
 class Periodic(object):
 
-    def __init__(self, duration, period):
+    CATCH_UP = 'catch_up'
+    SKIP = 'skip'
+
+    def __init__(self, duration, period, overrun=CATCH_UP, spin=0.0005, stats=None):
         """
-        Iterable object for easier periodic time management
-        :param duration: Total duration of run in seconds
+        Iterable object for easier periodic time management.
+        Deadlines are absolute and based on time.monotonic_ns, so cycles do not drift and are unaffected by changes of
+        the wall clock.
+        :param duration: Total duration of run in seconds, None to run until the loop is exited
         :param period: Cycle period in seconds
+        :param overrun: Policy for cycles starting after their deadline. Periodic.CATCH_UP runs missed cycles back to
+        back, Periodic.SKIP drops all fully missed cycles and continues on the latest deadline. Skipped cycles are
+        still counted in the returned cycle count, so cycle * period is the time since start.
+        :param spin: Time in seconds before each deadline spent yielding instead of sleeping, for sub-millisecond
+        accuracy
+        :param stats: LoopStats to record timing in, a new one is created if None
         """
         self.duration = duration
         self.period = period
+        self.overrun = overrun
+        self.stats = stats if stats is not None else LoopStats()
         self.starttime = time.time()
 
+        self._period_ns = int(period * 1e9)
+        self._duration_ns = None if duration is None else int(duration * 1e9)
+        self._spin_ns = int(spin * 1e9)
+        self._start_ns = time.monotonic_ns()
+
     def __iter__(self):
         self._cycle = 0
         return self
@@ -30,15 +135,38 @@ class Periodic(object):
         Sleeps until next action is due
         :return: current cycle count
         """
-        run_time = time.time() - self.starttime
-        if run_time + self.period > self.duration:
+        now = time.monotonic_ns()
+        run_time = now - self._start_ns
+        if self._duration_ns is not None and run_time + self._period_ns > self._duration_ns:
             raise StopIteration
-        else:
-            sleep_time = self.period * self._cycle - run_time
-            self._cycle = self._cycle + 1
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-            return int(self._cycle)
+
+        deadline = self._start_ns + self._period_ns * self._cycle
+        if self._cycle > 0 and now > deadline:
+            self.stats.overruns = self.stats.overruns + 1
+            if self.overrun == Periodic.SKIP:
+                missed = (now - deadline) // self._period_ns
+                self.stats.skipped = self.stats.skipped + missed
+                self._cycle = self._cycle + missed
+                deadline = deadline + missed * self._period_ns
+
+        self._cycle = self._cycle + 1
+        sleep_until(deadline, self._spin_ns)
+        self.stats.record(time.monotonic_ns() - deadline)
+        return int(self._cycle)
+
+
+def sleep_until(deadline_ns, spin_ns=0):
+    """
+    Sleep until time.monotonic_ns() reaches deadline. The last spin_ns are spent yielding to other threads instead of
+    sleeping, as sleep may overshoot by up to a scheduler tick.
+    :param deadline_ns: Absolute deadline in nanoseconds
+    :param spin_ns: Spin time in nanoseconds
+    """
+    remaining = deadline_ns - time.monotonic_ns()
+    if remaining > spin_ns:
+        time.sleep((remaining - spin_ns) / 1e9)
+    while time.monotonic_ns() < deadline_ns:
+        time.sleep(0)
 
 
 def compute_rejections(A, B):
@@ -61,6 +189,33 @@ def compute_rejections(A, B):
     return angle, rej_A, rej_B
 
 
+def compute_rejections_array(A, B):
+    """
+    Row-wise version of compute_rejections for many vector pairs at once
+    :param A: numpy array of size m-3
+    :param B: numpy array of size m-3
+    :return: angle[m], rej_A[m-3], rej_B[m-3]. Degenerate pairs (equal, zero or parallel vectors) get zero rejections
+    """
+    dAB = np.einsum('ij,ij->i', A, B)
+    dBB = np.einsum('ij,ij->i', B, B)
+
+    len_A = np.linalg.norm(A, axis=1)
+    len_B = np.linalg.norm(B, axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rej_A = A - (dAB / dBB)[:, np.newaxis] * B
+        len_rej = np.linalg.norm(rej_A, axis=1)
+        rej_A = rej_A / len_rej[:, np.newaxis]
+        angle = np.maximum(0.01, np.arccos(np.clip(dAB / (len_A * len_B), -1, 1)))
+
+    degenerate = ~np.isfinite(rej_A).all(axis=1) | (len_rej == 0)
+    rej_A[degenerate] = 0
+    angle[~np.isfinite(angle)] = 0
+    angle[np.all(A == B, axis=1)] = 0
+
+    return angle, rej_A, -1 * rej_A
+
+
 def callback_wrapper(target, callback):
     """
     Starts a thread that executes run and callback in sequence
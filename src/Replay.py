@@ -0,0 +1,253 @@
+import inspect
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from CFUtil import CFUtil
+from ChunkWriter import ChunkWriter
+from FlightRecorder import FlightReader
+from SwarmState import SwarmState
+
+
+class Flight:
+
+    def __init__(self, times, uris, states, refs=None, control=None):
+        """
+        Recorded flight with references and control signals aligned to the state samples
+        :param times: numpy array of sample times
+        :param uris: Drone uris, defines the drone order of all arrays
+        :param states: numpy array of size samples-drones-6 containing x-y-z-dx-dy-dz
+        :param refs: Optional numpy array of size samples-3, reference active at each sample
+        :param control: Optional numpy array of size samples-drones-3, latest control signal at each sample
+        """
+        self.times = times
+        self.uris = list(uris)
+        self.states = states
+        self.refs = refs
+        self.control = control
+
+    def __len__(self):
+        return len(self.times)
+
+    @staticmethod
+    def from_log(directory, state='state', control='control', ref='ref'):
+        """
+        Load flight from a log folder streamed by LogManager
+        :param directory: Log folder
+        :param state: Name of the log with swarm states, ex: log.add_caller(name='state', call=swarm.get_state, ...)
+        :param control: Name of the log with controller outputs, skipped if missing
+        :param ref: Name of the log with references, skipped if missing
+        """
+        names = ChunkWriter.list_names(directory)
+
+        def load(name):
+            if name not in names:
+                return None
+            data, header = ChunkWriter.read(directory, name)
+            return header['meta']['starttime'] + data[:, 0], header['columns'][1:], data[:, 1:]
+
+        return Flight.from_channels(load(state), load(control), load(ref))
+
+    @staticmethod
+    def from_recorder(path, state='state', control='control', ref='ref'):
+        """
+        Load flight from a FlightRecorder file, also works while it is being written
+        """
+        reader = FlightReader(path)
+
+        def load(name):
+            if name not in reader.channels:
+                return None
+            times, data = reader.read(name)
+            return times, reader.channels[name]['columns'], data
+
+        return Flight.from_channels(load(state), load(control), load(ref))
+
+    @staticmethod
+    def from_channels(state, control=None, ref=None):
+        """
+        Build flight from logged channels, each given as (times, column names, data) with column names 'obj:param'.
+        Samples before every drone has reported its state are dropped.
+        """
+        times, columns, data = state
+        objects = Flight.split_columns(columns)
+        uris = [obj for obj in objects if all(key in objects[obj] for key in CFUtil.KEYS_STATE)]
+        states = np.stack([data[:, [objects[uri][key] for key in CFUtil.KEYS_STATE]] for uri in uris], axis=1)
+
+        valid = np.all(np.isfinite(states), axis=(1, 2))
+        times, states = times[valid], states[valid]
+
+        refs = None
+        if ref is not None and len(ref[0]) > 0:
+            ref_objects = Flight.split_columns(ref[1])
+            ref_columns = list(next(iter(ref_objects.values())).values())
+            refs = Flight.align(times, ref[0], ref[2][:, ref_columns])
+
+        control_array = None
+        if control is not None and len(control[0]) > 0:
+            control_objects = Flight.split_columns(control[1])
+            columns = np.full((len(uris), 3), -1)
+            for row, uri in enumerate(uris):
+                if uri in control_objects:
+                    columns[row] = list(control_objects[uri].values())[0:3]
+            # Drones without control output get NaN through an extra NaN column
+            padded = np.concatenate((control[2], np.full((len(control[2]), 1), np.nan)), axis=1)
+            control_array = Flight.align(times, control[0], padded[:, columns.ravel()]).reshape(-1, len(uris), 3)
+
+        return Flight(times, uris, states, refs=refs, control=control_array)
+
+    @staticmethod
+    def split_columns(columns):
+        """
+        :param columns: Column names 'obj:param' as written by Log
+        :return: dict{obj: dict{param: column index}}, in column order
+        """
+        objects = {}
+        for index, column in enumerate(columns):
+            obj, param = column.rsplit(':', 1)
+            objects.setdefault(obj, {})[param] = index
+        return objects
+
+    @staticmethod
+    def align(times, sample_times, samples):
+        """
+        Latest sample at or before each time, NaN before the first sample
+        """
+        index = np.searchsorted(sample_times, times, side='right') - 1
+        aligned = samples[np.maximum(index, 0)].astype(float)
+        aligned[index < 0] = np.nan
+        return aligned
+
+
+class ControllerFactory:
+
+    def __init__(self, cls, **kwargs):
+        """
+        Picklable controller constructor for parameter sweeps
+        :param cls: Controller class, ex: DistanceController
+        :param kwargs: Constructor arguments shared by all configurations
+        """
+        self.cls = cls
+        self.kwargs = kwargs
+
+    def __call__(self, config):
+        """
+        Construct controller for one configuration
+        :param config: dict of constructor arguments and controller attributes, ex: {'weight': (1, 0, 0.1, 0.05)} or
+        {'kp': 1.2, 'k1': -0.3}. Attributes are set after construction.
+        :return: Controller
+        """
+        parameters = inspect.signature(self.cls.__init__).parameters
+        kwargs = dict(self.kwargs)
+        kwargs.update({key: value for key, value in config.items() if key in parameters})
+        controller = self.cls(**kwargs)
+        for key, value in config.items():
+            if key in parameters:
+                continue
+            if not hasattr(controller, key):
+                raise AttributeError(self.cls.__name__ + ' has no parameter ' + key)
+            setattr(controller, key, value)
+        return controller
+
+
+class Replay:
+    """
+    Re-runs controllers against recorded flights as fast as possible, without drones or wall clock timing.
+
+    Every recorded state is fed to the controller's compute through a SwarmState, with the recorded reference set
+    before each call. The new control signals can be compared to the recorded ones, or a parameter sweep can score
+    many controller configurations against the same flight.
+
+    Drones on the ignore lists during the flight are not recorded and have to be added to the controller manually.
+
+    Example:
+        replay = Replay(Flight.from_log('output/log_2019-05-01_T120000'))
+        u = replay.run(DistanceController(period_ms=10))
+        results = replay.sweep(ControllerFactory(DistanceController, period_ms=10), [{'kp': kp} for kp in gains])
+    """
+
+    def __init__(self, flight, stride=1):
+        """
+        :param flight: Flight to replay
+        :param stride: Replay every stride:th sample, ex: 5 for a 50 ms controller on a 10 ms log
+        """
+        self.flight = flight
+        self.stride = stride
+
+    def run(self, controller):
+        """
+        Compute control signals for every replayed sample
+        :param controller: Controller with compute(state) and set_ref(ref)
+        :return: numpy array of size samples-drones-3, rows ordered as flight.uris
+        """
+        flight = self.flight
+        steps = range(0, len(flight), self.stride)
+        state = SwarmState(flight.uris)
+        output = np.full((len(steps), len(flight.uris), 3), np.nan)
+
+        for row, k in enumerate(steps):
+            if flight.refs is not None and np.all(np.isfinite(flight.refs[k])):
+                controller.set_ref(flight.refs[k])
+            state.array[:, 0:6] = flight.states[k]
+            state.arrival[:] = flight.times[k]
+
+            u = controller.compute(state)
+            if hasattr(controller, 'get_u_batch'):
+                output[row] = controller.get_u_batch()[1]
+            else:
+                output[row] = [u[uri] for uri in flight.uris]
+        return output
+
+    def get_recorded(self):
+        """
+        :return: Recorded control signals at the replayed samples, None if not recorded
+        """
+        if self.flight.control is None:
+            return None
+        return self.flight.control[::self.stride]
+
+    def score(self, u):
+        """
+        Metrics of replayed control signals
+        :param u: Output of run()
+        :return: dict containing rms and max speed of u, and rms difference to the recorded control signals
+        """
+        speed = np.linalg.norm(u, axis=2)
+        result = {'rms': float(np.sqrt(np.nanmean(speed**2))), 'max': float(np.nanmax(speed))}
+        recorded = self.get_recorded()
+        if recorded is not None:
+            error = np.linalg.norm(u - recorded, axis=2)
+            result['rms_error'] = float(np.sqrt(np.nanmean(error**2))) if np.isfinite(error).any() else np.nan
+        return result
+
+    def sweep(self, factory, configs, workers=None):
+        """
+        Replay the flight once per configuration
+        :param factory: Function returning a new controller for a configuration, ex: ControllerFactory
+        :param configs: List of configurations
+        :param workers: Number of worker processes, None to run in this process. factory must then be picklable.
+        :return: List of dict containing the configuration and score() of each replay, ordered as configs
+        """
+        if workers is None:
+            return [_replay_config(self, factory, config) for config in configs]
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self, factory)) as pool:
+            chunksize = max(1, len(configs) // (4*workers))
+            return list(pool.map(_replay_worker, configs, chunksize=chunksize))
+
+
+def _replay_config(replay, factory, config):
+    result = replay.score(replay.run(factory(config)))
+    result['config'] = config
+    return result
+
+
+_worker = {}
+
+
+def _init_worker(replay, factory):
+    _worker['replay'] = replay
+    _worker['factory'] = factory
+
+
+def _replay_worker(config):
+    return _replay_config(_worker['replay'], _worker['factory'], config)
@@ -2,13 +2,194 @@ from CFUtil import CFUtil
 from PyUtil import Periodic
 import numpy as np
 import math
+import time
+
+
+class Step:
+    """
+    One segment of a sequence, see Sequences.STEPS. A step lasting duration seconds runs one tick per controller
+    period, zero duration steps only run their actions and set their reference.
+
+    Every tick the swarm follows the controller. Instead, with follow=False all drones are sent their hover positions
+    and with a velocity all drones are sent that velocity, see take_off and land. The reference can be held, ramped
+    linearly or follow a curve, and the first drone of the swarm can be detached from the controller and held at or
+    ramped between absolute positions, see IGNORE.
+
+    Nothing blocks longer than a tick, so a sequence can be preempted between any two ticks, see SwarmThread.
+    """
+
+    # Actions, run in order before the first tick of their step
+    RESET = 'reset'         # Reset controller
+    STOP = 'stop'           # Stop all motors ("crash" from previous setpoint)
+    IGNORE = 'ignore'       # Controller ignores the first drone of the swarm
+    UNIGNORE = 'unignore'   # First drone of the swarm follows the controller again
+    SPREAD = 'spread'       # Hover positions of the first two drones moved to opposite sides to avoid collision
+
+    # Velocity of land steps, also run as action on their first tick
+    DESCEND = 'descend'
+
+    def __init__(self, duration=0, ref=None, end=None, curve=None, detached=None, detached_end=None, follow=True,
+                 velocity=None, actions=()):
+        """
+        :param duration: Length of the step in seconds
+        :param ref: Reference set at the start of the step, None keeps the previous reference
+        :param end: Reference at the end of the step, ramped linearly from ref
+        :param curve: Function of progress, numpy array in (0, 1], returning a numpy array of size ticks-3 with the
+        reference of every tick, see Curves
+        :param detached: Absolute position of the first drone during the step, None if not detached
+        :param detached_end: Position of the first drone at the end of the step, ramped linearly from detached
+        :param follow: False to send hover positions to all drones instead of following the controller
+        :param velocity: Velocity (vx, vy, vz) sent to all drones every tick instead of following the controller, or
+        DESCEND for every drone to descend from its height at the start of the step to CFUtil.HEIGHT_LAND
+        :param actions: Actions run before the first tick, see constants of Step
+        """
+        self.duration = duration
+        self.ref = ref
+        self.end = end
+        self.curve = curve
+        self.detached = detached
+        self.detached_end = detached_end
+        self.follow = follow
+        self.velocity = velocity
+        self.actions = tuple(actions)
+
+    @staticmethod
+    def hold(duration, ref=None, detached=None):
+        return Step(duration, ref=ref, detached=detached)
+
+    @staticmethod
+    def ramp(duration, start, end, detached=None):
+        return Step(duration, ref=start, end=end, detached=detached)
+
+    @staticmethod
+    def do(*actions):
+        return Step(actions=actions)
+
+    @staticmethod
+    def take_off(duration=1.0, height=1.0):
+        """
+        All drones climb at constant speed, reaching height after duration
+        """
+        return Step(duration, velocity=(0, 0, height/duration))
+
+    @staticmethod
+    def land(duration=2.0):
+        """
+        All drones descend from their current position, follow with STOP to turn off the motors
+        """
+        return Step(duration, velocity=Step.DESCEND)
+
+
+class Curves:
+    """
+    Parametric references, functions of progress through the step returning a numpy array of size ticks-3
+    """
+
+    @staticmethod
+    def spiral(progress, z_pos_0=0.6, scale=(0.5, 0.5, 1.0)):
+        """
+        Two turns around the z axis while rising scale z
+        """
+        angle = progress*2*math.pi
+        return np.stack((np.cos(angle*2)*scale[0], np.sin(angle*2)*scale[1], z_pos_0 + progress*scale[2]), axis=1)
+
+    @staticmethod
+    def ellipse(progress, z_pos_0=1.3, scale=(0.7, 1.2, 0.3)):
+        """
+        One turn around the z axis, height oscillating twice
+        """
+        angle = progress*2*math.pi
+        return np.stack((np.cos(angle)*scale[0], np.sin(angle)*scale[1], z_pos_0 + np.sin(2*angle)*scale[2]), axis=1)
+
+
+class SequenceTable:
+
+    # What the swarm is sent on each tick
+    FOLLOW = 0      # Setpoints of the controller
+    HOVER = 1       # Hover positions
+    VELOCITY = 2    # Velocity of the tick to all drones
+    DESCEND = 3     # Landing velocities computed on the first tick of the step
+
+    def __init__(self, steps, period_s):
+        """
+        Sequence compiled into time indexed tables before flight. Row k holds tick k of the sequence, the extra last
+        row holds actions and reference of zero duration steps at the end, run without a tick.
+        :param steps: List of Step
+        :param period_s: Controller period in seconds
+        """
+        counts = [int(round(step.duration/period_s)) for step in steps]
+        self.period_s = period_s
+        self.ticks = sum(counts)
+
+        # NaN rows keep the previous reference and do not send a detached setpoint
+        self.refs = np.full((self.ticks + 1, 3), np.nan)
+        self.detached = np.full((self.ticks + 1, 4), np.nan)
+        self.mode = np.full(self.ticks + 1, SequenceTable.FOLLOW, dtype=np.int8)
+        # Velocity of VELOCITY ticks, DESCEND ticks hold the fraction of the height descended per second in z
+        self.velocity = np.full((self.ticks + 1, 3), np.nan)
+        self.actions = [[] for k in range(self.ticks + 1)]
+
+        tick = 0
+        for step, count in zip(steps, counts):
+            self.actions[tick].extend(step.actions)
+            if count == 0:
+                if step.ref is not None:
+                    self.refs[tick] = step.ref
+                continue
+
+            # Ramps and curves end at their target on the last tick
+            progress = np.arange(1, count + 1)/count
+            rows = slice(tick, tick + count)
+            if step.curve is not None:
+                self.refs[rows] = step.curve(progress)
+            elif step.end is not None:
+                self.refs[rows] = SequenceTable.interpolate(step.ref, step.end, progress)
+            elif step.ref is not None:
+                self.refs[tick] = step.ref
+
+            if step.detached is not None:
+                end = step.detached if step.detached_end is None else step.detached_end
+                self.detached[rows, 0:3] = SequenceTable.interpolate(step.detached, end, progress)
+                self.detached[rows, 3] = 0
+            if step.velocity is Step.DESCEND:
+                self.mode[rows] = SequenceTable.DESCEND
+                self.velocity[rows] = (0, 0, 1/step.duration)
+                self.actions[tick].append(Step.DESCEND)
+            elif step.velocity is not None:
+                self.mode[rows] = SequenceTable.VELOCITY
+                self.velocity[rows] = step.velocity
+            elif not step.follow:
+                self.mode[rows] = SequenceTable.HOVER
+            tick = tick + count
+
+        self.uses_first = bool(np.isfinite(self.detached).any()) or \
+            any(action in (Step.IGNORE, Step.UNIGNORE) for actions in self.actions for action in actions)
+
+        # Per tick tuples of preallocated row views, the runtime loop only indexes this list
+        set_ref = np.all(np.isfinite(self.refs), axis=1)
+        detach = np.all(np.isfinite(self.detached), axis=1)
+        self.plan = [(tuple(self.actions[k]), self.refs[k] if set_ref[k] else None,
+                      self.detached[k] if detach[k] else None, int(self.mode[k]), self.velocity[k])
+                     for k in range(self.ticks + 1)]
+
+    @staticmethod
+    def interpolate(start, end, progress):
+        start = np.asarray(start, dtype=float)
+        return start + (np.asarray(end, dtype=float) - start)*progress[:, np.newaxis]
+
+    def get_duration(self):
+        """
+        :return: Length of the sequence in seconds
+        """
+        return self.ticks*self.period_s
 
 
 class Sequences:
     """
     Class containing all sequences available through the GUI
-    Sequences should contain code sending commands to the drones, and should be blocking.
-    Add a static key for the sequence, and a corresponding elif statement
+    Sequences are described by a list of Step in STEPS and compiled into numpy tables before they are flown, the
+    sequence blocks until done.
+    Add a static key for the sequence, and a corresponding entry in STEPS
 
     Sequences only show up in the GUI after you add an entry to the REAL dictionary containing a readable name and the
     static key for the specific sequence.
@@ -60,6 +241,199 @@ class Sequences:
     # Collapse?
     # Scatter?
 
+    STEPS = {
+        TAKE_OFF_FOLLOW_CONTROLLER: [
+            Step.take_off(),
+            Step.do(Step.RESET),
+            Step.hold(10, (0, 0, 1)),
+            Step.hold(5, (0, 0, 0.5)),
+            Step.do(Step.STOP)],
+
+        TAKE_OFF_HOVER: [
+            Step.take_off(),
+            Step.do(Step.RESET),
+            Step.hold(10, (0, 0, 1)),
+            Step.land(),
+            Step.do(Step.STOP)],
+
+        TAKE_OFF_CONTROLLER_SEQ: [
+            Step.take_off(),
+            Step.do(Step.RESET),
+            Step.hold(4, (0, 0, 1.2)),
+            Step.hold(2, (0, -0.5, 0.8)),
+            Step.hold(2, (0.5, 0, 1.5)),
+            Step.hold(2, (0, 0, 1.2)),
+            Step.hold(2, (0, -0.5, 0.8)),
+            Step.hold(2, (0.5, 0, 1.5)),
+            Step.hold(2, (0, 0, 1)),
+            # Prepare for landing
+            Step.hold(4, (0, 0, 0.5)),
+            Step.land(),
+            Step.do(Step.STOP)],
+
+        TAKE_OFF_MERGE: [
+            Step.take_off(),
+            Step.do(Step.RESET, Step.SPREAD),
+            Step(5, follow=False),
+            Step.hold(10, (0, 0, 1)),
+            Step.hold(3, (0, 0, 0.1)),
+            Step.do(Step.STOP)],
+
+        SINGLE_TAKE_OFF_STEPS: [
+            Step.take_off(),
+            Step.do(Step.RESET),
+            Step.hold(5, (0, 0, 1)),
+            Step.hold(10, (1, 0, 1)),
+            Step.hold(10, (0, 0, 1)),
+            Step.hold(10, (0, 1, 1)),
+            Step.hold(10, (0, 0, 1)),
+            Step.hold(10, (0, 0, 1.5)),
+            Step.hold(10, (0, 0, 1)),
+            Step.hold(3, (0, 0, 0.1))],
+
+        Y_STEP: [
+            Step.take_off(),
+            Step.do(Step.RESET),
+            Step.hold(4, (0, 0, 1)),
+            Step.hold(4, (0, 0.5, 1)),
+            Step.hold(4, (0, 0, 1)),
+            Step.hold(3, (0, 0, 0.5)),
+            Step.do(Step.STOP)],
+
+        TEST_IGNORE: [
+            Step.do(Step.IGNORE),
+            Step.hold(5, (0.2, 0, 1), detached=(0, 0, 1)),
+            Step.do(Step.UNIGNORE)],
+
+        TEST_IGNORE_2: [
+            Step.do(Step.RESET),
+            Step.hold(5, (0, 0, 1)),
+            Step.do(Step.IGNORE),
+            Step.hold(5, (0, 0, 1), detached=(0, -1, 1)),
+            Step(3, detached=(0, -1, 1), detached_end=(0, 1, 1)),
+            Step.hold(3, detached=(0, 1, 1)),
+            Step.do(Step.UNIGNORE),
+            Step.hold(5, (0, 0, 0.5))],
+
+        CONTROLLER_SEQ: [
+            Step.do(Step.RESET),
+            Step.hold(2, (0, 0, 1.2)),
+            Step.hold(2, (0, -0.5, 0.8)),
+            Step.hold(2, (0.5, 0, 1.5)),
+            Step.hold(2, (0, 0, 1))],
+
+        SPIRAL: [
+            Step.hold(2, (0, 0, 0.6)),
+            Step(6, curve=Curves.spiral),
+            Step.hold(1)],
+
+        # Useful standards here
+        # Take off and land
+        # More space to read
+
+        TAKE_OFF_STANDARD: [
+            Step.take_off(),
+            Step.do(Step.RESET),
+            Step.hold(0, (0, 0, 1))],
+
+        # Descend and turn off
+        LAND_UNSAFE: [
+            Step.land(),
+            Step.do(Step.STOP)],
+
+        # ALL CASES MENTIONED IN REPORT START HERE
+        # Naming should be consistent with report
+
+        ROBOT_LAB_1: [
+            Step.hold(5),
+            Step.hold(3, (-0.7, -0.7, 1.3)),
+            Step.hold(3, (0.7, -0.7, 1.3)),
+            Step.hold(3, (0.7, 0.7, 1.3)),
+            Step.hold(3, (-0.7, 0.7, 1.3)),
+            Step.hold(5, (0, 0, 1))],
+
+        ROBOT_LAB_2: [
+            Step.hold(5, (0, 0, 1.3)),
+            Step(6, curve=Curves.ellipse),
+            Step.hold(5, (0, 0, 1.3))],
+
+        HOVER: [
+            Step.hold(10)],
+
+        STEP_Z_POS: [
+            Step.hold(5, (0, 0, 0.5)),
+            Step.hold(10, (0, 0, 1.5))],
+
+        STEP_Z_NEG: [
+            Step.hold(5, (0, 0, 1.5)),
+            Step.hold(10, (0, 0, 0.5))],
+
+        STEP_Y: [
+            Step.hold(5, (0, 0, 1)),
+            Step.hold(10, (0, 1, 1))],
+
+        RAMP_Z_POS: [
+            Step.hold(5, (0, 0, 0.5)),
+            Step.ramp(2, (0, 0, 0.5), (0, 0, 1.5)),
+            Step.hold(5, (0, 0, 1.5))],
+
+        RAMP_Z_NEG: [
+            Step.hold(5, (0, 0, 1.5)),
+            Step.ramp(2, (0, 0, 1.5), (0, 0, 0.5)),
+            Step.hold(5, (0, 0, 0.5))],
+
+        RAMP_Y: [
+            Step.hold(5, (0, 0, 1)),
+            Step.ramp(2, (0, 0, 1), (0, 1, 1)),
+            Step.hold(5, (0, 1, 1))],
+
+        # Merges: first drone held at start_1 while the others fly to start_2, then all merge at (0, 0, 1)
+        MERGE_1_1_C: [
+            Step.do(Step.IGNORE),
+            Step.hold(5, (0, 1, 1), detached=(0, -1, 1)),
+            Step.do(Step.UNIGNORE),
+            Step.hold(10, (0, 0, 1))],
+
+        MERGE_1_1_1: [
+            Step.do(Step.IGNORE),
+            Step.hold(5, (0, 1, 1), detached=(0, 0, 1)),
+            Step.do(Step.UNIGNORE),
+            Step.hold(10, (0, 0, 1))],
+
+        MERGE_1_3_C: [
+            Step.do(Step.IGNORE),
+            Step.hold(5, (0, 0.8, 1), detached=(0, -0.8, 1)),
+            Step.do(Step.UNIGNORE),
+            Step.hold(10, (0, 0, 1))],
+
+        MERGE_1_3_3: [
+            Step.do(Step.IGNORE),
+            Step.hold(5, (0, 0, 1), detached=(0, -1, 1)),
+            Step.do(Step.UNIGNORE),
+            Step.hold(10, (0, 0, 1))],
+
+        MERGE_1_3_1: [
+            Step.do(Step.IGNORE),
+            Step.hold(5, (0, 1, 1), detached=(0, 0, 1)),
+            Step.do(Step.UNIGNORE),
+            Step.hold(10, (0, 0, 1))],
+
+        LEAVE_HOVER: [
+            Step.hold(5, (-0.5, 0, 1)),
+            Step.do(Step.IGNORE),
+            Step.hold(10, detached=(1, 0, 1)),
+            Step.do(Step.UNIGNORE)],
+
+        # First drone branches off halfway through the ramp
+        LEAVE_RAMP: [
+            Step.hold(5, (0, -1, 1)),
+            Step.ramp(1, (0, -1, 1), (0, 0, 1)),
+            Step.do(Step.IGNORE),
+            Step.ramp(1, (0, 0, 1), (0, 1, 1), detached=(1, 0, 1)),
+            Step.hold(5, (0, 1, 1), detached=(1, 0, 1)),
+            Step.do(Step.UNIGNORE)],
+    }
+
     def __init__(self, period_ms=20):
         """
         Initialize sequencer, standard period is 20ms
@@ -69,6 +443,7 @@ class Sequences:
         self.get_statics()
 
         self.period_s = period_ms/1000
+        self._tables = {}
 
     @staticmethod
     def get_statics():
@@ -83,92 +458,144 @@ class Sequences:
                 seen.append(attr)
         return seen, collisions
 
+    def compile(self, sequence):
+        """
+        Compile sequence into reference tables, tables of sequence ids are compiled once and kept
+        :param sequence: ID of sequence, keys available in Sequences class, or a list of Step
+        :return: SequenceTable
+        """
+        if isinstance(sequence, (list, tuple)):
+            return SequenceTable(sequence, self.period_s)
+        if sequence not in self._tables:
+            if sequence not in Sequences.STEPS:
+                raise ValueError('Unknown sequence ' + str(sequence))
+            self._tables[sequence] = SequenceTable(Sequences.STEPS[sequence], self.period_s)
+        return self._tables[sequence]
+
     def run(self, swarm, controller, sequence, log=None):
         """
-        Run sequence with id
+        Run sequence with id, blocks until the sequence is done
         :param swarm: AsyncSwarm object containing swarm attributes
         :param controller: Swarm controller to follow/update
-        :param sequence: ID of sequence to follow, keys available in Sequences class
-        :param log: LogManager to add custom logs to
+        :param sequence: ID of sequence to follow, keys available in Sequences class, or a list of Step
+        :param log: LogManager to add custom logs to, start and end of the sequence are recorded as events
         :return:
         """
+        ticks = self.start(swarm, controller, sequence, log=log)
+        periodic = iter(Periodic(duration=None, period=self.period_s))
+        while True:
+            next(periodic)
+            started = time.monotonic()
+            if next(ticks, None) is None:
+                return
+            # Ticks blocking longer than a period restart the schedule instead of catching up in a burst, the
+            # blocking tick takes the place of the first cycle
+            if time.monotonic() - started > self.period_s:
+                periodic = iter(Periodic(duration=None, period=self.period_s))
+                next(periodic)
+
+    def start(self, swarm, controller, sequence, log=None):
+        """
+        Resumable sequence, advanced by one tick on every next() until StopIteration. The caller keeps the timing, ex:
+        SwarmThread calls next() once per period. Closing the generator aborts the sequence and records a
+        sequence_preempted event, an exception raised by a tick records sequence_failed. However the sequence ends, a
+        first drone still ignored is handed back to the controller.
+        :param swarm: AsyncSwarm object containing swarm attributes
+        :param controller: Swarm controller to follow/update
+        :param sequence: ID of sequence to follow, keys available in Sequences class, or a list of Step
+        :param log: LogManager to add custom logs to, start and end of the sequence are recorded as events
+        :return: Generator yielding the index of every tick run
+        """
+        table = self.compile(sequence)
 
-        if sequence == Sequences.TAKE_OFF_FOLLOW_CONTROLLER:
-            # Lift off
-            swarm.parallel(func=CFUtil.take_off)
-            controller.reset()
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0, 0.5))
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            # Stop all motors ("crash" from previous setpoint)
-            swarm.parallel(CFUtil.send_stop_signal)
-
-        elif sequence == Sequences.TAKE_OFF_HOVER:
-            # Lift off
-            swarm.parallel(func=CFUtil.take_off)
-            controller.reset()
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            state = swarm.get_state()
-            swarm.parallel(CFUtil.land, args_dict=CFUtil.get_land_dict(state=state))
-
-        elif sequence == Sequences.TAKE_OFF_CONTROLLER_SEQ:
-            # Lift off
-            swarm.parallel(func=CFUtil.take_off)
-            controller.reset()
-
-            controller.set_ref(new_ref=(0, 0, 1.2))
-            for cycle in Periodic(duration=4, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, -0.5, 0.8))
-            for cycle in Periodic(duration=2, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0.5, 0, 1.5))
-            for cycle in Periodic(duration=2, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0, 1.2))
-            for cycle in Periodic(duration=2, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, -0.5, 0.8))
-            for cycle in Periodic(duration=2, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0.5, 0, 1.5))
-            for cycle in Periodic(duration=2, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=2, period=self.period_s):
-                swarm.follow_controller(controller)
+        if log is not None:
+            log.record_event('sequence_start', [sequence])
 
-            # Prepare for landing
-            controller.set_ref(new_ref=(0, 0, 0.5))
-            for cycle in Periodic(duration=4, period=self.period_s):
-                swarm.follow_controller(controller)
+        scf1 = None
+        ignore_list = None
+        if table.uses_first:
+            uri1 = swarm.get_uris()[0]
+            scf1 = swarm.get_cfs()[uri1]
+            ignore_list = [uri1]
+        positions = CFUtil.POS_HOVER
+        ignoring = False
+
+        # Velocity setpoints of VELOCITY and DESCEND ticks, one row per drone of uris
+        uris = swarm.get_uris()
+        u = np.zeros((len(uris), 3))
+
+        plan = table.plan
+        try:
+            for index in range(table.ticks + 1):
+                actions, ref, detached, mode, velocity = plan[index]
+                for action in actions:
+                    if action == Step.DESCEND:
+                        uris, u = Sequences._descend(swarm, velocity[2])
+                        continue
+                    positions = self._do(action, swarm, controller, ignore_list, positions)
+                    if action == Step.IGNORE or action == Step.UNIGNORE:
+                        ignoring = action == Step.IGNORE
+                if ref is not None:
+                    controller.set_ref(new_ref=ref)
+                # The last row runs right after the last tick, without a tick of its own
+                if index == table.ticks:
+                    break
+
+                if mode == SequenceTable.FOLLOW:
+                    swarm.follow_controller(controller)
+                elif mode == SequenceTable.HOVER:
+                    swarm.broadcast(CFUtil.set_abs_pos, args_dict=positions)
+                else:
+                    if mode == SequenceTable.VELOCITY:
+                        u[:] = velocity
+                    swarm.send_velocity_batch(uris, u, ignore_list if ignoring else ())
+                if detached is not None:
+                    CFUtil.set_abs_pos(scf=scf1, pos=detached)
+                if index < table.ticks - 1:
+                    yield index
+        except GeneratorExit:
+            if log is not None:
+                log.record_event('sequence_preempted', [sequence])
+            raise
+        except Exception:
+            if log is not None:
+                log.record_event('sequence_failed', [sequence])
+            raise
+        finally:
+            # However the sequence ends, the first drone is not left without setpoints
+            if ignoring:
+                controller.remove_ignore(ignore_list)
+
+        if log is not None:
+            log.record_event('sequence_end', [sequence])
 
-            state = swarm.get_state()
-            swarm.parallel(CFUtil.land, args_dict=CFUtil.get_land_dict(state=state))
+    @staticmethod
+    def _descend(swarm, rate):
+        """
+        Landing velocities, every drone reaches CFUtil.HEIGHT_LAND at the end of the land step
+        :param rate: Fraction of the height descended per second, 1/duration of the step
+        :return: list of uris, numpy array of size n-3 with the velocity of each drone
+        """
+        uris, states = CFUtil.state_dict_to_array(swarm.get_state())
+        u = np.zeros((len(uris), 3))
+        u[:, 2] = (CFUtil.HEIGHT_LAND - states[:, 2])*rate
+        return uris, u
 
-        elif sequence == Sequences.TAKE_OFF_MERGE:
-            # Lift off
-            swarm.parallel(func=CFUtil.take_off)
+    @staticmethod
+    def _do(action, swarm, controller, ignore_list, positions):
+        """
+        Run one action of a sequence
+        :return: Hover positions sent to drones on ticks not following the controller
+        """
+        if action == Step.RESET:
             controller.reset()
-
-            positions = CFUtil.POS_HOVER
-
+        elif action == Step.STOP:
+            swarm.broadcast(CFUtil.send_stop_setpoint)
+        elif action == Step.IGNORE:
+            controller.add_ignore(ignore_list)
+        elif action == Step.UNIGNORE:
+            controller.remove_ignore(ignore_list)
+        elif action == Step.SPREAD:
             # Get uri of first 2 drones in swarm
             state = swarm.get_state()
             drone_list = list(state.items())
@@ -176,572 +603,13 @@ class Sequences:
             uri2 = drone_list[1][0]
 
             # Move setpoints to right side to avoid collision
+            positions = dict(positions)
             if state[uri1][CFUtil.KEY_Y] > state[uri2][CFUtil.KEY_Y]:
                 positions[uri1] = [(0, 1, 1, 0)]
                 positions[uri2] = [(0, -1, 1, 0)]
             else:
                 positions[uri1] = [(0, -1, 1, 0)]
                 positions[uri2] = [(0, 1, 1, 0)]
-
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.parallel(CFUtil.set_abs_pos, args_dict=positions)
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0, 0.1))
-            for cycle in Periodic(duration=3, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            # Stop all motors ("crash" from previous setpoint)
-            swarm.parallel(CFUtil.send_stop_signal)
-
-        elif sequence == Sequences.SINGLE_TAKE_OFF_STEPS:
-            swarm.parallel(func=CFUtil.take_off)
-            controller.reset()
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(1, 0, 1))
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 1, 1))
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0, 1.5))
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0, 0.1))
-            for cycle in Periodic(duration=3, period=self.period_s):
-                swarm.follow_controller(controller)
-
-        elif sequence == Sequences.Y_STEP:
-            # Lift off
-            swarm.parallel(func=CFUtil.take_off)
-            controller.reset()
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=4, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0.5, 1))
-            for cycle in Periodic(duration=4, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=4, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0, 0.5))
-            for cycle in Periodic(duration=3, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            # Stop all motors ("crash" from previous setpoint)
-            swarm.parallel(CFUtil.send_stop_signal)
-
-        elif sequence == Sequences.TEST_IGNORE:
-
-            start_1 = (0, 0, 1)
-            start_2 = (0.2, 0, 1)
-            end_2 = (-0.5, 0, 1)
-            merge_pos = (0, 0, 1)
-
-            uri1 = swarm.get_uris()[0]
-            scf1 = swarm.get_cfs()[uri1]
-            ignore_list = [uri1]
-            controller.add_ignore(ignore_list)
-
-            controller.set_ref(start_2)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-                CFUtil.set_abs_pos(scf=scf1, pos=start_1)
-
-            # controller.set_ref(end_2)
-            # for cycle in Periodic(duration=5, period=self.period_s):
-            #     swarm.follow_controller(controller)
-            #     CFUtil.set_abs_pos(scf=scf1, pos=start_1)
-
-            controller.remove_ignore(ignore_list)
-
-            # controller.set_ref(merge_pos)
-            # for cycle in Periodic(duration=10, period=self.period_s):
-                # swarm.follow_controller(controller)
-
-
-            # hover_pos = (0, 0, 1)
-            #
-            # swarm_start = (0, -1, 1)
-            # swarm_end = (0, 1, 1)
-            #
-            # # Lift off
-            # swarm.parallel(func=CFUtil.take_off)
-            # controller.reset()
-            #
-            # uri1 = swarm.get_uris()[0]
-            # scf1 = swarm.get_cfs()[uri1]
-            # ignore_list = [uri1]
-            #
-            # controller.set_ref(new_ref=(0, 0, 1))
-            # for cycle in Periodic(duration=5, period=self.period_s):
-            #     swarm.follow_controller(controller)
-            #
-            # controller.add_ignore(ignore_list)
-            #
-            # controller.set_ref(new_ref=swarm_start)
-            #
-            # for cycle in Periodic(duration=3, period=self.period_s):
-            #     swarm.follow_controller(controller)
-            #     CFUtil.set_abs_pos(scf=scf1, pos=hover_pos)
-            #
-            # dur = 3
-            # for cycle in Periodic(duration=dur, period=self.period_s):
-            #     t = cycle * self.period_s
-            #     p0 = np.array(swarm_start)
-            #     p1 = np.array(swarm_end)
-            #     pos = np.add(p0, np.subtract(p1, p0) * t / dur)
-            #     controller.set_ref(new_ref=list(pos))
-            #     swarm.follow_controller(controller)
-            #     CFUtil.set_abs_pos(scf=scf1, pos=hover_pos)
-            #
-            # for cycle in Periodic(duration=3, period=self.period_s):
-            #     swarm.follow_controller(controller)
-            #     CFUtil.set_abs_pos(scf=scf1, pos=hover_pos)
-            #
-            # controller.remove_ignore(ignore_list)
-            #
-            # controller.set_ref(new_ref=(0, 0, 0.5))
-            # for cycle in Periodic(duration=5, period=self.period_s):
-            #     swarm.follow_controller(controller)
-            #
-            # state = swarm.get_state()
-            # swarm.parallel(CFUtil.land, args_dict=CFUtil.get_land_dict(state=state))
-
-        elif sequence == Sequences.TEST_IGNORE_2:
-            hover_pos = (0, 0, 1)
-
-            drone_start = (0, -1, 1)
-            drone_end = (0, 1, 1)
-
-            # Lift off
-            # swarm.parallel(func=CFUtil.take_off)
-            controller.reset()
-
-            uri1 = swarm.get_uris()[0]
-            scf1 = swarm.get_cfs()[uri1]
-            ignore_list = [uri1]
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.add_ignore(ignore_list)
-
-            controller.set_ref(new_ref=hover_pos)
-
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-                CFUtil.set_abs_pos(scf=scf1, pos=drone_start)
-
-            dur = 3
-            for cycle in Periodic(duration=dur, period=self.period_s):
-                t = cycle*self.period_s
-                p0 = np.array(drone_start)
-                p1 = np.array(drone_end)
-                pos = np.add(drone_start, np.subtract(drone_end, drone_start)*t/dur)
-                swarm.follow_controller(controller)
-                CFUtil.set_abs_pos(scf=scf1, pos=tuple(pos))
-
-            for cycle in Periodic(duration=3, period=self.period_s):
-                swarm.follow_controller(controller)
-                CFUtil.set_abs_pos(scf=scf1, pos=drone_end)
-
-            controller.remove_ignore(ignore_list)
-
-            controller.set_ref(new_ref=(0, 0, 0.5))
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            # state = swarm.get_state()
-            # swarm.parallel(CFUtil.land, args_dict=CFUtil.get_land_dict(state=state))
-
-        elif sequence == Sequences.CONTROLLER_SEQ:
-            controller.reset()
-            controller.set_ref(new_ref=(0, 0, 1.2))
-            for cycle in Periodic(duration=2, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, -0.5, 0.8))
-            for cycle in Periodic(duration=2, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0.5, 0, 1.5))
-            for cycle in Periodic(duration=2, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=2, period=self.period_s):
-                swarm.follow_controller(controller)
-
-        elif sequence == Sequences.SPIRAL:
-            z_pos_0 = 0.6
-            dur = 6
-            scale_x = 0.5
-            scale_y = 0.5
-            scale_z = 1.0
-
-            controller.set_ref(new_ref=(0, 0, z_pos_0))
-            for cycle in Periodic(duration=2, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-            for cycle in Periodic(duration=dur, period=self.period_s):
-                progress = cycle * self.period_s / dur
-                angle = progress * 2 * math.pi
-                x_pos = math.cos(angle*2) * scale_x
-                y_pos = math.sin(angle*2) * scale_y
-                z_pos = z_pos_0 + progress * scale_z
-                controller.set_ref(new_ref=(x_pos, y_pos, z_pos))
-                swarm.follow_controller(controller=controller)
-
-            for cycle in Periodic(duration=1, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-        # Useful standards here
-        # Take off and land
-        # More space to read
-
-        elif sequence == Sequences.TAKE_OFF_STANDARD:
-            # Lift off
-            swarm.parallel(func=CFUtil.take_off)
-            controller.reset()
-            controller.set_ref(new_ref=(0, 0, 1))
-
-        elif sequence == Sequences.LAND_UNSAFE:
-            # Descend and turn off
-            state = swarm.get_state()
-            swarm.parallel(CFUtil.land, args_dict=CFUtil.get_land_dict(state=state))
-
-        # ALL CASES MENTIONED IN REPORT START HERE
-        # Naming should be consistent with report
-
-        elif sequence == Sequences.ROBOT_LAB_1:
-            #for cycle in Periodic(duration=5, period=self.period_s):
-            #    swarm.parallel(CFUtil.set_abs_pos, args_dict=CFUtil.POS_HOVER)
-
-            z_pos = 1.3
-
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-            controller.set_ref(new_ref=(-0.7, -0.7, z_pos))
-            for cycle in Periodic(duration=3, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-            controller.set_ref(new_ref=(0.7, -0.7, z_pos))
-            for cycle in Periodic(duration=3, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-            controller.set_ref(new_ref=(0.7, 0.7, z_pos))
-            for cycle in Periodic(duration=3, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-            controller.set_ref(new_ref=(-0.7, 0.7, z_pos))
-            for cycle in Periodic(duration=3, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-            controller.set_ref(new_ref=(0, 0, 1))
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-        elif sequence == Sequences.ROBOT_LAB_2:
-            #for cycle in Periodic(duration=5, period=self.period_s):
-            #    swarm.parallel(CFUtil.set_abs_pos, args_dict=CFUtil.POS_HOVER)
-            z_pos_0 = 1.3
-            dur = 6
-            scale_x = 0.7
-            scale_y = 1.2
-            scale_z = 0.3
-
-            controller.set_ref(new_ref=(0, 0, z_pos_0))
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-            for cycle in Periodic(duration=dur, period=self.period_s):
-                angle = cycle*self.period_s/dur * 2*math.pi
-                x_pos = math.cos(angle)*scale_x
-                y_pos = math.sin(angle)*scale_y
-                z_pos = z_pos_0 + math.sin(2*angle)*scale_z
-                controller.set_ref(new_ref=(x_pos, y_pos, z_pos))
-                swarm.follow_controller(controller=controller)
-
-            controller.set_ref(new_ref=(0, 0, z_pos_0))
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-        elif sequence == Sequences.HOVER:
-            #for cycle in Periodic(duration=5, period=self.period_s):
-            #    swarm.parallel(CFUtil.set_abs_pos, args_dict=CFUtil.POS_HOVER)
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-        elif sequence == Sequences.STEP_Z_POS:
-            controller.set_ref((0, 0, 0.5))
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-            controller.set_ref((0, 0, 1.5))
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-        elif sequence == Sequences.STEP_Z_NEG:
-            controller.set_ref((0, 0, 1.5))
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-            controller.set_ref((0, 0, 0.5))
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-        elif sequence == Sequences.STEP_Y:
-            controller.set_ref((0, 0, 1))
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-            controller.set_ref((0, 1, 1))
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller=controller)
-
-        elif sequence == Sequences.RAMP_Z_POS:
-            start = (0, 0, 0.5)
-            end = (0, 0, 1.5)
-
-            controller.set_ref(new_ref=start)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            dur = 2
-            for cycle in Periodic(duration=dur, period=self.period_s):
-                t = cycle*self.period_s
-                pos = np.add(start, np.subtract(end, start)*t/dur)
-                controller.set_ref(pos)
-                swarm.follow_controller(controller)
-
-            controller.set_ref(end)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-
-        elif sequence == Sequences.RAMP_Z_NEG:
-            start = (0, 0, 1.5)
-            end = (0, 0, 0.5)
-
-            controller.set_ref(new_ref=start)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            dur = 2
-            for cycle in Periodic(duration=dur, period=self.period_s):
-                t = cycle*self.period_s
-                pos = np.add(start, np.subtract(end, start)*t/dur)
-                controller.set_ref(pos)
-                swarm.follow_controller(controller)
-
-            controller.set_ref(end)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-
-        elif sequence == Sequences.RAMP_Y:
-            start = (0, 0, 1)
-            end = (0, 1, 1)
-
-            controller.set_ref(new_ref=start)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            dur = 2
-            for cycle in Periodic(duration=dur, period=self.period_s):
-                t = cycle*self.period_s
-                pos = np.add(start, np.subtract(end, start)*t/dur)
-                controller.set_ref(pos)
-                swarm.follow_controller(controller)
-
-            controller.set_ref(end)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-
-        elif sequence == Sequences.MERGE_1_1_C:
-            start_1 = (0, -1, 1)
-            start_2 = (0, 1, 1)
-            merge_pos = (0, 0, 1)
-
-            uri1 = swarm.get_uris()[0]
-            scf1 = swarm.get_cfs()[uri1]
-            ignore_list = [uri1]
-            controller.add_ignore(ignore_list)
-
-            controller.set_ref(start_2)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-                CFUtil.set_abs_pos(scf=scf1, pos=start_1)
-
-            controller.remove_ignore(ignore_list)
-
-            controller.set_ref(merge_pos)
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-        elif sequence == Sequences.MERGE_1_1_1:
-            start_1 = (0, 0, 1)
-            start_2 = (0, 1, 1)
-            merge_pos = (0, 0, 1)
-
-            uri1 = swarm.get_uris()[0]
-            scf1 = swarm.get_cfs()[uri1]
-            ignore_list = [uri1]
-            controller.add_ignore(ignore_list)
-
-            controller.set_ref(start_2)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-                CFUtil.set_abs_pos(scf=scf1, pos=start_1)
-
-            controller.remove_ignore(ignore_list)
-
-            controller.set_ref(merge_pos)
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-        elif sequence == Sequences.MERGE_1_3_C:
-            start_1 = (0, -0.8, 1)
-            start_2 = (0, 0.8, 1)
-            merge_pos = (0, 0, 1)
-
-            uri1 = swarm.get_uris()[0]
-            scf1 = swarm.get_cfs()[uri1]
-            ignore_list = [uri1]
-            controller.add_ignore(ignore_list)
-
-            controller.set_ref(start_2)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-                CFUtil.set_abs_pos(scf=scf1, pos=start_1)
-
-            controller.remove_ignore(ignore_list)
-
-            controller.set_ref(merge_pos)
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-        elif sequence == Sequences.MERGE_1_3_3:
-            start_1 = (0, -1, 1)
-            start_2 = (0, 0, 1)
-            merge_pos = (0, 0, 1)
-
-            uri1 = swarm.get_uris()[0]
-            scf1 = swarm.get_cfs()[uri1]
-            ignore_list = [uri1]
-            controller.add_ignore(ignore_list)
-
-            controller.set_ref(start_2)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-                CFUtil.set_abs_pos(scf=scf1, pos=start_1)
-
-            controller.remove_ignore(ignore_list)
-
-            controller.set_ref(merge_pos)
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-        elif sequence == Sequences.MERGE_1_3_1:
-            start_1 = (0, 0, 1)
-            start_2 = (0, 1, 1)
-            merge_pos = (0, 0, 1)
-
-            uri1 = swarm.get_uris()[0]
-            scf1 = swarm.get_cfs()[uri1]
-            ignore_list = [uri1]
-            controller.add_ignore(ignore_list)
-
-            controller.set_ref(start_2)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-                CFUtil.set_abs_pos(scf=scf1, pos=start_1)
-
-            controller.remove_ignore(ignore_list)
-
-            controller.set_ref(merge_pos)
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-
-        elif sequence == Sequences.LEAVE_HOVER:
-            hover_pos = (-0.5, 0, 1)
-            branch_pos = (1, 0, 1)
-
-            uri1 = swarm.get_uris()[0]
-            scf1 = swarm.get_cfs()[uri1]
-            ignore_list = [uri1]
-
-            controller.set_ref(new_ref=hover_pos)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            controller.add_ignore(ignore_list)
-
-            for cycle in Periodic(duration=10, period=self.period_s):
-                swarm.follow_controller(controller)
-                CFUtil.set_abs_pos(scf=scf1, pos=branch_pos)
-
-            controller.remove_ignore(ignore_list)
-
-        elif sequence == Sequences.LEAVE_RAMP:
-            start = (0, -1, 1)
-            end = (0, 1, 1)
-            branch_pos = (1, 0, 1)
-
-            uri1 = swarm.get_uris()[0]
-            scf1 = swarm.get_cfs()[uri1]
-            ignore_list = [uri1]
-
-            controller.set_ref(new_ref=start)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-
-            dur = 2
-            for cycle in Periodic(duration=dur/2, period=self.period_s):
-                t = cycle * self.period_s
-                pos = np.add(start, np.subtract(end, start) * t / dur)
-                controller.set_ref(pos)
-                swarm.follow_controller(controller)
-
-            controller.add_ignore(ignore_list)
-
-            for cycle in Periodic(duration=dur/2, period=self.period_s):
-                t = cycle * self.period_s
-                pos = np.add(start, np.subtract(end, start) * (dur/2 + t) / dur)
-                controller.set_ref(pos)
-                swarm.follow_controller(controller)
-                CFUtil.set_abs_pos(scf=scf1, pos=branch_pos)
-
-            controller.set_ref(end)
-            for cycle in Periodic(duration=5, period=self.period_s):
-                swarm.follow_controller(controller)
-                CFUtil.set_abs_pos(scf=scf1, pos=branch_pos)
-
-            controller.remove_ignore(ignore_list)
-
-
-
+        else:
+            raise ValueError('Unknown sequence action ' + str(action))
+        return positions
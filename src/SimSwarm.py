@@ -0,0 +1,339 @@
+import math
+import threading
+from functools import partial
+import numpy as np
+
+from cflib.utils.callbacks import Caller
+from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
+
+from CFUtil import CFUtil
+from PyUtil import Periodic, LoopStats
+
+
+class PointMassModel:
+
+    MODE_STOP = 0
+    MODE_VELOCITY = 1
+    MODE_POSITION = 2
+
+    def __init__(self, count, positions=None, tau=0.2, kp=1.5, max_vel=1.0, setpoint_timeout=0.5):
+        """
+        Vectorized point mass model of n drones following velocity or position setpoints.
+        Velocities follow the requested velocity as a first order system with time constant tau. Position setpoints are
+        turned into velocity setpoints by a proportional controller. Stopped drones fall to the ground.
+        :param count: Number of drones
+        :param positions: Optional numpy array of size n-3 of start positions, defaults to a grid on the ground
+        :param tau: Velocity time constant in seconds
+        :param kp: Gain of the position controller
+        :param max_vel: Maximum speed in m/s
+        :param setpoint_timeout: Drones hover in place if no setpoint arrives within this time, like the firmware
+        """
+        self.count = count
+        self.tau = tau
+        self.kp = kp
+        self.max_vel = max_vel
+        self.setpoint_timeout = setpoint_timeout
+
+        if positions is None:
+            side = max(1, int(math.ceil(math.sqrt(count))))
+            positions = [((i % side)*0.5, (i // side)*0.5, 0) for i in range(count)]
+        self.pos = np.array(positions, dtype=float).reshape(count, 3)
+        self.vel = np.zeros((count, 3))
+
+        self.mode = np.full(count, PointMassModel.MODE_STOP)
+        self.setpoint = np.zeros((count, 3))
+        self.setpoint_age = np.zeros(count)
+
+    def set_velocity(self, index, vel):
+        self.setpoint[index] = vel
+        self.mode[index] = PointMassModel.MODE_VELOCITY
+        self.setpoint_age[index] = 0
+
+    def set_position(self, index, pos):
+        self.setpoint[index] = pos
+        self.mode[index] = PointMassModel.MODE_POSITION
+        self.setpoint_age[index] = 0
+
+    def stop(self, index):
+        self.mode[index] = PointMassModel.MODE_STOP
+
+    def step(self, dt):
+        """
+        Advance all drones dt seconds
+        """
+        vel_sp = np.zeros((self.count, 3))
+
+        velocity = self.mode == PointMassModel.MODE_VELOCITY
+        vel_sp[velocity] = self.setpoint[velocity]
+
+        position = self.mode == PointMassModel.MODE_POSITION
+        vel_sp[position] = self.kp*(self.setpoint[position] - self.pos[position])
+
+        # Hover in place on lost setpoints, fall when stopped
+        self.setpoint_age += dt
+        vel_sp[self.setpoint_age > self.setpoint_timeout] = 0
+        vel_sp[self.mode == PointMassModel.MODE_STOP] = (0, 0, -self.max_vel)
+
+        # Limit speed
+        speed = np.linalg.norm(vel_sp, axis=1)
+        too_fast = speed > self.max_vel
+        vel_sp[too_fast] = vel_sp[too_fast]*(self.max_vel/speed[too_fast])[:, np.newaxis]
+
+        self.vel += (vel_sp - self.vel)*min(1.0, dt/self.tau)
+        self.pos += self.vel*dt
+
+        # Ground
+        grounded = self.pos[:, 2] < 0
+        self.pos[grounded, 2] = 0
+        self.vel[grounded] = 0
+
+
+class SimSwarm:
+    """
+    Headless simulated swarm replacing the radio, for load testing without hardware.
+
+    Implements the parts of the Crazyflie API used by CFUtil and AsyncSwarm: connection callbacks, parameter download,
+    log blocks and commander setpoints. Drones follow a PointMassModel integrated at a fixed rate, either in a
+    background thread (start/stop) or manually through step().
+
+    The SimSwarm is also the Crazyflie factory passed to AsyncSwarm:
+        sim = SimSwarm(count=100)
+        sim.start()
+        swarm = AsyncSwarm(uri_indices=(), uris=sim.uris, factory=sim)
+        swarm.start()
+    """
+
+    # Estimator variance after reset and its decay time constant in seconds
+    VARIANCE_RESET = 1.0
+    VARIANCE_TAU = 0.2
+
+    def __init__(self, count, positions=None, rate_hz=100, connect_delay=0.0, battery_mv=4100, diverging=()):
+        """
+        :param count: Number of simulated drones
+        :param positions: Optional numpy array of size n-3 of start positions
+        :param rate_hz: Integration rate of the model
+        :param connect_delay: Simulated time for connection and TOC download in seconds
+        :param battery_mv: Battery voltage reported by all drones
+        :param diverging: Indices of drones whose estimator variance keeps oscillating and never converges
+        """
+        self.uris = tuple('sim://' + str(i) for i in range(count))
+        self.model = PointMassModel(count, positions=positions)
+        self.period = 1.0/rate_hz
+        self.connect_delay = connect_delay
+        self.battery_mv = battery_mv
+        self.diverging = set(diverging)
+        self.time = 0.0
+        self.stats = LoopStats()
+
+        self._index = {uri: i for i, uri in enumerate(self.uris)}
+        self._reset_time = np.zeros(count)
+        self._blocks = []
+        self._running = False
+        self._thread = None
+
+    def construct(self, uri):
+        """
+        Factory interface, see AsyncSwarm.CfFactory
+        :return: SyncCrazyflie wrapping a simulated Crazyflie
+        """
+        return SyncCrazyflie(uri, SimCrazyflie(self, self._index[uri]))
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(name='SimSwarm', target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        for cycle in Periodic(duration=None, period=self.period, overrun=Periodic.SKIP, stats=self.stats):
+            if not self._running:
+                break
+            self.step()
+
+    def step(self):
+        """
+        Advance the simulation one period and deliver all log data that is due
+        """
+        self.model.step(self.period)
+        self.time = self.time + self.period
+
+        timestamp = int(self.time*1000)
+        for block in list(self._blocks):
+            if block[0] <= self.time + 1e-9:
+                block[0] = block[0] + block[1].period_in_ms/1000
+                logconf = block[1]
+                logconf.data_received_cb.call(timestamp, self.get_log_data(block[2], logconf), logconf)
+
+    def get_log_data(self, index, logconf):
+        values = self.get_values(index)
+        return {var.name: values[var.name] for var in logconf.variables}
+
+    def get_values(self, index):
+        """
+        All log variables available for one drone
+        :return: dict{log variable: value}
+        """
+        pos = self.model.pos[index].tolist()
+        vel = self.model.vel[index].tolist()
+        variance = SimSwarm.VARIANCE_RESET*math.exp(-(self.time - self._reset_time[index])/SimSwarm.VARIANCE_TAU)
+        if index in self.diverging:
+            variance = SimSwarm.VARIANCE_RESET*(1 + math.sin(2*math.pi*self.time))/2
+        return {CFUtil.KEY_X: pos[0], CFUtil.KEY_Y: pos[1], CFUtil.KEY_Z: pos[2],
+                CFUtil.KEY_DX: vel[0], CFUtil.KEY_DY: vel[1], CFUtil.KEY_DZ: vel[2],
+                CFUtil.KEY_BAT: self.battery_mv,
+                'kalman.varPX': variance, 'kalman.varPY': variance, 'kalman.varPZ': variance}
+
+    def reset_estimator(self, index):
+        self._reset_time[index] = self.time
+
+    def add_log_block(self, index, logconf):
+        self._blocks.append([self.time + logconf.period_in_ms/1000, logconf, index])
+
+    def remove_log_block(self, logconf):
+        self._blocks = [block for block in self._blocks if block[1] is not logconf]
+
+
+class SimCrazyflie:
+
+    def __init__(self, sim, index):
+        """
+        Simulated Crazyflie, drop in replacement for cflib.crazyflie.Crazyflie as far as this project uses it
+        :param sim: SimSwarm the drone belongs to
+        :param index: Index of the drone in the simulation
+        """
+        self._sim = sim
+        self._index = index
+
+        self.connected = Caller()
+        self.disconnected = Caller()
+        self.connection_failed = Caller()
+        self.connection_lost = Caller()
+        self.fully_connected = Caller()
+
+        self.link = None
+        self.link_uri = ''
+        self.log = SimLog(self)
+        self.param = SimParam(self)
+        self.commander = SimCommander(sim.model, index)
+
+    def open_link(self, link_uri):
+        """
+        Returns at once, connected callbacks are called from another thread once the simulated connection is done
+        """
+        self.link_uri = link_uri
+        timer = threading.Timer(self._sim.connect_delay, self._connect)
+        timer.daemon = True
+        timer.start()
+
+    def _connect(self):
+        self.link = self
+        self.connected.call(self.link_uri)
+        self.param.set_updated()
+        self.fully_connected.call(self.link_uri)
+
+    def close_link(self):
+        for logconf in self.log.log_blocks:
+            self._sim.remove_log_block(logconf)
+        self.link = None
+        self.disconnected.call(self.link_uri)
+
+    def is_connected(self):
+        return self.link is not None
+
+    def send_packet(self, pk, expected_reply=(), resend=False, timeout=0.2):
+        pass
+
+    def reset_estimator(self):
+        self._sim.reset_estimator(self._index)
+
+    def add_log_block(self, logconf):
+        self._sim.add_log_block(self._index, logconf)
+
+    def remove_log_block(self, logconf):
+        self._sim.remove_log_block(logconf)
+
+
+class SimLog:
+
+    def __init__(self, cf):
+        self.cf = cf
+        self.log_blocks = []
+        self._config_id_counter = 0
+
+    def add_config(self, logconf):
+        """
+        Validate and register a cflib LogConfig. start/stop/delete of the config are redirected to the simulation.
+        """
+        values = self.cf._sim.get_values(0) if self.cf._sim.model.count > 0 else {}
+        for var in logconf.variables:
+            if var.name not in values:
+                logconf.valid = False
+                raise KeyError('Variable {} not in TOC'.format(var.name))
+
+        logconf.valid = True
+        logconf.cf = self.cf
+        logconf.id = self._config_id_counter
+        self._config_id_counter = (self._config_id_counter + 1) % 255
+
+        logconf.start = partial(self._start, logconf)
+        logconf.stop = partial(self._stop, logconf)
+        logconf.delete = partial(self._delete, logconf)
+        self.log_blocks.append(logconf)
+
+    def _start(self, logconf):
+        logconf.added = True
+        self.cf.add_log_block(logconf)
+        logconf.started = True
+
+    def _stop(self, logconf):
+        self.cf.remove_log_block(logconf)
+        logconf.started = False
+
+    def _delete(self, logconf):
+        self.cf.remove_log_block(logconf)
+        logconf.added = False
+        # New list, callers may be iterating the old one
+        self.log_blocks = [block for block in self.log_blocks if block is not logconf]
+
+
+class SimParam:
+
+    def __init__(self, cf):
+        self.cf = cf
+        self.all_updated = Caller()
+        self.is_updated = False
+        self.values = {}
+
+    def set_updated(self):
+        self.is_updated = True
+        self.all_updated.call()
+
+    def set_value(self, complete_name, value):
+        self.values[complete_name] = value
+        if complete_name == 'kalman.resetEstimation' and str(value) == '1':
+            self.cf.reset_estimator()
+
+
+class SimCommander:
+
+    def __init__(self, model, index):
+        self._model = model
+        self._index = index
+
+    def send_velocity_world_setpoint(self, vx, vy, vz, yawrate):
+        self._model.set_velocity(self._index, (vx, vy, vz))
+
+    def send_position_setpoint(self, x, y, z, yaw):
+        self._model.set_position(self._index, (x, y, z))
+
+    def send_setpoint(self, roll, pitch, yaw, thrust):
+        # Attitude is not simulated, any thrust is treated as climbing
+        self._model.set_velocity(self._index, (0, 0, 0.5 if thrust > 0 else 0))
+
+    def send_stop_setpoint(self):
+        self._model.stop(self._index)
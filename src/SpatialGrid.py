@@ -0,0 +1,101 @@
+import itertools
+import numpy as np
+
+
+class SpatialGrid:
+    """
+    Uniform grid spatial index over drone positions, rebuilt from the state array every controller tick.
+
+    Cells are cubes with sides equal to the cutoff radius, so every neighbour within the cutoff of a drone is found in
+    its own cell or one of the 26 surrounding cells. Only half of the surrounding cells are searched from each cell,
+    which visits every pair of cells exactly once.
+
+    Example:
+        grid = SpatialGrid(cutoff=1.5)
+        grid.rebuild(states[:, 0:3])
+        i, j = grid.pairs()
+    """
+
+    # The cell itself followed by the 13 neighbouring cells "after" it
+    OFFSETS = np.array([(0, 0, 0)] + [offset for offset in itertools.product((-1, 0, 1), repeat=3)
+                                      if offset > (0, 0, 0)], dtype=np.int64)
+
+    def __init__(self, cutoff):
+        """
+        :param cutoff: Interaction radius in meters, also used as cell size
+        """
+        self.cutoff = float(cutoff)
+        self.positions = np.zeros((0, 3))
+
+        self._order = np.zeros(0, dtype=np.int64)
+        self._codes = np.zeros(0, dtype=np.int64)
+        self._starts = np.zeros(0, dtype=np.int64)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._strides = np.ones(3, dtype=np.int64)
+
+    def rebuild(self, positions):
+        """
+        Sort all drones into grid cells
+        :param positions: numpy array of size n-3 containing x-y-z
+        """
+        self.positions = positions
+        if len(positions) == 0:
+            self._codes = np.zeros(0, dtype=np.int64)
+            return
+
+        # Integer cell coordinates, padded by one cell on each side so neighbour codes never wrap around
+        cells = np.floor(positions / self.cutoff).astype(np.int64)
+        cells = cells - cells.min(axis=0) + 1
+        shape = cells.max(axis=0) + 2
+        self._strides = np.array([shape[1]*shape[2], shape[2], 1], dtype=np.int64)
+
+        codes = cells @ self._strides
+        self._order = np.argsort(codes, kind='stable')
+        self._codes, self._starts, self._counts = np.unique(codes[self._order], return_index=True, return_counts=True)
+
+    def pairs(self):
+        """
+        Find all drone pairs closer than the cutoff radius
+        :return: index arrays i, j with i < j, one entry per pair
+        """
+        if len(self._codes) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        first = []
+        second = []
+        for offset in self.OFFSETS:
+            # Look up the neighbouring cell of every occupied cell
+            neighbour = self._codes + offset @ self._strides
+            found = np.searchsorted(self._codes, neighbour)
+            found = np.minimum(found, len(self._codes) - 1)
+            exists = self._codes[found] == neighbour
+            cell_a = np.flatnonzero(exists)
+            cell_b = found[exists]
+
+            # Expand every pair of cells into all member pairs
+            count_a = self._counts[cell_a]
+            count_b = self._counts[cell_b]
+            sizes = count_a*count_b
+            pair = np.repeat(np.arange(len(sizes)), sizes)
+            local = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            member_a = local // count_b[pair]
+            member_b = local % count_b[pair]
+            if not offset.any():
+                # Same cell, keep each unordered pair once
+                keep = member_a < member_b
+                pair, member_a, member_b = pair[keep], member_a[keep], member_b[keep]
+
+            first.append(self._order[self._starts[cell_a][pair] + member_a])
+            second.append(self._order[self._starts[cell_b][pair] + member_b])
+
+        i = np.concatenate(first)
+        j = np.concatenate(second)
+
+        # Cells overlap the cutoff sphere only partially, remove candidates outside of it
+        within = np.linalg.norm(self.positions[i] - self.positions[j], axis=1) < self.cutoff
+        i, j = i[within], j[within]
+
+        # Sort pairs for reproducible summation order
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        order = np.lexsort((j, i))
+        return i[order], j[order]
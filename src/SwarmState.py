@@ -0,0 +1,179 @@
+import time
+import threading
+import numpy as np
+
+from CFUtil import CFUtil
+
+
+class SwarmState:
+    """
+    Live state of the swarm, stored as one preallocated float64 matrix with a fixed row per drone.
+
+    Columns are ordered as SwarmState.KEYS: x, y, z, vx, vy, vz, vbat. Log callbacks write their row in place and
+    controllers read the matrix directly, no dictionaries are built on the hot path.
+
+    Readers never lock the log callbacks. Every row carries a sequence counter which the writer makes odd before and
+    even after updating the row (a seqlock). snapshot() copies all rows and retries the rows that were being written
+    during the copy, so the snapshot is free of torn rows. Each row must only be written by one thread at a time,
+    which holds as every drone has its own log callback.
+
+    For older code the object also behaves like the previous dict{uri: dict{key: value}} state,
+    ex: x = state[URI1]['kalman.stateX']. Rows that have not received any data yet are returned as empty dicts.
+    """
+    KEYS = CFUtil.KEYS_STATE + (CFUtil.KEY_BAT,)
+
+    def __init__(self, uris=()):
+        """
+        :param uris: Drone uris, the order defines the row of each drone
+        """
+        self.uris = tuple(uris)
+        self.index = {uri: row for row, uri in enumerate(self.uris)}
+        self.seq = np.zeros(len(self.uris), dtype=np.int64)
+        self.updated = threading.Event()
+
+        # State, log timestamp and arrival time share one buffer so a snapshot is a single copy
+        self._set_buffer(np.zeros((len(self.uris), len(SwarmState.KEYS) + 2)))
+        self.array[:] = np.nan
+
+    def _set_buffer(self, buffer):
+        self._buffer = buffer
+        self.array = buffer[:, 0:len(SwarmState.KEYS)]
+        self.timestamps = buffer[:, -2]
+        self.arrival = buffer[:, -1]
+
+    def write(self, uri, timestamp, data):
+        """
+        Write incoming log data into the row of the drone
+        :param uri: Drone uri
+        :param timestamp: Timestamp supplied by the log API
+        :param data: dict{key: value} as supplied by the log API, missing keys are stored as NaN
+        """
+        row = self.index[uri]
+        values = [data.get(key, np.nan) for key in SwarmState.KEYS]
+        values.append(timestamp)
+        values.append(time.time())
+
+        # Odd sequence number marks the row as being written
+        self.seq[row] += 1
+        self._buffer[row] = values
+        self.seq[row] += 1
+        self.updated.set()
+
+    def get_matrix(self):
+        """
+        View of the state matrix without battery column
+        :return: numpy array of size n-6 containing x-y-z-dx-dy-dz, rows ordered as self.uris
+        """
+        return self.array[:, 0:6]
+
+    def get_valid(self):
+        """
+        Rows holding a complete state, False for drones that have not sent any data yet
+        :return: boolean numpy array, rows ordered as self.uris
+        """
+        return np.isfinite(self.array[:, 0:6]).all(axis=1)
+
+    def get_last_seen(self):
+        """
+        Last time each drone was heard from
+        :return: dict{uri: [log timestamp, local time]}
+        """
+        return {uri: [self.timestamps[row], self.arrival[row]] for row, uri in enumerate(self.uris)}
+
+    def snapshot(self, out=None):
+        """
+        Consistent copy of the current state, safe to call while log callbacks are writing
+        :param out: Optional SwarmState to copy into, reused if it has the same uris to avoid allocation
+        :return: SwarmState snapshot, a complete SwarmState of its own. Only writes to the snapshot set its updated
+        event
+        """
+        if out is None or out.uris != self.uris:
+            out = SwarmState(self.uris)
+
+        rows = slice(None)
+        while True:
+            seq = self.seq[rows].copy()
+            out._buffer[rows] = self._buffer[rows]
+            out.seq[rows] = seq
+
+            # Retry rows that were written during the copy
+            torn = (seq != self.seq[rows]) | (seq % 2 == 1)
+            if not torn.any():
+                return out
+            rows = np.flatnonzero(torn) if isinstance(rows, slice) else rows[torn]
+            time.sleep(0)
+
+    def wait_for_update(self, since, timeout):
+        """
+        Block until every drone has written new data, or until timeout
+        :param since: Sequence numbers to compare against, usually seq of the previous snapshot. None waits for nothing
+        :param timeout: Maximum time to wait in seconds
+        :return: True if all drones have new data, False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            # Clear before checking, a write after the check sets the event again and ends the wait
+            self.updated.clear()
+            if since is None or len(since) != len(self.seq) or np.all(self.seq > since):
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.updated.wait(remaining)
+
+    def copy(self):
+        """
+        Consistent copy of the current state, see snapshot()
+        """
+        return self.snapshot()
+
+    def add(self, uri):
+        """
+        Add a row for a new drone. Reallocates all arrays, not meant to be called while logging.
+        """
+        if uri in self.index:
+            return
+        state = SwarmState(self.uris + (uri,))
+        state._buffer[:-1] = self._buffer
+        self._replace(state)
+
+    def remove(self, uri):
+        """
+        Remove the row of a drone. Reallocates all arrays, not meant to be called while logging.
+        """
+        if uri not in self.index:
+            return
+        keep = [row for row, other in enumerate(self.uris) if other != uri]
+        state = SwarmState([self.uris[row] for row in keep])
+        state._buffer[:] = self._buffer[keep]
+        self._replace(state)
+
+    def _replace(self, state):
+        self.uris = state.uris
+        self.index = state.index
+        self.seq = state.seq
+        self._set_buffer(state._buffer)
+
+    def __getitem__(self, uri):
+        row = self.index[uri]
+        if self.arrival[row] == 0:
+            return {}
+        return dict(zip(SwarmState.KEYS, self.array[row].tolist()))
+
+    def __contains__(self, uri):
+        return uri in self.index
+
+    def __iter__(self):
+        return iter(self.uris)
+
+    def __len__(self):
+        return len(self.uris)
+
+    def keys(self):
+        return list(self.uris)
+
+    def values(self):
+        return [self[uri] for uri in self.uris]
+
+    def items(self):
+        return [(uri, self[uri]) for uri in self.uris]
@@ -1,51 +1,215 @@
 from threading import Thread
+import itertools
 import queue
 import time
 
 from Sequences import Sequences
+from PyUtil import Periodic, LoopStats
 
 
 class SwarmThread(Thread):
+    """
+    Runs queued sequences on the swarm, one tick per period, and follows the controller while no sequence runs.
 
-    def __init__(self, swarm, controller, period_ms=20):
+    Sequences are generators from Sequences.start advanced once per period by this thread, so pause, stop and new
+    sequences are serviced every tick even during long sequences. The queue is ordered by priority, then by
+    submission. A sequence submitted with a more urgent priority than the running one preempts it on the next tick.
+
+    Example:
+        thread = SwarmThread(swarm, controller)
+        thread.start()
+        thread.submit(Sequences.STEP_Z_POS)
+        ...
+        thread.submit(Sequences.LAND_UNSAFE, priority=SwarmThread.EMERGENCY)
+    """
+
+    # Priorities, lower runs first
+    EMERGENCY = 0
+    HIGH = 5
+    NORMAL = 10
+
+    def __init__(self, swarm, controller, period_ms=20, maxsize=15, log=None):
         """
         Calls function on swarm at specified intervals when running.
         :param swarm: AsyncSwarm object to retrieve state from
         :param controller: Controller function to execute, passes swarm state as parameter
         :param period_ms: Period at which to call function, in milliseconds
+        :param maxsize: Maximum number of queued sequences
+        :param log: Optional LogManager, start, end and preemption of sequences are recorded as events
         """
         Thread.__init__(self)
-        self.queue = queue.Queue(maxsize=15)
+        self.queue = queue.PriorityQueue(maxsize=maxsize)
+        self._order = itertools.count()
 
         self.paused = False
 
         self.swarm = swarm
         self.controller = controller
+        self.log = log
         self._period_ms = period_ms
         self._seq = Sequences(period_ms=self._period_ms)
 
+        # Running sequence, only touched by the thread
+        self._current = None
+        self._current_item = None
+        # Number of sequences started, only written by the thread. The running sequence is aborted on the next tick
+        # while _starts <= _preempt, so a request can only abort sequences started before it was made
+        self._starts = 0
+        self._preempt = 0
+
         self.running = True
         self.starttime = None
+        self.stats = LoopStats()
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.preempted = 0
+        self.failed = 0
+        self._depth_sum = 0
+        self._depth_samples = 0
+        self._depth_max = 0
+        self._wait_sum = 0.0
+        self._wait_max = 0.0
+        self._dequeued = 0
 
     def run(self):
         self.starttime = time.time()
-        while self.running:
-            if not self.paused:
-                if not self.queue.empty():
-                    msg = None
-                    try:
-                        msg = self.queue.get_nowait()
-                        self._seq.run(swarm=self.swarm, controller=self.controller, sequence=msg['seq'])
-                    except queue.Empty:
-                        print('Error, get called on empty queue in SwarmThread.')
-                else:
-                    self.swarm.follow_controller(self.controller)
-
-            # Sleep until next call interval happens
-            current_time = time.time()
-            d_time = (current_time - self.starttime)
-            sleeptime = (self._period_ms - ((d_time * 1000.0) % self._period_ms)) / 1000.0
-            time.sleep(sleeptime)
+        for cycle in Periodic(duration=None, period=self._period_ms/1000, overrun=Periodic.SKIP, stats=self.stats):
+            if not self.running:
+                break
+            self.tick()
+        self._abort()
+
+    def tick(self):
+        """
+        One period of the thread, called by run. Preemption is handled while paused, sequences only advance when not.
+        """
+        depth = self.queue.qsize()
+        self._depth_sum = self._depth_sum + depth
+        self._depth_samples = self._depth_samples + 1
+        self._depth_max = max(self._depth_max, depth)
+
+        if self._current is not None and (self._starts <= self._preempt or self._urgent_queued()):
+            self._abort()
+        if self.paused:
+            return
+
+        if self._current is None:
+            self._next()
+        if self._current is None:
+            self.swarm.follow_controller(self.controller)
+            return
+
+        try:
+            if next(self._current, None) is None:
+                self.completed = self.completed + 1
+                self._current = None
+                self._current_item = None
+        except Exception as e:
+            print('Error in sequence ' + str(self._current_item[4]) + ': ' + str(e))
+            self.failed = self.failed + 1
+            self._current = None
+            self._current_item = None
+
+    def _next(self):
+        try:
+            item = self.queue.get_nowait()
+        except queue.Empty:
+            return
+        wait = time.monotonic() - item[2]
+        self._wait_sum = self._wait_sum + wait
+        self._wait_max = max(self._wait_max, wait)
+        self._dequeued = self._dequeued + 1
+        self._starts = self._starts + 1
+        self._current_item = item
+        self._current = self._seq.start(swarm=self.swarm, controller=self.controller, sequence=item[3], log=self.log)
+
+    def _urgent_queued(self):
+        """
+        :return: True if a queued sequence has a more urgent priority than the running one
+        """
+        with self.queue.mutex:
+            if len(self.queue.queue) == 0:
+                return False
+            head = self.queue.queue[0]
+            return head[0] < self._current_item[0] and head[5] is not False
+
+    def _abort(self):
+        if self._current is not None:
+            self._current.close()
+            self.preempted = self.preempted + 1
+            self._current = None
+            self._current_item = None
+
+    def submit(self, sequence, priority=NORMAL, name=None, preempt=None):
+        """
+        Queue a sequence, safe to call from any thread
+        :param sequence: ID of sequence, keys available in Sequences class, or a list of Step
+        :param priority: Queue priority, see constants of SwarmThread
+        :param name: Readable name of the sequence
+        :param preempt: True to abort the sequence running when submitted on the next tick, None to abort the running
+        sequence once this one is the most urgent queued and more urgent than it, False to never abort it
+        :return: False if the queue is full
+        """
+        # Read before queueing, the new sequence itself is never preempted by this request
+        started = self._starts
+        try:
+            self.queue.put_nowait((priority, next(self._order), time.monotonic(), sequence, name, preempt))
+        except queue.Full:
+            self.rejected = self.rejected + 1
+            return False
+        self.submitted = self.submitted + 1
+
+        if preempt:
+            self._preempt = started
+        return True
+
+    def stop_sequence(self, clear=True):
+        """
+        Abort the running sequence on the next tick, the swarm then follows the controller
+        :param clear: True to also drop all queued sequences
+        """
+        if clear:
+            self.clear()
+        self._preempt = self._starts
+
+    def clear(self):
+        """
+        Drop all queued sequences
+        :return: Number of dropped sequences
+        """
+        dropped = 0
+        while True:
+            try:
+                self.queue.get_nowait()
+                dropped = dropped + 1
+            except queue.Empty:
+                return dropped
+
+    def get_current(self):
+        """
+        :return: (sequence, name) of the running sequence, None if the swarm follows the controller
+        """
+        item = self._current_item
+        return None if item is None else (item[3], item[4])
+
+    def get_metrics(self):
+        """
+        :return: dict of queue metrics
+            depth               Sequences queued now
+            max_depth           Largest queue depth seen at a tick
+            mean_depth          Mean queue depth over all ticks
+            mean_wait           Mean time in seconds sequences waited in the queue
+            max_wait            Longest wait in the queue in seconds
+            submitted, rejected, completed, preempted, failed
+                                Sequence counts, rejected when the queue was full
+        """
+        return {'depth': self.queue.qsize(), 'max_depth': self._depth_max,
+                'mean_depth': self._depth_sum/self._depth_samples if self._depth_samples > 0 else 0.0,
+                'mean_wait': self._wait_sum/self._dequeued if self._dequeued > 0 else 0.0,
+                'max_wait': self._wait_max, 'submitted': self.submitted, 'rejected': self.rejected,
+                'completed': self.completed, 'preempted': self.preempted, 'failed': self.failed}
 
     def stop(self):
         self.running = False
@@ -53,6 +217,7 @@ class SwarmThread(Thread):
             self.join()
         except RuntimeError as e:
             print('Attempted join on unstarted SwarmThread')
+            self._abort()
 
     def pause(self):
         self.paused = True
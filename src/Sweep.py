@@ -0,0 +1,188 @@
+import os
+import csv
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from SimSwarm import PointMassModel
+from SwarmState import SwarmState
+
+
+class Sweep:
+    """
+    Closed loop parameter sweep of swarm controllers over the point mass model, spread over all cores.
+
+    Every run flies a reference profile with one controller configuration: the controller computes velocity setpoints
+    from the simulated state every period and the model follows them, no radio or wall clock involved.
+    Profiles are lists of segments in the style of Sequences, (duration_s, ref) holds a reference and
+    (duration_s, start_ref, end_ref) ramps linearly between two references.
+
+    Example:
+        sweep = Sweep(ControllerFactory(FlockingController), profile=Sweep.STEP_Z, count=4)
+        results = sweep.run([{'k': k} for k in np.linspace(0.5, 2, 16)], seeds=range(4))
+        Sweep.write_csv(results, 'output/sweep.csv')
+    """
+
+    HOVER = [(10, (0, 0, 1))]
+    STEP_Z = [(5, (0, 0, 1)), (5, (0, 0, 1.5))]
+    STEP_Y = [(5, (0, 0, 1)), (5, (0, 1, 1))]
+    RAMP_Y = [(2, (0, 0, 1)), (4, (0, 0, 1), (0, 1, 1)), (4, (0, 1, 1))]
+
+    def __init__(self, factory, profile=STEP_Z, count=4, period_ms=50, model_period_ms=10, spacing=0.5,
+                 settle_tolerance=0.1):
+        """
+        :param factory: Function returning a new controller for a configuration, ex: Replay.ControllerFactory.
+        Must be picklable to run on the process pool
+        :param profile: Reference profile, list of segments
+        :param count: Number of simulated drones
+        :param period_ms: Controller period
+        :param model_period_ms: Integration step of the model, period_ms should be a multiple of it
+        :param spacing: Distance between drones in the start grid
+        :param settle_tolerance: Distance from the swarm center to the reference counted as settled
+        """
+        self.factory = factory
+        self.profile = profile
+        self.count = count
+        self.period = period_ms/1000
+        self.substeps = max(1, int(round(period_ms/model_period_ms)))
+        self.spacing = spacing
+        self.settle_tolerance = settle_tolerance
+
+    def get_refs(self):
+        """
+        Reference of every controller step of the profile
+        :return: numpy array of size steps-3, numpy array with the segment index of each step
+        """
+        refs = []
+        segments = []
+        for index, segment in enumerate(self.profile):
+            steps = int(round(segment[0]/self.period))
+            start = np.array(segment[1], dtype=float)
+            end = np.array(segment[2] if len(segment) > 2 else segment[1], dtype=float)
+            ratio = np.arange(steps)[:, np.newaxis]/max(steps, 1)
+            refs.append(start + (end - start)*ratio)
+            segments.append(np.full(steps, index))
+        return np.concatenate(refs), np.concatenate(segments)
+
+    def get_start(self, seed):
+        """
+        Start positions, a grid around the first reference with random offsets
+        """
+        rng = np.random.default_rng(seed)
+        side = int(np.ceil(np.sqrt(self.count)))
+        grid = np.array([((i % side) - (side - 1)/2, (i // side) - (side - 1)/2, 0) for i in range(self.count)])
+        return grid*self.spacing + self.profile[0][1] + rng.uniform(-0.1, 0.1, (self.count, 3))*self.spacing
+
+    def simulate(self, config, seed=0):
+        """
+        Fly the profile once
+        :param config: Controller configuration passed to the factory
+        :param seed: Seed of the start position offsets
+        :return: dict of metrics, see get_metrics
+        """
+        refs, segments = self.get_refs()
+        model = PointMassModel(self.count, positions=self.get_start(seed))
+        controller = self.factory(config)
+        uris = ['sim://' + str(i) for i in range(self.count)]
+        state = SwarmState(uris)
+        state.arrival[:] = 1
+
+        positions = np.empty((len(refs), self.count, 3))
+        u_all = np.empty((len(refs), self.count, 3))
+        for step, ref in enumerate(refs):
+            state.array[:, 0:3] = model.pos
+            state.array[:, 3:6] = model.vel
+            controller.set_ref(ref)
+            controller.compute(state)
+            u = controller.get_u_batch()[1]
+
+            model.set_velocity(slice(None), u)
+            for i in range(self.substeps):
+                model.step(self.period/self.substeps)
+            positions[step] = model.pos
+            u_all[step] = u
+
+        return self.get_metrics(refs, segments, positions, u_all)
+
+    def get_metrics(self, refs, segments, positions, u):
+        """
+        :return: dict containing
+            settling_time   Longest time of all segments until the swarm center stays within settle_tolerance of the
+                            reference, NaN if any segment does not settle
+            final_error     Distance between swarm center and reference at the end
+            min_distance    Smallest distance between any two drones during the run
+            effort          Integral of the squared setpoint speed, mean over drones
+            max_speed       Largest setpoint speed
+        """
+        error = np.linalg.norm(positions.mean(axis=1) - refs, axis=1)
+        outside = error > self.settle_tolerance
+
+        settling_time = 0.0
+        for index in np.unique(segments):
+            steps = np.flatnonzero(segments == index)
+            late = np.flatnonzero(outside[steps])
+            if len(late) == 0:
+                continue
+            if late[-1] == len(steps) - 1:
+                settling_time = np.nan
+                break
+            settling_time = max(settling_time, (late[-1] + 1)*self.period)
+
+        min_distance = np.inf
+        if self.count > 1:
+            i, j = np.triu_indices(self.count, 1)
+            min_distance = np.linalg.norm(positions[:, i] - positions[:, j], axis=2).min()
+
+        speed2 = np.einsum('tij,tij->ti', u, u)
+        return {'settling_time': float(settling_time), 'final_error': float(error[-1]),
+                'min_distance': float(min_distance), 'effort': float(speed2.sum(axis=0).mean()*self.period),
+                'max_speed': float(np.sqrt(speed2.max()))}
+
+    def run(self, configs, seeds=(0,), workers=None):
+        """
+        Simulate every configuration with every seed
+        :param configs: List of controller configurations
+        :param seeds: Start position seeds
+        :param workers: Number of processes, defaults to all cores. 0 runs in this process.
+        :return: Results table as list of dict, one row per run containing config, seed and metrics or error
+        """
+        runs = list(itertools.product(range(len(configs)), seeds))
+        if workers == 0:
+            results = [_simulate(self, configs[index], seed) for index, seed in runs]
+        else:
+            workers = workers or os.cpu_count()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunksize = max(1, len(runs) // (4*workers))
+                results = list(pool.map(_simulate, itertools.repeat(self), [configs[index] for index, seed in runs],
+                                        [seed for index, seed in runs], chunksize=chunksize))
+
+        table = []
+        for (index, seed), result in zip(runs, results):
+            row = {'run': index, 'seed': seed}
+            row.update(configs[index])
+            row.update(result)
+            table.append(row)
+        return table
+
+    @staticmethod
+    def write_csv(table, filename):
+        """
+        Write results table, one line per run
+        """
+        columns = []
+        for row in table:
+            columns.extend(key for key in row if key not in columns)
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(filename, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(table)
+
+
+def _simulate(sweep, config, seed):
+    try:
+        return sweep.simulate(config, seed)
+    except Exception as e:
+        return {'error': type(e).__name__ + ': ' + str(e)}
@@ -0,0 +1,154 @@
+import argparse
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
+from cflib.crazyflie.toccache import TocCache
+import cflib.crtp
+
+from CFUtil import CFUtil
+
+
+class ManagedTocCache(TocCache):
+    """
+    Log and parameter TOC cache shared by all Crazyflies of the process, keyed by the TOC CRC of the firmware.
+
+    Drones with a cached TOC skip the TOC download when connecting. TOCs are looked up in memory first, then in the
+    read-only and read-write cache folders, and downloaded TOCs are saved in the read-write folder. A fleet with
+    identical firmware can share one read-only folder filled once by prewarm, ex: on a network drive.
+
+    Example:
+        cache = ManagedTocCache.get_shared(ro_cache=CFUtil.RO_CACHE, rw_cache=CFUtil.RW_CACHE)
+        cf = cache.attach(Crazyflie())
+        ...
+        print(cache)
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, ro_cache=None, rw_cache=None):
+        """
+        :param ro_cache: Optional folder of cached TOCs that is never written
+        :param rw_cache: Optional folder of cached TOCs, new TOCs are saved here
+        """
+        super(ManagedTocCache, self).__init__(ro_cache=ro_cache, rw_cache=rw_cache)
+        self.ro_cache = ro_cache
+        self.rw_cache = rw_cache
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_shared(ro_cache=None, rw_cache=None):
+        """
+        :return: The ManagedTocCache of the process for the given folders, created on first use
+        """
+        with ManagedTocCache._shared_lock:
+            key = (ro_cache, rw_cache)
+            if key not in ManagedTocCache._shared:
+                ManagedTocCache._shared[key] = ManagedTocCache(ro_cache=ro_cache, rw_cache=rw_cache)
+            return ManagedTocCache._shared[key]
+
+    def attach(self, cf):
+        """
+        Use this cache for all TOC downloads of a Crazyflie, must be called before opening the link
+        :return: cf
+        """
+        cf._toc_cache = self
+        return cf
+
+    def fetch(self, crc):
+        """
+        Called by cflib when connecting
+        :return: Copy of the cached TOC of crc, None on a miss
+        """
+        with self._lock:
+            toc = self._memory.get(crc)
+        if toc is None:
+            toc = super(ManagedTocCache, self).fetch(crc)
+
+        with self._lock:
+            if toc is None:
+                self.misses = self.misses + 1
+                return None
+            self.hits = self.hits + 1
+            self._memory[crc] = toc
+        # Every Crazyflie gets its own elements
+        return copy.deepcopy(toc)
+
+    def insert(self, crc, toc):
+        """
+        Called by cflib after downloading a TOC
+        """
+        super(ManagedTocCache, self).insert(crc, toc)
+        with self._lock:
+            self.inserts = self.inserts + 1
+            self._memory[crc] = copy.deepcopy(toc)
+
+    def contains(self, crc):
+        """
+        :return: True if the TOC of crc is cached, without counting a hit or miss
+        """
+        with self._lock:
+            if crc in self._memory:
+                return True
+        pattern = '%08X.json' % crc
+        return any(name.endswith(pattern) for name in self._cache_files)
+
+    def get_stats(self):
+        """
+        :return: dict of hit, miss and insert counts and the number of TOCs held in memory
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'inserts': self.inserts, 'memory': len(self._memory)}
+
+    def __str__(self):
+        return 'hits: %(hits)d, misses: %(misses)d, inserts: %(inserts)d, in memory: %(memory)d' % self.get_stats()
+
+
+def prewarm(uris, cache, timeout=10, retries=2):
+    """
+    Connect to every drone once, in parallel, so their TOCs end up in the cache. Drones sharing firmware only
+    download the TOC once per CRC as long as they are connected one after another, parallel connections may both
+    download it.
+    :param uris: Drones to connect to
+    :param cache: ManagedTocCache to fill, needs a rw_cache folder to keep the TOCs after the process ends
+    :param timeout: Maximum wait per connection attempt in seconds
+    :param retries: Number of connection attempts per drone
+    :return: dict{uri: True if the TOCs of the drone are cached}
+    """
+    def warm(uri):
+        scf = SyncCrazyflie(uri, cache.attach(Crazyflie()))
+        try:
+            CFUtil.ext_open_link_cf(scf, timeout=timeout, retries=retries)
+        except Exception as e:
+            print('Prewarm failed for ' + uri + ': ' + str(e))
+            return False
+        try:
+            return CFUtil.wait_for_param_download(scf, timeout=timeout)
+        finally:
+            scf.close_link()
+
+    uris = list(uris)
+    with ThreadPoolExecutor(max_workers=max(1, len(uris))) as pool:
+        return dict(zip(uris, pool.map(warm, uris)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fill the TOC cache for all drones')
+    parser.add_argument('uris', nargs='*', default=list(CFUtil.URIS_DEFAULT))
+    parser.add_argument('--rw-cache', default=CFUtil.RW_CACHE)
+    parser.add_argument('--timeout', type=float, default=10)
+    args = parser.parse_args()
+
+    cflib.crtp.init_drivers(enable_debug_driver=False)
+    cache = ManagedTocCache(rw_cache=args.rw_cache)
+    result = prewarm(args.uris, cache, timeout=args.timeout)
+    for uri in result:
+        print(uri + ': ' + ('cached' if result[uri] else 'failed'))
+    print(cache)
@@ -1,7 +1,9 @@
 import cflib.crtp
 import logging
+import time
 from AsyncSwarm import AsyncSwarm
 from LogManager import LogManager
+from FlightRecorder import FlightRecorder
 from Controllers import FlockingController
 from Controllers import DistanceController
 from ControllerThread import ControllerThread
@@ -15,8 +17,9 @@ if __name__ == '__main__':
     # Initialize the low-level drivers (don't list the debug drivers)
     cflib.crtp.init_drivers(enable_debug_driver=False)
 
-    # Log manager initialization
-    log = LogManager()
+    # Log manager initialization, the flight recorder keeps all samples if the process dies
+    recorder = FlightRecorder('output/flight_' + time.strftime("%Y-%m-%d_T%H%M%S") + '.rec')
+    log = LogManager(recorder=recorder)
 
     # Initialize swarm
     active_indices = (0, 2, 3, 4)
@@ -46,11 +49,12 @@ if __name__ == '__main__':
 
     seq = Sequences(period_ms=period_ms)
     # seq.run(swarm=swarm, controller=controller, sequence=seq.TAKE_OFF_CONTROLLER_SEQ)
-    seq.run(swarm=swarm, controller=controller, sequence=seq.TAKE_OFF_STANDARD)
-    seq.run(swarm=swarm, controller=controller, sequence=seq.MERGE_1_3_C)
-    seq.run(swarm=swarm, controller=controller, sequence=seq.LAND_UNSAFE)
+    seq.run(swarm=swarm, controller=controller, sequence=seq.TAKE_OFF_STANDARD, log=log)
+    seq.run(swarm=swarm, controller=controller, sequence=seq.MERGE_1_3_C, log=log)
+    seq.run(swarm=swarm, controller=controller, sequence=seq.LAND_UNSAFE, log=log)
 
     swarm.stop()
     controller_thread.stop()
     log.stop()
     log.write_mat()
+    recorder.close()
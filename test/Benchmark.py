@@ -0,0 +1,206 @@
+"""
+Benchmark of the control loop hot path over a range of swarm sizes.
+
+Times controller compute, state conversion, state snapshots, a full follow_controller tick and a ControllerThread
+tick with and without latency tracing. Drones are simulated
+by SimSwarm so no radio is needed, setpoints are applied directly to the simulated commanders.
+
+Results are written as JSON, one entry per case and swarm size, so runs of different commits can be compared:
+    python Benchmark.py --sizes 2 5 10 100 500 --out results.json
+
+Bounds depending on the machine being idle, ex: the cost of the disabled tracing hook or the wake up latency of
+Periodic, are checked by check_overhead and check_periodic and reported at the end of the run instead of in the unit
+tests.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from functools import partial
+import numpy as np
+
+from AsyncSwarm import AsyncSwarm
+from CFUtil import CFUtil
+from ControllerThread import ControllerThread
+from Controllers import FlockingController, DistanceController
+from PyUtil import Periodic
+from SimSwarm import SimSwarm
+
+SIZES_DEFAULT = (2, 5, 10, 20, 50, 100, 200, 500)
+
+# (case, reference case, ratio, slack in microseconds), the minimum time of case stays below ratio*reference + slack
+OVERHEAD_BOUNDS = (('ControllerThread tick', 'ControllerThread tick without hook', 1.1, 5),)
+
+
+def build_swarm(count, seed=0):
+    """
+    Simulated swarm with random positions at constant density and one log sample received from every drone
+    :return: AsyncSwarm, SimSwarm
+    """
+    rng = np.random.default_rng(seed)
+    side = 0.5*count**(1/3)
+    positions = rng.uniform(0, side, (count, 3)) + (0, 0, 0.5)
+    sim = SimSwarm(count, positions=positions)
+    swarm = AsyncSwarm((), uris=sim.uris, factory=sim)
+    swarm.controller_active = True
+    for i, uri in enumerate(sim.uris):
+        swarm.log_callback(uri=uri, timestamp=0, data=sim.get_values(i), logconf=None)
+    return swarm, sim
+
+
+def time_call(func, repeats, warmup=3):
+    """
+    :return: dict of timing statistics in microseconds
+    """
+    for i in range(warmup):
+        func()
+    times = []
+    for i in range(repeats):
+        t0 = time.perf_counter_ns()
+        func()
+        times.append((time.perf_counter_ns() - t0)/1000)
+    return {'median_us': statistics.median(times), 'min_us': min(times), 'mean_us': statistics.mean(times),
+            'repeats': repeats}
+
+
+def get_cases(swarm):
+    """
+    :return: dict{case name: function without arguments}
+    """
+    state = swarm.get_state()
+    state_dict = {uri: state[uri] for uri in state}
+    flocking = FlockingController((0, 0, 1))
+    distance = DistanceController((0, 0, 1))
+
+    def tick():
+        flocking.compute(swarm.get_state())
+        swarm.follow_controller(flocking)
+
+    thread = ControllerThread(swarm=swarm, controller_func=flocking.compute,
+                              output_func=partial(swarm.follow_controller, flocking))
+    tracer = swarm.enable_tracing()
+    swarm.disable_tracing()
+
+    def traced_tick():
+        swarm.tracer = tracer
+        thread._tick()
+        swarm.tracer = None
+
+    plain_state = [None]
+
+    def plain_tick():
+        # Body of ControllerThread._tick without the tracer hook
+        plain_state[0] = swarm.get_state(out=plain_state[0])
+        flocking.compute(plain_state[0])
+        swarm.follow_controller(flocking)
+        if len(plain_state[0].arrival) > 0:
+            thread.latency.append(time.time() - np.max(plain_state[0].arrival))
+
+    return {'FlockingController.compute': lambda: flocking.compute(state),
+            'DistanceController.compute': lambda: distance.compute(state),
+            'CFUtil.state_dict_to_numpy_matrix': lambda: CFUtil.state_dict_to_numpy_matrix(state_dict),
+            'AsyncSwarm.get_state': swarm.get_state,
+            'follow_controller tick': tick,
+            'ControllerThread tick': thread._tick,
+            'ControllerThread tick without hook': plain_tick,
+            'ControllerThread tick traced': traced_tick}
+
+
+def run(sizes=SIZES_DEFAULT, repeats=50):
+    """
+    Run all cases for all sizes. Cases raising an exception are recorded with the error instead of timings.
+    :return: list of result dicts
+    """
+    results = []
+    for count in sizes:
+        swarm, sim = build_swarm(count)
+        for case, func in get_cases(swarm).items():
+            result = {'case': case, 'size': count}
+            try:
+                result.update(time_call(func, repeats))
+            except Exception as e:
+                result['error'] = type(e).__name__ + ': ' + str(e)
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def check_overhead(results, bounds=OVERHEAD_BOUNDS):
+    """
+    Compare cases against their reference case of the same size, see OVERHEAD_BOUNDS
+    :return: list of messages, one per exceeded bound
+    """
+    times = {(result['case'], result['size']): result['min_us'] for result in results if 'error' not in result}
+    failures = []
+    for case, reference, ratio, slack_us in bounds:
+        for (name, size), time_us in sorted(times.items()):
+            if name != case or (reference, size) not in times:
+                continue
+            bound_us = times[(reference, size)]*ratio + slack_us
+            if time_us >= bound_us:
+                failures.append('{} ({} drones): {:.1f} us, bound {:.1f} us'.format(case, size, time_us, bound_us))
+    return failures
+
+
+def check_periodic(period=0.01, cycles=51, bound_s=0.005):
+    """
+    Run Periodic with a real clock, cycles should start within bound_s of their deadline
+    :return: list of messages, one per exceeded bound
+    """
+    start = time.monotonic()
+    periodic = Periodic(duration=None, period=period)
+    for cycle in periodic:
+        if cycle == cycles:
+            break
+    elapsed = time.monotonic() - start
+    print(periodic.stats)
+    failures = []
+    if periodic.stats.worst_latency >= bound_s:
+        failures.append('Periodic worst latency: {:.2f} ms, bound {:.2f} ms'.format(periodic.stats.worst_latency*1000,
+                                                                                    bound_s*1000))
+    if abs(elapsed - (cycles - 1)*period) >= bound_s:
+        failures.append('Periodic {} cycles: {:.4f} s, expected {:.4f} s'.format(cycles, elapsed,
+                                                                                (cycles - 1)*period))
+    return failures
+
+
+def print_result(result):
+    if 'error' in result:
+        print('{:<36}{:>6}  {}'.format(result['case'], result['size'], result['error']))
+    else:
+        print('{:<36}{:>6}{:>12.1f} us'.format(result['case'], result['size'], result['median_us']))
+
+
+def get_meta():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(), 'processor': platform.processor()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark controller compute, state conversion and dispatch')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES_DEFAULT, help='Swarm sizes to run')
+    parser.add_argument('--repeats', type=int, default=50, help='Timed calls per case and size')
+    parser.add_argument('--out', default='benchmark.json', help='JSON output file')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeats)
+    with open(args.out, 'w') as file:
+        json.dump({'meta': get_meta(), 'results': results}, file, indent=2)
+    print('Results written to ' + args.out)
+
+    failures = check_overhead(results) + check_periodic()
+    for failure in failures:
+        print('Overhead bound exceeded: ' + failure)
+    if len(failures) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,16 @@
 from unittest import TestCase
+import numpy as np
 from AsyncSwarm import AsyncSwarm
 from CFUtil import CFUtil
+from Controllers import FlockingController
+
+
+class RecordingCommander:
+    def __init__(self):
+        self.setpoints = []
+
+    def send_velocity_world_setpoint(self, vx, vy, vz, yawrate):
+        self.setpoints.append((vx, vy, vz, yawrate))
 
 
 class TestAsyncSwarm(TestCase):
@@ -23,4 +33,24 @@ class TestAsyncSwarm(TestCase):
     def test_get_relative_order(self):
         res = self.swarm.get_relative_order()
         print(res)
+        self.assertEqual(res[0], list(CFUtil.URIS_DEFAULT))
+        self.assertEqual(res[1], list(reversed(CFUtil.URIS_DEFAULT)))
+        self.assertEqual(res[2], [CFUtil.URI1, CFUtil.URI3, CFUtil.URI2, CFUtil.URI5, CFUtil.URI4])
+
+    def test_follow_controller(self):
+        for scf in self.swarm.get_cfs().values():
+            scf.cf.commander = RecordingCommander()
+
+        controller = FlockingController((0, 0, 1))
+        controller.add_ignore(CFUtil.URI1)
+        u = controller.compute(self.swarm.get_state())
+
+        self.swarm.controller_active = True
+        self.swarm.follow_controller(controller)
 
+        for uri, scf in self.swarm.get_cfs().items():
+            if uri == CFUtil.URI1:
+                self.assertEqual(scf.cf.commander.setpoints, [])
+            else:
+                self.assertEqual(len(scf.cf.commander.setpoints), 1)
+                self.assertTrue(np.allclose(scf.cf.commander.setpoints[0], list(u[uri]) + [0]))
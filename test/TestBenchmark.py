@@ -0,0 +1,31 @@
+import unittest
+import json
+import Benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run(self):
+        results = Benchmark.run(sizes=(2, 5), repeats=2)
+        self.assertEqual(len(results), 16)
+        for result in results:
+            self.assertIn(result['size'], (2, 5))
+            self.assertNotIn('error', result)
+            self.assertGreater(result['median_us'], 0)
+        json.dumps({'meta': Benchmark.get_meta(), 'results': results})
+
+    def test_check_periodic(self):
+        # Bounds depend on the machine, only the report is checked
+        failures = Benchmark.check_periodic(period=0.01, cycles=6)
+        self.assertIsInstance(failures, list)
+
+    def test_check_overhead(self):
+        results = [{'case': 'a', 'size': 2, 'min_us': 12.0}, {'case': 'b', 'size': 2, 'min_us': 10.0},
+                   {'case': 'a', 'size': 5, 'min_us': 30.0}, {'case': 'b', 'size': 5, 'min_us': 10.0},
+                   {'case': 'a', 'size': 10, 'error': 'ValueError'}]
+        failures = Benchmark.check_overhead(results, bounds=(('a', 'b', 1.1, 5),))
+        self.assertEqual(failures, ['a (5 drones): 30.0 us, bound 16.0 us'])
+
+
+if __name__ == '__main__':
+    unittest.main()
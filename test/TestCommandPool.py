@@ -0,0 +1,106 @@
+import unittest
+import time
+import numpy as np
+from AsyncSwarm import AsyncSwarm
+from CFUtil import CFUtil
+from CommandPool import CommandPool
+
+
+class DummyScf:
+    def __init__(self, uri):
+        self._link_uri = uri
+        self.received = []
+
+
+def record(scf, value, delay=0):
+    time.sleep(delay)
+    scf.received.append(value)
+    return value
+
+
+class TestCommandPool(unittest.TestCase):
+
+    def setUp(self):
+        self.cfs = {uri: DummyScf(uri) for uri in CFUtil.URIS_DEFAULT}
+        self.pool = CommandPool(maxsize=4)
+        self.pool.start(self.cfs)
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_broadcast_order(self):
+        for i in range(3):
+            self.pool.broadcast(record, args_dict={uri: [i] for uri in self.cfs})
+        futures = self.pool.broadcast(record, args_dict={uri: [3] for uri in self.cfs}, futures=True)
+        for uri in futures:
+            self.assertEqual(futures[uri].result(timeout=1), 3)
+            self.assertEqual(self.cfs[uri].received, [0, 1, 2, 3])
+
+    def test_partial_args_dict(self):
+        future = self.pool.submit(CFUtil.URI2, record, ['a'], future=True)
+        future.result(timeout=1)
+        self.assertEqual(self.cfs[CFUtil.URI2].received, ['a'])
+        self.assertEqual(self.cfs[CFUtil.URI1].received, [])
+
+    def test_exception(self):
+        def fail(scf):
+            raise ValueError('test')
+        future = self.pool.submit(CFUtil.URI1, fail, future=True)
+        self.assertRaises(ValueError, future.result, 1)
+
+    def test_missing_worker(self):
+        # Drones without a worker are skipped and counted instead of raising on the control path
+        self.pool.remove(CFUtil.URI1)
+        self.assertIsNone(self.pool.submit(CFUtil.URI1, record, ['a'], future=True))
+        self.assertIsNone(self.pool.submit('radio://0/80/2M/E7E7E7E7FF', record, ['a']))
+        self.assertEqual(self.pool.missing, 2)
+        self.assertNotIn(CFUtil.URI1, self.pool.get_dropped())
+
+        swarm = AsyncSwarm((), uris=list(self.cfs))
+        swarm._cfs = dict(self.cfs)
+        swarm._commands = self.pool
+        u = np.ones((len(self.cfs), 3))
+        swarm.send_velocity_batch(list(self.cfs), u)
+        self.assertEqual(self.pool.missing, 3)
+
+    def test_drop_oldest(self):
+        uri = CFUtil.URI1
+        self.pool.submit(uri, record, ['slow', 0.2])
+        time.sleep(0.05)
+        for i in range(10):
+            self.pool.submit(uri, record, [i])
+        self.pool.submit(uri, record, ['last'], future=True).result(timeout=1)
+        self.assertEqual(self.cfs[uri].received, ['slow', 7, 8, 9, 'last'])
+        self.assertEqual(self.pool.get_dropped()[uri], 7)
+
+    def test_dispatch_latency(self):
+        """
+        Per tick dispatch latency and jitter of Swarm.parallel compared to the worker pool
+        """
+        swarm = AsyncSwarm((0, 1, 2, 3, 4))
+
+        def send(scf, vel, ignore=False):
+            pass
+
+        u = {uri: [np.zeros(3)] for uri in CFUtil.URIS_DEFAULT}
+        ticks = 200
+
+        latency = {}
+        for name in ('parallel', 'pool'):
+            samples = []
+            for i in range(ticks):
+                t0 = time.perf_counter()
+                if name == 'parallel':
+                    swarm.parallel(send, args_dict=u)
+                else:
+                    self.pool.broadcast(send, args_dict=u)
+                samples.append(time.perf_counter() - t0)
+            latency[name] = np.array(samples)*1000
+
+        for name in latency:
+            print(name + ': mean ' + str(np.mean(latency[name])) + ' ms, jitter (std) ' +
+                  str(np.std(latency[name])) + ' ms, max ' + str(np.max(latency[name])) + ' ms.')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,3 +23,19 @@ class TestComputeRejections(TestCase):
         print('Angle: ' + str(angle))
         print('Rejection 1: ' + str(rej_1))
         print('Rejection 2: ' + str(rej_2))
+
+    def test_compute_array(self):
+        A = np.array([[1, 0.1, 0], [0.5, 0.5, 0.2], [1, 0, 0], [0, 0, 0]])
+        B = np.array([[0.9, 0, 0], [0.1, 0.7, -0.3], [1, 0, 0], [1, 0, 0]])
+
+        angle, rej_1, rej_2 = PyUtil.compute_rejections_array(A, B)
+
+        for i in range(2):
+            expected_angle, expected_rej_1, expected_rej_2 = PyUtil.compute_rejections(A[i], B[i])
+            self.assertAlmostEqual(angle[i], expected_angle)
+            self.assertTrue(np.allclose(rej_1[i], expected_rej_1))
+            self.assertTrue(np.allclose(rej_2[i], expected_rej_2))
+
+        # Equal and zero vectors give no rejection
+        self.assertEqual(angle[2], 0)
+        self.assertTrue(np.array_equal(rej_1[2:], np.zeros((2, 3))))
@@ -0,0 +1,72 @@
+import unittest
+import threading
+import time
+import numpy as np
+from AsyncSwarm import AsyncSwarm
+from CFUtil import CFUtil
+from ControllerThread import ControllerThread
+from Controllers import FlockingController
+
+
+class TestControllerThread(unittest.TestCase):
+
+    def setUp(self):
+        self.swarm = AsyncSwarm((0, 1, 2, 3, 4))
+        self.ctr = FlockingController((0, 0, 1))
+        self.running = True
+        self.radio = threading.Thread(target=self.simulate_radio, args=(0.01,))
+        self.radio.start()
+
+    def tearDown(self):
+        self.running = False
+        self.radio.join()
+
+    def simulate_radio(self, period):
+        """
+        Deliver log data for all drones every period, slightly staggered like separate radio links
+        """
+        k = 0
+        while self.running:
+            k = k + 1
+            for i, uri in enumerate(CFUtil.URIS_DEFAULT):
+                data = CFUtil.generate_drone(name=uri, pos=(i, 0, 1))[uri]
+                self.swarm.log_callback(uri=uri, timestamp=k, data=data, logconf=None)
+                time.sleep(period/10)
+            time.sleep(period/2)
+
+    def run_thread(self, thread, duration=0.5):
+        thread.start()
+        time.sleep(duration)
+        thread.stop()
+        return thread.get_latency()
+
+    def test_fresh_trigger(self):
+        sent = []
+        thread = ControllerThread(swarm=self.swarm, controller_func=self.ctr.compute, period_ms=50,
+                                  trigger=ControllerThread.TRIGGER_FRESH, output_func=lambda: sent.append(1))
+        latency = self.run_thread(thread)
+
+        # Data arrives every 15 ms, much faster than the 50 ms timer
+        self.assertGreater(len(latency), 20)
+        self.assertEqual(len(sent), len(latency))
+        print('Fresh trigger: ' + str(len(latency)) + ' ticks, median latency ' + str(np.median(latency)*1000) +
+              ' ms, timeouts ' + str(thread.timeouts))
+
+    def test_quorum_timeout(self):
+        # Drone that never delivers data
+        self.swarm.add_drone('radio://0/120/2M/E7E7E7E799')
+        thread = ControllerThread(swarm=self.swarm, controller_func=self.ctr.compute, period_ms=50,
+                                  trigger=ControllerThread.TRIGGER_FRESH)
+        latency = self.run_thread(thread)
+        self.assertGreater(thread.timeouts, 5)
+        self.assertLess(len(latency), 15)
+
+    def test_timer_trigger(self):
+        thread = ControllerThread(swarm=self.swarm, controller_func=self.ctr.compute, period_ms=50)
+        latency = self.run_thread(thread)
+        print('Timer trigger: ' + str(len(latency)) + ' ticks, median latency ' + str(np.median(latency)*1000) +
+              ' ms')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,12 @@ import unittest
 import copy
 import time
 import random
+import numpy as np
 import AsyncSwarm
 from CFUtil import CFUtil
 from Controllers import DistanceController
+from Formation import Formation
+import math
 #from examples.DistanceController import DistanceController
 
 
@@ -73,6 +76,67 @@ class TestDistanceController(unittest.TestCase):
         test = self.ctr.compute(state)
         print(test)
 
+    def test_cutoff(self):
+        state = {}
+        for i in range(4):
+            name = 'd' + str(i)
+            state.update(generate_drone(name, pos=(random.random(), random.random(), 1 + random.random())))
+
+        expected = self.ctr.compute(state)
+        test = DistanceController(REF, cutoff=10).compute(state)
+        for uri in expected:
+            self.assertTrue(np.allclose(test[uri], expected[uri]))
+
+    def test_large_swarm(self):
+        state = {}
+        for i in range(20):
+            name = 'd' + str(i)
+            state.update(generate_drone(name, pos=(i % 4, i // 4, 1)))
+
+        for option in range(6):
+            ctr = DistanceController(REF, formation=option)
+            test = ctr.compute(state)
+            self.assertEqual(len(test), 20)
+            self.assertTrue(np.all(np.isfinite(list(test.values()))))
+
+        # Drones joining get the free slots closest to them
+        ctr = DistanceController(REF, formation=Formation.LINE)
+        line = {'d' + str(i): generate_drone('d', pos=(0.5*i, 0, 1))['d'] for i in (0, 1, 2, 3, 5, 4)}
+        ctr.add_ignore(['d4', 'd5'])
+        ctr.compute(line)
+        ctr.remove_ignore(['d4', 'd5'])
+        ctr.compute(line)
+        self.assertTrue(np.allclose(ctr.slots[:, 0], 0.5*np.array([0, 1, 2, 3, 5, 4])))
+
+    def test_disturbance(self):
+        state = {}
+        for i in range(12):
+            name = 'd' + str(i)
+            state.update(generate_drone(name, pos=(random.random(), random.random(), 1 + random.random())))
+        disturbances = ['d3', 'd7', 'd8', 'd11']
+        self.ctr.add_ignore(disturbances)
+
+        t0 = time.time()
+        test = self.ctr.compute(state)
+        dur = time.time() - t0
+
+        # Compare with the disturbance terms summed one pair at a time
+        undisturbed = DistanceController(REF)
+        undisturbed.add_ignore(disturbances)
+        undisturbed.k_disturb = 0
+        expected = dict(undisturbed.compute(state).items())
+        for uri in expected:
+            if uri in disturbances:
+                self.assertTrue(np.allclose(test[uri], 0))
+                continue
+            for uri3 in disturbances:
+                dist = np.array([state[uri][key] - state[uri3][key] for key in CFUtil.KEYS_STATE[0:3]])
+                direction, magn = self.ctr.calculate_disturbance(dist)
+                expected[uri] = expected[uri] + self.ctr.k_disturb*magn*direction
+            self.assertTrue(np.allclose(test[uri], expected[uri]))
+
+        print('Runtime with ' + str(len(disturbances)) + ' disturbances: ' + str(dur*1000) + 'ms.')
+
     def test_runtime(self):
         state = {}
         for i in range(5):
@@ -85,6 +149,46 @@ class TestDistanceController(unittest.TestCase):
 
         print('Runtime: ' + str(dur*1000) + 'ms.')
 
+    def test_layout(self):
+        state = {}
+        for i in range(5):
+            name = 'd' + str(i)
+            state.update(generate_drone(name, pos=(random.random(), random.random(), 1 + random.random())))
+
+        self.ctr.compute(state)
+        uris = list(state.keys())
+        slots = dict(zip(uris, self.ctr.slots))
+
+        # Every drone has its own slot of the first five formation points, distances computed pair by pair
+        formation = Formation.gen_formation(dist=self.ctr.dist, drone_count=5, option=0)
+        self.assertEqual(sorted(map(tuple, self.ctr.slots)), sorted(map(tuple, formation)))
+        for i in range(5):
+            for j in range(5):
+                self.assertAlmostEqual(self.ctr.adj[i][j], math.dist(self.ctr.slots[i], self.ctr.slots[j]))
+
+        # Leaving drones keep the slots of the others, and get their own slot back when rejoining
+        self.ctr.add_ignore('d1')
+        self.ctr.compute(state)
+        self.assertEqual(self.ctr.adj.shape, (4, 4))
+        for uri, slot in zip([uri for uri in uris if uri != 'd1'], self.ctr.slots):
+            self.assertTrue(np.array_equal(slot, slots[uri]))
+        self.ctr.remove_ignore('d1')
+        self.ctr.compute(state)
+        for uri, slot in zip(uris, self.ctr.slots):
+            self.assertTrue(np.array_equal(slot, slots[uri]))
+
+        # Other drones with the same count do not reuse the layout
+        other = {'e' + uri: state[uri] for uri in list(state.keys())[0:4]}
+        self.ctr.compute(other)
+        self.assertEqual(self.ctr._layout_key[2], tuple(other.keys()))
+
+        # Least recently used layouts are evicted
+        self.assertEqual(len(self.ctr._layouts), 3)
+        for i in range(DistanceController.LAYOUT_CACHE_SIZE):
+            self.ctr.compute({uri + str(i): state[uri] for uri in uris})
+        self.assertEqual(len(self.ctr._layouts), DistanceController.LAYOUT_CACHE_SIZE)
+        self.assertNotIn((0, 0.5, tuple(uris)), self.ctr._layouts)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
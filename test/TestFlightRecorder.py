@@ -0,0 +1,96 @@
+import unittest
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+from CFUtil import CFUtil
+from FlightRecorder import FlightRecorder, FlightReader
+from LogManager import LogManager
+from SwarmState import SwarmState
+
+
+class TestFlightRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'flight.rec')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_write_read(self):
+        recorder = FlightRecorder(self.path, capacity=100, width=4)
+        small = recorder.add_channel('small', ['a', 'b'])
+        large = recorder.add_channel('large', [str(i) for i in range(10)])
+        for i in range(5):
+            recorder.write(small, (i, -i), timestamp=i)
+            recorder.write(large, np.arange(10) + i, timestamp=i)
+        recorder.event('sequence_start', [3])
+
+        # Reader opened while the recorder is still open
+        reader = FlightReader(self.path)
+        self.assertEqual(reader.get_names(), ['small', 'large', 'event:sequence_start'])
+        times, data = reader.read('small')
+        self.assertTrue(np.array_equal(times, np.arange(5)))
+        self.assertTrue(np.array_equal(data, [(i, -i) for i in range(5)]))
+        times, data = reader.read('large')
+        self.assertEqual(data.shape, (5, 10))
+        self.assertTrue(np.array_equal(data[4], np.arange(10) + 4))
+        self.assertEqual(reader.get_events()[0][1:], ('sequence_start', [3]))
+        recorder.close()
+
+    def test_full(self):
+        recorder = FlightRecorder(self.path, capacity=10, width=2)
+        channel = recorder.add_channel('x', ['a', 'b', 'c'])
+        results = [recorder.write(channel, (i, i, i)) for i in range(8)]
+        self.assertEqual(results, [True]*5 + [False]*3)
+        self.assertEqual(recorder.dropped, 3)
+
+        recorder = FlightRecorder(self.path, capacity=10, width=2, wrap=True)
+        channel = recorder.add_channel('x', ['a', 'b', 'c'])
+        for i in range(8):
+            recorder.write(channel, (i, i, i))
+        times, data = FlightReader(self.path).read('x')
+        self.assertTrue(np.array_equal(data[:, 0], [3, 4, 5, 6, 7]))
+
+    def test_log_manager(self):
+        recorder = FlightRecorder(self.path)
+        log = LogManager(directory=self.tmp.name, recorder=recorder)
+        state_log = log.add_caller(name='state', call=None, period_ms=None, start=False)
+        state = SwarmState(CFUtil.URIS_DEFAULT)
+        for i in range(20):
+            state.write(CFUtil.URI1, i, CFUtil.generate_drone(name=CFUtil.URI1, pos=(i, 0, 1))[CFUtil.URI1])
+            state_log.push_data(state.snapshot())
+        log.record_event('sequence_start', [1])
+        log.stop()
+
+        times, data = FlightReader(self.path).read('state')
+        self.assertEqual(data.shape, (20, 35))
+        self.assertTrue(np.array_equal(data[:, 0], np.arange(20)))
+        self.assertEqual(len(FlightReader(self.path).get_events()), 1)
+
+    def test_kill(self):
+        script = ('import os, signal, sys\n'
+                  'from FlightRecorder import FlightRecorder\n'
+                  'recorder = FlightRecorder(sys.argv[1], capacity=1000, width=8)\n'
+                  'channel = recorder.add_channel("state", ["x", "y", "z"])\n'
+                  'for i in range(500):\n'
+                  '    recorder.write(channel, (i, 0, 1))\n'
+                  'os.kill(os.getpid(), signal.SIGKILL)\n')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        process = subprocess.run([sys.executable, '-c', script, self.path], env=env)
+        self.assertEqual(process.returncode, -signal.SIGKILL)
+
+        t0 = time.perf_counter()
+        times, data = FlightReader(self.path).read('state')
+        print('Read ' + str(len(data)) + ' samples after kill in ' + str((time.perf_counter() - t0)*1000) + ' ms')
+        self.assertTrue(np.array_equal(data[:, 0], np.arange(500)))
+
+
+if __name__ == '__main__':
+    unittest.main()
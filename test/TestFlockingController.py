@@ -5,6 +5,7 @@ from Controllers import FlockingController
 from AsyncSwarm import AsyncSwarm
 from CFUtil import CFUtil
 import numpy as np
+import PyUtil
 
 
 def generate_drone(name, pos=(0, 0, 1), vel=(0, 0, 0)):
@@ -12,6 +13,51 @@ def generate_drone(name, pos=(0, 0, 1), vel=(0, 0, 0)):
                    CFUtil.KEY_DX: vel[0], CFUtil.KEY_DY: vel[1], CFUtil.KEY_DZ: vel[2]}}
 
 
+def reference_compute(ctr, state):
+    """
+    Pairwise loop implementation of FlockingController.compute, used as reference for the batched version
+    """
+    uris = list(state.keys())
+    state = CFUtil.state_dict_to_numpy_matrix(state)
+    count = len(uris)
+
+    output = {}
+    for uri in uris:
+        output[uri] = np.zeros(3)
+
+    for i in range(count):
+        uri = uris[i]
+        output[uri] = output[uri] + (ctr.ref[0:3] - state[uri][0:3])*ctr.r_ref
+
+        for j in range(i+1, count):
+            uri2 = uris[j]
+            error_rel = state[uri][:] - state[uri2][:]
+            error_position = error_rel[0:3]
+            error_velocity = -error_rel[3:6]
+
+            distance = max(np.linalg.norm(error_position), ctr.distance_minimum)
+
+            sum_pos = error_position * ctr.r_rel / (distance - ctr.distance_offset)
+            sum_vel = error_velocity * ctr.rdot_rel
+
+            angle, rej_1, rej_2 = PyUtil.compute_rejections(state[uri][0:3] - ctr.ref, state[uri2][0:3] - ctr.ref)
+            if angle < ctr.angle_cap:
+                angle_ratio = (ctr.angle_cap - angle)/ctr.angle_cap
+                angle_ampl = ctr.angle_k*min([1, angle_ratio/(distance - ctr.distance_offset)])
+                rej_1 = rej_1 * angle_ampl
+                rej_2 = rej_2 * angle_ampl
+            else:
+                rej_1 = rej_1 * 0
+                rej_2 = rej_2 * 0
+
+            _sum = (sum_pos + sum_vel) / (distance - ctr.distance_offset)
+
+            output[uri] = output[uri] + _sum + rej_1
+            output[uri2] = output[uri2] - _sum + rej_2
+
+    return output
+
+
 class TestFlockingController(unittest.TestCase):
     def setUp(self):
         self.swarm = AsyncSwarm((0, 1, 2, 3, 4))
@@ -54,6 +100,54 @@ class TestFlockingController(unittest.TestCase):
         t1 = time.time()
         print('Runtime: ' + str((t1-t0)*1000) + ' ms.')
 
+    def test_equivalence_random(self):
+        random.seed(1)
+        for angle_k in (0, 0.2):
+            self.ctr.angle_k = angle_k
+            for count in (1, 2, 3, 7, 20):
+                state = {}
+                for i in range(count):
+                    name = 'd' + str(i)
+                    state.update(generate_drone(name, pos=(random.uniform(-2, 2), random.uniform(-2, 2), random.uniform(0, 2)),
+                                                vel=(random.uniform(-1, 1), random.uniform(-1, 1), random.uniform(-1, 1))))
+                test = self.ctr.compute(state)
+                expected = reference_compute(self.ctr, state)
+                self.assertEqual(list(test.keys()), list(expected.keys()))
+                for uri in expected:
+                    self.assertTrue(np.allclose(test[uri], expected[uri]), msg=uri)
+
+    def test_cutoff(self):
+        state = {}
+        for i in range(10):
+            name = 'd' + str(i)
+            state.update(generate_drone(name, pos=(random.random(), random.random(), 1 + random.random())))
+        expected = self.ctr.compute(state)
+
+        # Cutoff larger than the swarm gives all pairs
+        test = FlockingController((0, 0, 1), cutoff=10).compute(state)
+        for uri in expected:
+            self.assertTrue(np.allclose(test[uri], expected[uri]))
+
+        # Drones outside the cutoff do not interact
+        state = {}
+        state.update(generate_drone('d1', pos=(0, 0, 1)))
+        state.update(generate_drone('d2', pos=(2, 0, 1)))
+        test = FlockingController((0, 0, 1), cutoff=1).compute(state)
+        self.assertTrue(np.allclose(test['d1'], np.zeros(3)))
+        self.assertTrue(np.allclose(test['d2'], np.array([-2, 0, 0])))
+
+    def test_runtime_cutoff(self):
+        ctr = FlockingController((0, 0, 1), cutoff=1.5)
+        state = {}
+        for i in range(500):
+            name = 'd' + str(i)
+            state.update(generate_drone(name, pos=(random.uniform(-10, 10), random.uniform(-10, 10), 1 + random.random())))
+
+        t0 = time.time()
+        test = ctr.compute(state)
+        t1 = time.time()
+        print('Runtime: ' + str((t1-t0)*1000) + ' ms.')
+
     def test_relative_velocity(self):
         state = {}
         state.update(generate_drone('d1', pos=(0, -1, 1)))
@@ -66,7 +160,31 @@ class TestFlockingController(unittest.TestCase):
         uris = self.swarm.get_uris()
         uri = uris[0]
         self.ctr.add_ignore(uri)
-        self.assertTrue(uri in self.ctr._ignore_list)
+        self.assertTrue(uri in self.ctr.get_ignore())
+        self.ctr.add_ignore([uri, uri])
+        self.assertEqual(self.ctr.get_ignore(), {uri})
+        self.ctr.remove_ignore([uri])
+        self.assertEqual(self.ctr.get_ignore(), set())
+
+    def test_output(self):
+        state = {}
+        for i in range(4):
+            state.update(generate_drone('d' + str(i), pos=(i, 0, 1)))
+        self.ctr.add_ignore('d2')
+        output = self.ctr.compute(state)
+
+        self.assertIs(self.ctr.get_u(), output)
+        self.assertEqual(output.array.shape, (4, 3))
+        self.assertFalse(output.array.flags.writeable)
+        self.assertEqual(list(output.active), [True, True, False, True])
+        self.assertEqual(output.index['d3'], 3)
+        self.assertIs(output['d1'].base, output.array)
+        with self.assertRaises(ValueError):
+            output.array[0, 0] = 1
+
+        # Index and mask are reused while the drones stay the same
+        self.assertIs(self.ctr.compute(state).index, output.index)
+        self.assertEqual(self.ctr.get_u_list()['d2'][1], True)
 
     def test_land_generator(self):
         state = {}
@@ -0,0 +1,69 @@
+import unittest
+import itertools
+import time
+import numpy as np
+from Formation import Formation
+
+
+def distances(points):
+    return np.linalg.norm(points[:, np.newaxis] - points[np.newaxis], axis=2)
+
+
+class TestFormation(unittest.TestCase):
+
+    def test_spacing(self):
+        for option in range(6):
+            for count in (0, 1, 2, 5, 7, 20, 100):
+                formation = Formation.gen_formation(dist=0.5, drone_count=count, option=option)
+                self.assertEqual(formation.shape, (count, 3))
+                if count > 1:
+                    d = distances(formation)
+                    d[np.eye(count, dtype=bool)] = np.inf
+                    self.assertAlmostEqual(d.min(), 0.5, delta=0.07)
+
+        with self.assertRaises(ValueError):
+            Formation.gen_formation(drone_count=3, option=10)
+
+    def test_original_shapes(self):
+        self.assertTrue(np.allclose(Formation.gen_formation(dist=1, drone_count=5, option=Formation.TETRAHEDRON),
+                                    [(0, 0, 0), (1, 0, 0), (0.5, 1, 0), (0.5, 0.5, 1), (0.5, 0.5, -1)]))
+        self.assertTrue(np.allclose(Formation.gen_formation(dist=1, drone_count=5, option=Formation.LINE)[:, 0],
+                                    range(5)))
+        # Circle follows dist for any count
+        ring = Formation.gen_formation(dist=0.3, drone_count=12, option=Formation.CIRCLE)
+        self.assertAlmostEqual(np.linalg.norm(ring[0] - ring[1]), 0.3)
+
+    def test_prefix_stable(self):
+        for option in (Formation.TETRAHEDRON, Formation.LINE, Formation.LATTICE):
+            large = Formation.gen_formation(dist=0.5, drone_count=40, option=option)
+            for count in (3, 6, 25):
+                self.assertTrue(np.allclose(Formation.gen_formation(dist=0.5, drone_count=count, option=option),
+                                            large[0:count]))
+
+    def test_assign(self):
+        rng = np.random.default_rng(1)
+        slots = Formation.gen_formation(dist=0.5, drone_count=6, option=Formation.GRID)
+        positions = rng.uniform(-1, 1, (6, 3))
+        assigned = Formation.assign(positions, slots, center=False)
+        self.assertEqual(sorted(assigned), list(range(6)))
+
+        # Optimal compared to all permutations
+        cost = lambda order: np.sum((positions - slots[list(order)])**2)
+        best = min(itertools.permutations(range(6)), key=cost)
+        self.assertAlmostEqual(cost(assigned), cost(best))
+
+        # Drones already in a shifted formation keep their slots
+        order = rng.permutation(6)
+        self.assertTrue(np.array_equal(Formation.assign(slots[order] + (3, -2, 1), slots), order))
+
+    def test_runtime(self):
+        t0 = time.time()
+        slots = Formation.gen_formation(dist=0.5, drone_count=200, option=Formation.TETRAHEDRON)
+        t1 = time.time()
+        Formation.assign(np.random.default_rng(0).uniform(0, 5, (200, 3)), slots)
+        t2 = time.time()
+        print('Runtime generate: ' + str((t1 - t0)*1000) + ' ms, assign: ' + str((t2 - t1)*1000) + ' ms.')
+
+
+if __name__ == '__main__':
+    unittest.main()
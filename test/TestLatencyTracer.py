@@ -0,0 +1,109 @@
+import unittest
+import os
+import tempfile
+from functools import partial
+import numpy as np
+import scipy.io
+
+from AsyncSwarm import AsyncSwarm
+from ChunkWriter import ChunkWriter
+from ControllerThread import ControllerThread
+from Controllers import FlockingController
+from LatencyTracer import LatencyTracer
+from LogManager import LogManager
+from SimSwarm import SimSwarm
+
+
+class TestLatencyTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = SimSwarm(4, positions=[(0, 0, 1), (1, 0, 1), (0, 1, 1), (1, 1, 1)])
+        self.swarm = AsyncSwarm((), uris=self.sim.uris, factory=self.sim)
+        self.swarm.controller_active = True
+        self.ctr = FlockingController((0, 0, 1))
+        self.thread = ControllerThread(swarm=self.swarm, controller_func=self.ctr.compute,
+                                       output_func=partial(self.swarm.follow_controller, self.ctr))
+
+    def run_ticks(self, count):
+        for k in range(count):
+            for i, uri in enumerate(self.sim.uris):
+                self.swarm.log_callback(uri=uri, timestamp=k, data=self.sim.get_values(i), logconf=None)
+            self.thread._tick()
+
+    def test_pipeline(self):
+        tracer = self.swarm.enable_tracing(capacity=16)
+        self.ctr.add_ignore(self.sim.uris[3])
+        self.run_ticks(20)
+
+        latency = tracer.get_latency()
+        self.assertEqual(tracer.ticks, 20)
+        self.assertEqual(len(latency['total']), 16)
+        for segment in LatencyTracer.SEGMENTS:
+            if segment != 'dispatch_to_send':
+                self.assertTrue(np.all(latency[segment] >= 0), msg=segment)
+        self.assertEqual(latency['dispatch_to_send'].shape, (16, 4))
+        self.assertTrue(np.all(latency['dispatch_to_send'][:, 0:3] >= 0))
+        self.assertTrue(np.all(np.isnan(latency['dispatch_to_send'][:, 3])))
+        self.assertTrue(np.all(latency['total'] >= latency['compute']))
+
+        percentiles = tracer.get_percentiles()
+        self.assertEqual(set(percentiles), set(LatencyTracer.SEGMENTS))
+        self.assertLessEqual(percentiles['total'][50], percentiles['total'][99])
+        print(tracer)
+
+    def test_incomplete_tick(self):
+        tracer = LatencyTracer(['a', 'b'], capacity=4)
+        tick = tracer.begin()
+        self.assertEqual(len(tracer.get_ticks()[0]), 0)
+        self.assertEqual(tracer.dispatch(), -1)
+
+        tracer.callback('a')
+        tracer.snapshot(tick)
+        tracer.commit(tick)
+        self.assertEqual(tracer.dispatch(), tick)
+        tracer.sent(tick, 'a')
+        tracer.sent(tick, 'unknown')
+
+        latency = tracer.get_latency()
+        self.assertTrue(np.isnan(latency['compute'][0]))
+        self.assertTrue(np.isfinite(latency['total'][0]))
+        self.assertTrue(np.isnan(latency['dispatch_to_send'][0, 1]))
+        self.assertTrue(np.isnan(LatencyTracer(['a']).get_percentiles()['total'][50]))
+
+    def test_export(self):
+        tracer = self.swarm.enable_tracing()
+        self.run_ticks(5)
+        with tempfile.TemporaryDirectory() as directory:
+            log = LogManager(directory=directory)
+            log.add_tracer(tracer)
+            log.write_mat()
+
+            data, header = ChunkWriter.read(log.directory, 'latency')
+            self.assertEqual(data.shape, (5, 1 + 5 + 4))
+            self.assertEqual(header['columns'][1], 'pipeline:callback_to_snapshot')
+
+            filename = [name for name in os.listdir(directory) if name.endswith('.mat')][0]
+            mat = scipy.io.loadmat(os.path.join(directory, filename))
+            self.assertEqual(mat['pipeline_latency'].shape, (5, 5))
+
+    def test_disabled(self):
+        # Once disabled, ticks, callbacks and sends leave the tracer untouched. The cost of the disabled hook is
+        # measured by Benchmark.check_overhead
+        tracer = self.swarm.enable_tracing(capacity=64)
+        self.run_ticks(5)
+        self.swarm.disable_tracing()
+        ticks, stages, sends = tracer.get_ticks()
+        callbacks = tracer._callback.copy()
+
+        self.run_ticks(20)
+        self.assertEqual(tracer.ticks, 5)
+        after = tracer.get_ticks()
+        self.assertTrue(np.array_equal(after[0], ticks))
+        self.assertTrue(np.array_equal(after[1], stages))
+        self.assertTrue(np.array_equal(after[2], sends))
+        self.assertTrue(np.array_equal(tracer._callback, callbacks))
+        self.assertTrue(np.all(tracer._stages[5:] == 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import unittest
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+import scipy.io
+
+from CFUtil import CFUtil
+from ChunkWriter import ChunkWriter
+from LogManager import LogManager, Log
+from SwarmState import SwarmState
+from PyUtil import RingBuffer
+
+
+class TestLogManager(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log = LogManager(directory=self.tmp.name, chunk_size=10)
+
+    def tearDown(self):
+        self.log.stop()
+        self.tmp.cleanup()
+
+    def test_chunk_writer(self):
+        writer = ChunkWriter(self.tmp.name, 'test', ['a', 'b'], chunk_size=4)
+        for i in range(10):
+            writer.append([i, 2*i])
+
+        # Full chunks are readable before the writer is closed
+        writer._pending.join()
+        data, header = ChunkWriter.read(self.tmp.name, 'test')
+        self.assertEqual(data.shape, (8, 2))
+        self.assertEqual(header['columns'], ['a', 'b'])
+        self.assertTrue(np.array_equal(writer.get_data()[:, 1], 2*np.arange(10)))
+
+        writer.close()
+        data, header = ChunkWriter.read(self.tmp.name, 'test')
+        self.assertTrue(np.array_equal(data[:, 0], np.arange(10)))
+        with self.assertRaises(ValueError):
+            writer.append([10, 20])
+
+    def test_append_after_stop(self):
+        # Late callbacks after stop neither write rows nor wait forever for a chunk buffer
+        log = Log('late', call=None, period_ms=None, start=False, directory=self.tmp.name, chunk_size=4, memory=50)
+        for i in range(5):
+            log.push_data({'d1': [i, -i]})
+        log.stop()
+
+        thread = threading.Thread(target=lambda: [log.push_data({'d1': [i, -i]}) for i in range(3*4 + 10)],
+                                  daemon=True)
+        thread.start()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(log.writer.rows, 5)
+        self.assertEqual(len(log.read()['timestamps_late']), 5)
+        log.flush()
+
+    def test_stream(self):
+        count = [0]
+
+        def call():
+            count[0] = count[0] + 1
+            return {'d1': {'x': count[0], 'y': -count[0]}, 'ref': [1, 2, 3]}
+
+        log = self.log.add_caller(name='test', call=call, period_ms=2)
+        time.sleep(0.2)
+
+        # Chunks reach the disk during logging
+        data, header = ChunkWriter.read(self.log.directory, 'test')
+        self.assertGreaterEqual(len(data), 10)
+        self.assertEqual(header['columns'], ['timestamp', 'd1:x', 'd1:y', 'ref:0', 'ref:1', 'ref:2'])
+
+        log.stop()
+        data = log.get_data()
+        n = len(data['timestamps_test'])
+        self.assertEqual(n, count[0])
+        self.assertTrue(np.array_equal(data['d1_test'], [np.arange(1, n + 1), -np.arange(1, n + 1)]))
+        self.assertTrue(np.array_equal(data['ref_test'], np.tile([[1], [2], [3]], n)))
+
+        filename = os.path.join(self.tmp.name, 'export')
+        self.log.write_mat()
+        LogManager.export_mat(self.log.directory, filename)
+        mat = scipy.io.loadmat(filename)
+        self.assertTrue(np.array_equal(mat['d1_test'], data['d1_test']))
+
+    def test_push_data(self):
+        uris = list(CFUtil.URIS_DEFAULT)
+        state = SwarmState(uris)
+        log = self.log.add_caller(name='callbacks', call=None, period_ms=None, start=False)
+
+        # Incomplete samples can not define the columns and are dropped
+        log.push_data({})
+        log.push_data({CFUtil.URI1: [1, 2], CFUtil.URI2: []})
+        self.assertIsNone(log.writer)
+
+        def push(uri):
+            for i in range(100):
+                data = CFUtil.generate_drone(name=uri, pos=(i, 0, 1))[uri]
+                data[CFUtil.KEY_BAT] = 4000
+                state.write(uri, i, data)
+                log.push_data(state.get_last_seen())
+
+        threads = [threading.Thread(target=push, args=(uri,)) for uri in uris]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        log.stop()
+        data = log.get_data()
+        self.assertEqual(len(data['timestamps_callbacks']), 500)
+        self.assertEqual(data['d01_callbacks'].shape, (2, 500))
+        self.assertEqual(data['d01_callbacks'][0].max(), 99)
+
+    def test_ring_buffer(self):
+        ring = RingBuffer(4, 2)
+        self.assertEqual(ring.get_view().shape, (0, 2))
+        for i in range(3):
+            ring.append([i, -i])
+        self.assertTrue(ring.is_complete())
+        self.assertTrue(np.array_equal(ring.get_view()[:, 0], [0, 1, 2]))
+        for i in range(3, 10):
+            ring.append([i, -i])
+        self.assertFalse(ring.is_complete())
+        self.assertTrue(np.array_equal(ring.get_view()[:, 0], [6, 7, 8, 9]))
+        self.assertTrue(np.array_equal(ring.get_view(2)[:, 1], [-8, -9]))
+        self.assertTrue(np.shares_memory(ring.get_view(), ring.buffer))
+
+    def test_state_log(self):
+        uris = list(CFUtil.URIS_DEFAULT)
+        state = SwarmState(uris)
+        log = Log('state', call=None, period_ms=None, start=False, directory=self.tmp.name, chunk_size=10, memory=50)
+        for i in range(40):
+            uri = uris[i % len(uris)]
+            data = CFUtil.generate_drone(name=uri, pos=(i, 0, 1))[uri]
+            state.write(uri, i, data)
+            log.push_data(state.snapshot())
+
+        # Constant time views with variable names while everything fits in memory
+        data = log.get_data()
+        self.assertTrue(np.shares_memory(data['d01_state'], log.ring.buffer))
+        self.assertEqual(list(data['d01_state_names']), list(SwarmState.KEYS))
+        self.assertEqual(data['d02_state'].shape, (7, 40))
+        self.assertTrue(np.isnan(data['d02_state'][0, 0]))
+        self.assertEqual(data['d02_state'][0, -1], 36)
+
+        # Still views once samples are overwritten, older samples are only read back from disk
+        for i in range(40):
+            log.push_data(state.snapshot())
+        data = log.get_data()
+        self.assertTrue(np.shares_memory(data['d01_state'], log.ring.buffer))
+        self.assertEqual(data['d01_state'].shape, (7, 50))
+        complete = log.read()
+        self.assertEqual(complete['d01_state'].shape, (7, 80))
+        self.assertTrue(np.array_equal(complete['d03_state'][:, -50:], data['d03_state'], equal_nan=True))
+        self.assertEqual(log.get_recent(5)['d05_state'].shape, (7, 5))
+        self.assertTrue(np.array_equal(log.get_recent(5)['timestamps_state'], data['timestamps_state'][-5:]))
+        log.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,27 @@
 import unittest
+from unittest import mock
 import time
 
-from PyUtil import Periodic
+import PyUtil
+from PyUtil import Periodic, LoopStats
+
+
+class FakeClock:
+    """
+    Replaces time.monotonic_ns and sleep_until, every sleep overshoots its deadline by the next of jitter_ns
+    """
+
+    def __init__(self, jitter_ns):
+        self.now = 10**12
+        self.jitter_ns = list(jitter_ns)
+        self.deadlines = []
+
+    def monotonic_ns(self):
+        return self.now
+
+    def sleep_until(self, deadline_ns, spin_ns=0):
+        self.deadlines.append(deadline_ns)
+        self.now = max(self.now, deadline_ns) + self.jitter_ns[(len(self.deadlines) - 1) % len(self.jitter_ns)]
 
 
 class MyTestCase(unittest.TestCase):
@@ -38,6 +58,56 @@ class MyTestCase(unittest.TestCase):
             if cycle % 2:
                 time.sleep(0.7)
 
+    def test_no_drift(self):
+        # Deadlines stay on start + k*period however late each sleep returns, the latency bound of a real clock is
+        # checked by Benchmark.check_periodic
+        clock = FakeClock(jitter_ns=(3000000, 0, 7000000, 1000))
+        with mock.patch('time.monotonic_ns', clock.monotonic_ns), mock.patch.object(PyUtil, 'sleep_until',
+                                                                                      clock.sleep_until):
+            periodic = Periodic(duration=None, period=0.01)
+            start = clock.now
+            for cycle in periodic:
+                if cycle == 51:
+                    break
+        self.assertEqual(clock.deadlines, [start + k*10000000 for k in range(51)])
+        self.assertEqual(periodic.stats.cycles, 51)
+        self.assertEqual(periodic.stats.overruns, 0)
+        self.assertAlmostEqual(periodic.stats.worst_latency, 0.007)
+
+    def test_catch_up_overrun(self):
+        periodic = Periodic(duration=0.5, period=0.05, overrun=Periodic.CATCH_UP)
+        cycles = []
+        for cycle in periodic:
+            cycles.append(cycle)
+            if cycle == 2:
+                time.sleep(0.17)
+        self.assertEqual(cycles, list(range(1, 11)))
+        self.assertGreaterEqual(periodic.stats.overruns, 3)
+        self.assertEqual(periodic.stats.skipped, 0)
+        print(periodic.stats)
+
+    def test_skip_overrun(self):
+        periodic = Periodic(duration=0.5, period=0.05, overrun=Periodic.SKIP)
+        cycles = []
+        for cycle in periodic:
+            cycles.append(cycle)
+            if cycle == 2:
+                time.sleep(0.17)
+        self.assertEqual(cycles, [1, 2, 5, 6, 7, 8, 9, 10])
+        self.assertEqual(periodic.stats.overruns, 1)
+        self.assertEqual(periodic.stats.skipped, 2)
+        print(periodic.stats)
+
+    def test_stats(self):
+        stats = LoopStats()
+        stats.record(10000)
+        stats.record(3000000)
+        data = stats.get_data()
+        self.assertEqual(data['cycles'], 2)
+        self.assertAlmostEqual(data['worst_latency'], 0.003)
+        self.assertEqual(data['histogram'][0], 1)
+        self.assertEqual(data['histogram'][LoopStats.HISTOGRAM_US.index(5000)], 1)
+
 
 if __name__ == '__main__':
     unittest.main()
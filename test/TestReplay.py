@@ -0,0 +1,97 @@
+import unittest
+import os
+import tempfile
+import time
+import numpy as np
+
+from Controllers import FlockingController, DistanceController
+from FlightRecorder import FlightRecorder
+from LogManager import LogManager
+from Replay import Flight, Replay, ControllerFactory
+from SimSwarm import PointMassModel
+from SwarmState import SwarmState
+
+
+class TestReplay(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Record a simulated flight of the flocking controller moving between two references
+        """
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.recorder_path = os.path.join(cls.tmp.name, 'flight.rec')
+        log = LogManager(directory=cls.tmp.name, chunk_size=50, recorder=FlightRecorder(cls.recorder_path))
+        cls.directory = log.directory
+        state_log = log.add_caller(name='state', call=None, period_ms=None, start=False)
+        control_log = log.add_caller(name='control', call=None, period_ms=None, start=False)
+        ref_log = log.add_caller(name='ref', call=None, period_ms=None, start=False)
+
+        uris = ['sim://' + str(i) for i in range(4)]
+        model = PointMassModel(4, positions=[(0, 0, 1), (1, 0, 1), (0, 1, 1), (1, 1, 1)])
+        state = SwarmState(uris)
+        controller = FlockingController(ref=(0, 0, 1))
+        for k in range(200):
+            if k == 100:
+                controller.set_ref((1, 1, 1.5))
+            for i, uri in enumerate(uris):
+                state.write(uri, k, {'kalman.stateX': model.pos[i, 0], 'kalman.stateY': model.pos[i, 1],
+                                     'kalman.stateZ': model.pos[i, 2], 'kalman.statePX': model.vel[i, 0],
+                                     'kalman.statePY': model.vel[i, 1], 'kalman.statePZ': model.vel[i, 2]})
+            u = controller.compute(state)
+            ref_log.push_data(controller.get_ref())
+            control_log.push_data(controller.get_u())
+            state_log.push_data(state.snapshot())
+            for i, uri in enumerate(uris):
+                model.set_velocity(i, u[uri])
+            model.step(0.01)
+        log.stop()
+        cls.uris = uris
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_load(self):
+        for flight in (Flight.from_log(self.directory), Flight.from_recorder(self.recorder_path)):
+            self.assertEqual(flight.uris, self.uris)
+            self.assertEqual(flight.states.shape, (200, 4, 6))
+            self.assertEqual(flight.control.shape, (200, 4, 3))
+            self.assertTrue(np.array_equal(flight.refs[[0, 150]], [(0, 0, 1), (1, 1, 1.5)]))
+
+    def test_run(self):
+        replay = Replay(Flight.from_log(self.directory))
+        t0 = time.perf_counter()
+        u = replay.run(FlockingController())
+        print('Replayed ' + str(len(u)) + ' samples in ' + str((time.perf_counter() - t0)*1000) + ' ms')
+        self.assertTrue(np.allclose(u, replay.get_recorded()))
+        self.assertAlmostEqual(replay.score(u)['rms_error'], 0)
+
+        # Other gains give other control signals
+        u = replay.run(FlockingController(k=2))
+        self.assertGreater(replay.score(u)['rms_error'], 0.01)
+
+        # Stride
+        replay = Replay(Flight.from_recorder(self.recorder_path), stride=5)
+        self.assertEqual(len(replay.run(FlockingController())), 40)
+
+    def test_sweep(self):
+        replay = Replay(Flight.from_log(self.directory), stride=2)
+        configs = [{'k': k} for k in (0.5, 1, 2)]
+        results = replay.sweep(ControllerFactory(FlockingController), configs)
+        self.assertEqual([result['config'] for result in results], configs)
+        self.assertAlmostEqual(results[1]['rms_error'], 0)
+
+        configs = [{'kp': kp, 'k1': -0.3} for kp in np.linspace(0.5, 2, 8)]
+        factory = ControllerFactory(DistanceController, period_ms=20)
+        t0 = time.perf_counter()
+        results = replay.sweep(factory, configs, workers=2)
+        print('Swept ' + str(len(configs)) + ' configurations in ' + str((time.perf_counter() - t0)*1000) + ' ms')
+        self.assertEqual(results, replay.sweep(factory, configs))
+
+        with self.assertRaises(AttributeError):
+            factory({'gain': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
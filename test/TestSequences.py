@@ -0,0 +1,226 @@
+import unittest
+import math
+import time
+import numpy as np
+
+from Sequences import Sequences, SequenceTable, Step, Curves
+from CFUtil import CFUtil
+
+
+class Recorder:
+
+    def __init__(self):
+        self.calls = []
+
+
+class FakeCommander:
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def send_position_setpoint(self, x, y, z, yaw):
+        self.recorder.calls.append(('detached', (x, y, z, yaw)))
+
+
+class FakeCf:
+
+    def __init__(self, recorder):
+        self.commander = FakeCommander(recorder)
+
+
+class FakeScf:
+
+    def __init__(self, recorder):
+        self.cf = FakeCf(recorder)
+
+
+class FakeSwarm:
+
+    def __init__(self, recorder, uris=('radio://0/80/2M/E7E7E7E701', 'radio://0/80/2M/E7E7E7E702'),
+                 heights=(1.0, 0.5)):
+        self.recorder = recorder
+        self.uris = list(uris)
+        self.cfs = {uri: FakeScf(recorder) for uri in self.uris}
+        self.heights = heights
+
+    def get_uris(self):
+        return list(self.uris)
+
+    def get_cfs(self):
+        return self.cfs
+
+    def follow_controller(self, controller):
+        self.recorder.calls.append(('follow', None))
+
+    def broadcast(self, func, args_dict=None):
+        self.recorder.calls.append(('broadcast', func.__name__))
+
+    def send_velocity_batch(self, uris, u, ignore=()):
+        self.recorder.calls.append(('velocity', tuple(round(vz, 6) for vz in u[:, 2])))
+
+    def get_state(self):
+        return {uri: {key: z if key == CFUtil.KEY_Z else 0.0 for key in CFUtil.KEYS_STATE}
+                for uri, z in zip(self.uris, self.heights)}
+
+
+class SlowSwarm(FakeSwarm):
+
+    def __init__(self, recorder, broadcast_s):
+        FakeSwarm.__init__(self, recorder)
+        self.broadcast_s = broadcast_s
+        self.follow_times = []
+
+    def follow_controller(self, controller):
+        self.follow_times.append(time.monotonic())
+
+    def broadcast(self, func, args_dict=None):
+        # Same as AsyncSwarm.broadcast falling back to parallel without command workers
+        time.sleep(self.broadcast_s)
+
+
+class FakeController:
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def set_ref(self, new_ref):
+        self.recorder.calls.append(('ref', tuple(new_ref)))
+
+    def reset(self):
+        self.recorder.calls.append(('reset', None))
+
+    def add_ignore(self, uri):
+        self.recorder.calls.append(('ignore', tuple(uri)))
+
+    def remove_ignore(self, uri):
+        self.recorder.calls.append(('unignore', tuple(uri)))
+
+
+class FakeLog:
+
+    def __init__(self):
+        self.events = []
+
+    def record_event(self, name, values=()):
+        self.events.append((name, list(values)))
+
+
+class TestSequences(unittest.TestCase):
+
+    def test_compile_all(self):
+        seq = Sequences(period_ms=20)
+        seen, collisions = Sequences.get_statics()
+        self.assertEqual(collisions, [])
+        t0 = time.perf_counter()
+        for sequence in Sequences.STEPS:
+            table = seq.compile(sequence)
+            self.assertIs(table, seq.compile(sequence))
+            self.assertEqual(len(table.plan), table.ticks + 1)
+        print('Compiled ' + str(len(Sequences.STEPS)) + ' sequences in ' + str((time.perf_counter() - t0)*1000) +
+              ' ms')
+        for sequence in Sequences.REAL.values():
+            self.assertIn(sequence, Sequences.STEPS)
+        self.assertAlmostEqual(seq.compile(Sequences.SPIRAL).get_duration(), 9)
+        with self.assertRaises(ValueError):
+            seq.compile(12345)
+
+    def test_spiral(self):
+        period_s = 0.02
+        table = Sequences(period_ms=20).compile(Sequences.SPIRAL)
+        start = 100
+        self.assertTrue(np.allclose(table.refs[0], (0, 0, 0.6)))
+        self.assertTrue(np.all(np.isnan(table.refs[1:start])))
+
+        # Same formula as the loop this table replaced, cycles counted from 1
+        for cycle in (1, 77, 300):
+            progress = cycle*period_s/6
+            angle = progress*2*math.pi
+            expected = (math.cos(angle*2)*0.5, math.sin(angle*2)*0.5, 0.6 + progress)
+            self.assertTrue(np.allclose(table.refs[start + cycle - 1], expected))
+        self.assertTrue(np.all(np.isnan(table.refs[start + 300:])))
+        self.assertTrue(np.allclose(Curves.spiral(np.array([1.0]))[0], (0.5, 0, 1.6)))
+
+    def test_ramp(self):
+        table = SequenceTable([Step.hold(0.5, (0, 0, 1)), Step.ramp(1, (0, 0, 1), (0, 1, 1)),
+                               Step(0.5, detached=(0, -1, 1), detached_end=(0, 1, 1))], period_s=0.1)
+        self.assertEqual(table.ticks, 20)
+        self.assertTrue(np.allclose(table.refs[5:15, 1], np.arange(1, 11)/10))
+        self.assertTrue(np.all(np.isnan(table.refs[15:])))
+        self.assertTrue(np.allclose(table.detached[15:20], [(0, -0.6, 1, 0), (0, -0.2, 1, 0), (0, 0.2, 1, 0),
+                                                            (0, 0.6, 1, 0), (0, 1, 1, 0)]))
+        self.assertTrue(table.uses_first)
+        self.assertTrue(np.all(table.mode == SequenceTable.FOLLOW))
+
+    def test_velocity(self):
+        table = SequenceTable([Step.take_off(0.5, 1.0), Step(0.2, follow=False), Step.land(1)], period_s=0.1)
+        self.assertEqual(list(table.mode), [2]*5 + [1]*2 + [3]*10 + [0])
+        self.assertTrue(np.allclose(table.velocity[0:5], (0, 0, 2)))
+        self.assertTrue(np.allclose(table.velocity[7:17, 2], 1))
+        self.assertEqual(table.plan[7][0], (Step.DESCEND,))
+
+    def test_run(self):
+        recorder = Recorder()
+        swarm = FakeSwarm(recorder)
+        log = FakeLog()
+        uri1 = swarm.get_uris()[0]
+        steps = [Step.take_off(0.02, 1.0),
+                 Step.do(Step.RESET),
+                 Step.hold(0.03, (0, 0, 1)),
+                 Step.do(Step.IGNORE),
+                 Step.hold(0.02, (0, 1, 1), detached=(1, 0, 1)),
+                 Step.do(Step.UNIGNORE),
+                 Step.hold(0.01, (0, 0, 0.5)),
+                 Step.land(0.02),
+                 Step.do(Step.STOP)]
+
+        t0 = time.perf_counter()
+        Sequences(period_ms=10).run(swarm, FakeController(recorder), steps, log=log)
+        self.assertGreater(time.perf_counter() - t0, 0.08)
+        self.assertEqual(recorder.calls, [('velocity', (50, 50)), ('velocity', (50, 50)), ('reset', None),
+                                          ('ref', (0, 0, 1)), ('follow', None),
+                                          ('follow', None),
+                                          ('follow', None),
+                                          ('ignore', (uri1,)), ('ref', (0, 1, 1)), ('follow', None),
+                                          ('detached', (1, 0, 1, 0)),
+                                          ('follow', None), ('detached', (1, 0, 1, 0)),
+                                          ('unignore', (uri1,)), ('ref', (0, 0, 0.5)), ('follow', None),
+                                          ('velocity', (-55, -30)), ('velocity', (-55, -30)),
+                                          ('broadcast', 'send_stop_setpoint')])
+        self.assertEqual([event[0] for event in log.events], ['sequence_start', 'sequence_end'])
+
+    def test_blocking_action(self):
+        # Ticks after a slow action keep their spacing instead of catching up on the missed ticks
+        recorder = Recorder()
+        swarm = SlowSwarm(recorder, broadcast_s=0.2)
+        steps = [Step.do(Step.STOP), Step.hold(0.2, (0, 0, 1))]
+        Sequences(period_ms=10).run(swarm, FakeController(recorder), steps)
+
+        gaps = np.diff(swarm.follow_times)
+        print('Tick spacing after slow action: min %.1f ms, max %.1f ms' % (gaps.min()*1000, gaps.max()*1000))
+        self.assertEqual(len(swarm.follow_times), 20)
+        self.assertGreater(gaps.min(), 0.0025)
+        self.assertGreater(swarm.follow_times[-1] - swarm.follow_times[0], 0.17)
+
+    def test_take_off_standard(self):
+        # Take off runs one velocity setpoint per tick, the reference is set right after the last tick
+        recorder = Recorder()
+        ticks = Sequences(period_ms=20).start(FakeSwarm(recorder), FakeController(recorder),
+                                              Sequences.TAKE_OFF_STANDARD)
+        self.assertEqual(len(list(ticks)), 49)
+        self.assertEqual(recorder.calls, [('velocity', (1, 1))]*50 + [('reset', None), ('ref', (0, 0, 1))])
+
+    def test_land_preempted(self):
+        # Landing velocities come from the heights at the start of the landing, closing stops sending them
+        recorder = Recorder()
+        swarm = FakeSwarm(recorder, heights=(1.1, 0.1))
+        ticks = Sequences(period_ms=20).start(swarm, FakeController(recorder), Sequences.LAND_UNSAFE)
+        for k in range(3):
+            next(ticks)
+        swarm.heights = (2, 2)
+        next(ticks)
+        ticks.close()
+        self.assertEqual(recorder.calls, [('velocity', (-0.6, -0.1))]*4)
+
+
+if __name__ == '__main__':
+    unittest.main()
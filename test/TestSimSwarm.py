@@ -0,0 +1,200 @@
+import unittest
+import time
+import numpy as np
+from AsyncSwarm import AsyncSwarm
+from CFUtil import CFUtil
+from Controllers import FlockingController
+from SimSwarm import SimSwarm, PointMassModel
+
+
+class TestSimSwarm(unittest.TestCase):
+
+    def test_model_velocity(self):
+        model = PointMassModel(2, positions=[(0, 0, 1), (1, 0, 1)])
+        model.set_velocity(0, (0.5, 0, 0))
+        model.set_velocity(1, (0, 0.5, 0))
+        for i in range(300):
+            model.step(0.01)
+            model.setpoint_age[:] = 0
+        self.assertTrue(np.allclose(model.vel, [(0.5, 0, 0), (0, 0.5, 0)], atol=1e-3))
+        self.assertGreater(model.pos[0, 0], 0.3)
+        self.assertGreater(model.pos[1, 1], 0.3)
+
+    def test_model_position_and_stop(self):
+        model = PointMassModel(2)
+        model.set_position(0, (1, 1, 1))
+        for i in range(500):
+            model.step(0.01)
+            model.setpoint_age[0] = 0
+        self.assertTrue(np.allclose(model.pos[0], (1, 1, 1), atol=0.05))
+
+        # Stopped drones fall to the ground, lost setpoints make drones hover
+        model.set_velocity(1, (0, 0, 1))
+        model.step(0.01)
+        model.stop(0)
+        for i in range(300):
+            model.step(0.01)
+        self.assertEqual(model.pos[0, 2], 0)
+        self.assertTrue(np.allclose(model.vel[1], 0, atol=1e-3))
+
+    def test_log_blocks(self):
+        sim = SimSwarm(count=3, rate_hz=100)
+        scf = sim.construct(sim.uris[1])
+        CFUtil.ext_open_link_cf(scf, timeout=1)
+        self.assertTrue(scf.cf.is_connected())
+        self.assertTrue(scf.cf.param.is_updated)
+
+        received = []
+        config = CFUtil.default_log_config(sample_time_ms=50)
+        config.data_received_cb.add_callback(lambda timestamp, data, logconf: received.append((timestamp, data)))
+        scf.cf.log.add_config(config)
+        config.start()
+        self.assertTrue(config.started)
+
+        scf.cf.commander.send_velocity_world_setpoint(0, 0, 0.5, 0)
+        for i in range(100):
+            sim.step()
+        self.assertEqual(len(received), 20)
+        self.assertEqual(received[-1][0], 1000)
+        self.assertEqual(set(received[-1][1].keys()), set(SwarmKeys))
+        self.assertGreater(received[-1][1][CFUtil.KEY_Z], 0.2)
+
+        CFUtil.stop_all_logging(scf)
+        for i in range(10):
+            sim.step()
+        self.assertEqual(len(received), 20)
+        self.assertEqual(scf.cf.log.log_blocks, [])
+        scf.close_link()
+        self.assertFalse(scf.cf.is_connected())
+
+    def test_connect(self):
+        # Returns on the connected callback instead of polling
+        sim = SimSwarm(count=2, connect_delay=0.2)
+        scf = sim.construct(sim.uris[0])
+        starttime = time.time()
+        CFUtil.ext_open_link_cf(scf, timeout=2)
+        self.assertTrue(CFUtil.wait_for_param_download(scf, timeout=1))
+        self.assertTrue(scf.cf.is_connected())
+        self.assertLess(time.time() - starttime, 0.5)
+
+        # Timed out attempts are retried with backoff, then given up
+        sim = SimSwarm(count=1, connect_delay=5)
+        scf = sim.construct(sim.uris[0])
+        starttime = time.time()
+        with self.assertRaises(ConnectionError):
+            CFUtil.ext_open_link_cf(scf, timeout=0.2, retries=2, backoff=0.1)
+        self.assertLess(time.time() - starttime, 1)
+        self.assertFalse(scf.cf.is_connected())
+
+    def test_estimator(self):
+        sim = SimSwarm(count=2, rate_hz=100)
+        sim.start()
+        try:
+            scf = sim.construct(sim.uris[0])
+            CFUtil.ext_open_link_cf(scf, timeout=1)
+            converged = CFUtil.reset_estimator(scf, timeout=5)
+            self.assertIsNotNone(converged)
+            self.assertLess(converged, 3)
+            self.assertEqual(scf.cf.log.log_blocks, [])
+
+            # Criterion never met
+            self.assertIsNone(CFUtil.wait_for_position_estimator(scf, timeout=0.3, criterion=lambda history: False))
+            self.assertIsNone(CFUtil.reset_estimator(scf, timeout=0.3, criterion=lambda history: False))
+        finally:
+            sim.stop()
+
+    def test_estimator_criterion(self):
+        # Convergence check set on the swarm reaches every drone
+        sim = SimSwarm(count=2, rate_hz=100)
+        sim.start()
+        swarm = AsyncSwarm((), uris=sim.uris, factory=sim)
+        shapes = []
+
+        def criterion(history):
+            shapes.append(history.shape)
+            return True
+
+        swarm.estimator_window = 3
+        swarm.estimator_criterion = criterion
+        try:
+            swarm.start()
+            self.assertEqual(set(shapes), {(3, 3)})
+            self.assertEqual(len(shapes), 2)
+            self.assertTrue(all(t is not None for t in swarm.estimator_times.values()))
+        finally:
+            swarm.stop()
+            sim.stop()
+
+    def test_estimator_window(self):
+        sim = SimSwarm(count=1, rate_hz=100)
+        sim.start()
+        try:
+            scf = sim.construct(sim.uris[0])
+            CFUtil.ext_open_link_cf(scf, timeout=1)
+            # A single sample in the window meets the spread threshold at once
+            converged = CFUtil.reset_estimator(scf, timeout=5, window=1, period_ms=10)
+            self.assertIsNotNone(converged)
+            self.assertLess(converged, 0.5)
+        finally:
+            sim.stop()
+
+    def test_swarm(self):
+        sim = SimSwarm(count=5, rate_hz=100)
+        sim.start()
+        swarm = AsyncSwarm((), uris=sim.uris, factory=sim)
+        starttime = time.time()
+        swarm.start()
+        print('Simulated swarm started after ' + str(time.time() - starttime) + ' seconds')
+        self.assertEqual(set(swarm.estimator_times), set(sim.uris))
+        self.assertTrue(all(t is not None for t in swarm.estimator_times.values()))
+
+        try:
+            time.sleep(0.2)
+            state = swarm.get_state()
+            self.assertFalse(np.isnan(state.get_matrix()).any())
+
+            controller = FlockingController((0, 0, 1))
+            swarm.controller_active = True
+            for i in range(100):
+                controller.compute(swarm.get_state())
+                swarm.follow_controller(controller)
+                time.sleep(0.02)
+            z = swarm.get_state().get_matrix()[:, 2]
+            self.assertTrue(np.all(z > 0.3))
+        finally:
+            swarm.stop()
+            sim.stop()
+        print(sim.stats)
+
+    def test_estimator_not_converged(self):
+        # Drone 1 never converges and is removed before the swarm is ready
+        sim = SimSwarm(count=3, rate_hz=100, diverging=(1,))
+        sim.start()
+        swarm = AsyncSwarm((), uris=sim.uris, factory=sim)
+        swarm.estimator_timeout = 3
+        try:
+            swarm.start()
+            self.assertIsNone(swarm.estimator_times[sim.uris[1]])
+            self.assertEqual(swarm.get_uris(), [sim.uris[0], sim.uris[2]])
+            self.assertEqual(swarm.state.uris, (sim.uris[0], sim.uris[2]))
+        finally:
+            swarm.stop()
+            sim.stop()
+
+        # Without any drone ready the swarm does not open
+        sim = SimSwarm(count=1, rate_hz=100, diverging=(0,))
+        sim.start()
+        swarm = AsyncSwarm((), uris=sim.uris, factory=sim)
+        swarm.estimator_timeout = 1
+        try:
+            with self.assertRaises(ConnectionError):
+                swarm.start()
+        finally:
+            sim.stop()
+
+
+SwarmKeys = CFUtil.KEYS_STATE + (CFUtil.KEY_BAT,)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import time
+import numpy as np
+from SpatialGrid import SpatialGrid
+
+
+def brute_force_pairs(positions, cutoff):
+    i, j = np.triu_indices(len(positions), 1)
+    within = np.linalg.norm(positions[i] - positions[j], axis=1) < cutoff
+    return set(zip(i[within], j[within]))
+
+
+class TestSpatialGrid(unittest.TestCase):
+
+    def test_empty(self):
+        grid = SpatialGrid(cutoff=1)
+        grid.rebuild(np.zeros((0, 3)))
+        i, j = grid.pairs()
+        self.assertEqual(len(i), 0)
+
+    def test_single_cell(self):
+        grid = SpatialGrid(cutoff=1)
+        grid.rebuild(np.array([[0.1, 0.1, 0.1], [0.2, 0.2, 0.2], [0.3, 0.1, 0.2]]))
+        i, j = grid.pairs()
+        self.assertEqual(set(zip(i, j)), {(0, 1), (0, 2), (1, 2)})
+
+    def test_cutoff(self):
+        grid = SpatialGrid(cutoff=1)
+        grid.rebuild(np.array([[0, 0, 1], [0.9, 0, 1], [2.5, 0, 1], [-0.95, 0, 1]]))
+        i, j = grid.pairs()
+        self.assertEqual(set(zip(i, j)), {(0, 1), (0, 3)})
+
+    def test_random_swarms(self):
+        rng = np.random.default_rng(1)
+        for count in (2, 10, 100, 300):
+            positions = rng.uniform(-3, 3, (count, 3))
+            grid = SpatialGrid(cutoff=0.8)
+            grid.rebuild(positions)
+            i, j = grid.pairs()
+            self.assertTrue(np.all(i < j))
+            self.assertEqual(set(zip(i, j)), brute_force_pairs(positions, 0.8))
+
+    def test_runtime(self):
+        rng = np.random.default_rng(2)
+        positions = rng.uniform(-20, 20, (500, 3))
+        grid = SpatialGrid(cutoff=1.5)
+
+        t0 = time.time()
+        grid.rebuild(positions)
+        i, j = grid.pairs()
+        dur = time.time() - t0
+
+        print('Runtime: ' + str(dur*1000) + ' ms for ' + str(len(i)) + ' pairs.')
+
+
+if __name__ == '__main__':
+    unittest.main()
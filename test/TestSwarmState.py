@@ -0,0 +1,150 @@
+import unittest
+import copy
+import threading
+import time
+import numpy as np
+from CFUtil import CFUtil
+from SwarmState import SwarmState
+from Controllers import FlockingController, DistanceController
+
+
+class TestSwarmState(unittest.TestCase):
+
+    def setUp(self):
+        self.state = SwarmState(CFUtil.URIS_DEFAULT[0:3])
+        for i, uri in enumerate(self.state.uris):
+            data = CFUtil.generate_drone(name=uri, pos=(i, 2*i, 1), vel=(0, 0.5, 0))[uri]
+            data[CFUtil.KEY_BAT] = 4000
+            self.state.write(uri=uri, timestamp=100 + i, data=data)
+
+    def test_write(self):
+        row = self.state.index[CFUtil.URI2]
+        self.assertTrue(np.array_equal(self.state.array[row], [1, 2, 1, 0, 0.5, 0, 4000]))
+        self.assertEqual(self.state.timestamps[row], 101)
+
+    def test_dict_access(self):
+        self.assertEqual(self.state[CFUtil.URI3][CFUtil.KEY_Y], 4)
+        self.assertEqual(list(self.state.keys()), list(CFUtil.URIS_DEFAULT[0:3]))
+        self.assertEqual(dict(self.state.items())[CFUtil.URI1][CFUtil.KEY_BAT], 4000)
+
+    def test_unseen_row(self):
+        state = SwarmState((CFUtil.URI1,))
+        self.assertEqual(state[CFUtil.URI1], {})
+
+    def test_matrix_is_view(self):
+        matrix = self.state.get_matrix()
+        self.assertEqual(matrix.shape, (3, 6))
+        self.assertTrue(np.shares_memory(matrix, self.state.array))
+
+    def test_copy(self):
+        state = self.state.copy()
+        self.state.write(CFUtil.URI1, 200, CFUtil.generate_drone(CFUtil.URI1, pos=(5, 5, 5))[CFUtil.URI1])
+        self.assertEqual(state[CFUtil.URI1][CFUtil.KEY_X], 0)
+        self.assertEqual(self.state[CFUtil.URI1][CFUtil.KEY_X], 5)
+
+    def test_snapshot_reuse(self):
+        out = self.state.snapshot()
+        test = self.state.snapshot(out=out)
+        self.assertIs(test, out)
+        self.assertTrue(np.array_equal(test.array, self.state.array))
+
+    def test_snapshot_is_state(self):
+        # Snapshots have every attribute of a SwarmState and work as one
+        snapshot = self.state.snapshot()
+        self.assertEqual(set(vars(snapshot)), set(vars(SwarmState(self.state.uris))))
+        self.assertTrue(snapshot.wait_for_update(snapshot.seq.copy() - 1, timeout=0))
+        self.assertFalse(snapshot.wait_for_update(snapshot.seq.copy(), timeout=0.01))
+        snapshot.write(CFUtil.URI1, 300, CFUtil.generate_drone(CFUtil.URI1, pos=(7, 7, 7))[CFUtil.URI1])
+        self.assertEqual(snapshot[CFUtil.URI1][CFUtil.KEY_X], 7)
+        self.assertNotEqual(self.state[CFUtil.URI1][CFUtil.KEY_X], 7)
+        self.assertTrue(snapshot.updated.is_set())
+
+    def test_snapshot_consistency(self):
+        state = SwarmState(CFUtil.URIS_DEFAULT)
+        running = [True]
+
+        def writer(uri):
+            k = 0
+            while running[0]:
+                k = k + 1
+                data = CFUtil.generate_drone(name=uri, pos=(k, k, k), vel=(k, k, k))[uri]
+                data[CFUtil.KEY_BAT] = k
+                state.write(uri=uri, timestamp=k, data=data)
+
+        threads = [threading.Thread(target=writer, args=(uri,)) for uri in state.uris]
+        for thread in threads:
+            thread.start()
+
+        out = None
+        try:
+            for i in range(500):
+                out = state.snapshot(out=out)
+                for row in range(len(out)):
+                    if out.timestamps[row] > 0:
+                        self.assertTrue(np.all(out.array[row] == out.timestamps[row]))
+        finally:
+            running[0] = False
+            for thread in threads:
+                thread.join()
+
+    def test_snapshot_runtime(self):
+        for count in (5, 100):
+            uris = ['d' + str(i) for i in range(count)]
+            state = SwarmState(uris)
+            state_dict = {}
+            for uri in uris:
+                data = CFUtil.generate_drone(name=uri, pos=(1, 2, 3))[uri]
+                state.write(uri=uri, timestamp=1, data=data)
+                state_dict[uri] = data
+
+            # Previous path: shallow copy of the state dict, then conversion to numpy in the controller
+            n = 1000
+            t0 = time.time()
+            for i in range(n):
+                CFUtil.state_dict_to_numpy_matrix(copy.copy(state_dict))
+            t_dict = (time.time() - t0)/n
+
+            out = None
+            t0 = time.time()
+            for i in range(n):
+                out = state.snapshot(out=out)
+                out.get_matrix()
+            t_snapshot = (time.time() - t0)/n
+
+            print('Drones: ' + str(count) + ', dict copy: ' + str(t_dict*1e6) + ' us, snapshot: ' +
+                  str(t_snapshot*1e6) + ' us.')
+
+    def test_add_remove(self):
+        self.state.add(CFUtil.URI4)
+        self.assertEqual(len(self.state), 4)
+        self.assertEqual(self.state[CFUtil.URI4], {})
+        self.state.remove(CFUtil.URI1)
+        self.assertEqual(self.state.uris, (CFUtil.URI2, CFUtil.URI3, CFUtil.URI4))
+        self.assertEqual(self.state[CFUtil.URI3][CFUtil.KEY_Y], 4)
+
+    def test_controller_input(self):
+        ctr = FlockingController((0, 0, 1))
+        test = ctr.compute(self.state)
+        expected = ctr.compute(dict(self.state.items()))
+        for uri in expected:
+            self.assertTrue(np.allclose(test[uri], expected[uri]))
+
+    def test_controller_before_first_sample(self):
+        # Drones that have not reported are left out of the controller output and get no setpoint
+        state = SwarmState(CFUtil.URIS_DEFAULT[0:3])
+        for ctr in (FlockingController((0, 0, 1)), DistanceController((0, 0, 1), assign=True)):
+            output = ctr.compute(state.snapshot())
+            self.assertEqual(len(output), 0)
+
+            data = CFUtil.generate_drone(name=CFUtil.URI2, pos=(0, 0, 0.5))[CFUtil.URI2]
+            state.write(uri=CFUtil.URI2, timestamp=1, data=data)
+            output = ctr.compute(state.snapshot())
+            self.assertEqual(output.uris, (CFUtil.URI2,))
+            self.assertTrue(np.all(np.isfinite(output.array)))
+            self.assertGreater(output[CFUtil.URI2][2], 0)
+            self.assertEqual(CFUtil.state_dict_to_array(dict(state.items()))[0], [CFUtil.URI2])
+            state = SwarmState(CFUtil.URIS_DEFAULT[0:3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+import unittest
+import time
+
+from Sequences import Sequences, Step
+from SwarmThread import SwarmThread
+
+
+class FakeSwarm:
+
+    def __init__(self, uris=('radio://0/80/2M/E7E7E7E701', 'radio://0/80/2M/E7E7E7E702')):
+        self.uris = list(uris)
+        self.calls = []
+
+    def get_uris(self):
+        return list(self.uris)
+
+    def get_cfs(self):
+        return {uri: None for uri in self.uris}
+
+    def follow_controller(self, controller):
+        self.calls.append(('follow', tuple(controller.ref)))
+
+    def parallel(self, func, args_dict=None):
+        self.calls.append(('parallel', func.__name__))
+
+    def broadcast(self, func, args_dict=None):
+        self.calls.append(('broadcast', func.__name__))
+
+    def send_velocity_batch(self, uris, u, ignore=()):
+        self.calls.append(('velocity', tuple(u[:, 2])))
+
+
+class FailingSwarm(FakeSwarm):
+
+    def __init__(self, fail_at):
+        FakeSwarm.__init__(self)
+        self.fail_at = fail_at
+
+    def follow_controller(self, controller):
+        FakeSwarm.follow_controller(self, controller)
+        if len(self.calls) == self.fail_at:
+            raise IOError('Send failed')
+
+
+class FakeLog:
+
+    def __init__(self):
+        self.events = []
+
+    def record_event(self, name, values=()):
+        self.events.append(name)
+
+
+class FakeController:
+
+    def __init__(self):
+        self.ref = (0, 0, 0)
+        self.ignore = set()
+
+    def set_ref(self, new_ref):
+        self.ref = tuple(new_ref)
+
+    def reset(self):
+        pass
+
+    def add_ignore(self, uri):
+        self.ignore.update(uri)
+
+    def remove_ignore(self, uri):
+        self.ignore.difference_update(uri)
+
+
+def hold(z, ticks=3):
+    return [Step.hold(ticks*0.01, (0, 0, z))]
+
+
+class TestSwarmThread(unittest.TestCase):
+
+    def setUp(self):
+        self.swarm = FakeSwarm()
+        self.ctr = FakeController()
+        self.thread = SwarmThread(self.swarm, self.ctr, period_ms=10)
+
+    def refs(self):
+        return [call[1][2] for call in self.swarm.calls if call[0] == 'follow']
+
+    def test_queue(self):
+        self.thread.tick()
+        self.thread.submit(hold(1), name='first')
+        self.thread.submit(hold(2), name='second')
+        self.assertEqual(self.thread.get_metrics()['depth'], 2)
+
+        for k in range(8):
+            self.thread.tick()
+        self.assertEqual(self.refs(), [0, 1, 1, 1, 2, 2, 2, 2, 2])
+        self.assertIsNone(self.thread.get_current())
+
+        metrics = self.thread.get_metrics()
+        print(metrics)
+        self.assertEqual(metrics['completed'], 2)
+        self.assertEqual(metrics['max_depth'], 2)
+        self.assertEqual(metrics['depth'], 0)
+        self.assertGreater(metrics['mean_depth'], 0)
+
+    def test_preempt(self):
+        uri1 = self.swarm.get_uris()[0]
+        ignore = [Step.do(Step.IGNORE), Step.hold(1, (0, 0, 1))]
+        self.thread.submit(ignore, name='ignore')
+        self.thread.submit(hold(3), name='later')
+        self.thread.tick()
+        self.assertEqual(self.thread.get_current(), (ignore, 'ignore'))
+        self.assertEqual(self.ctr.ignore, {uri1})
+
+        # Equal priority waits, emergency preempts on the next tick and runs before the queued sequence
+        self.thread.submit(hold(2), name='normal')
+        self.thread.tick()
+        self.assertEqual(self.thread.get_current()[1], 'ignore')
+        self.thread.submit(hold(0.1, ticks=1), priority=SwarmThread.EMERGENCY, name='land')
+        self.thread.tick()
+        self.assertEqual(self.ctr.ignore, set())
+        for k in range(7):
+            self.thread.tick()
+        self.assertEqual(self.refs(), [1, 1, 0.1, 3, 3, 3, 2, 2, 2, 2])
+
+        metrics = self.thread.get_metrics()
+        self.assertEqual(metrics['preempted'], 1)
+        self.assertEqual(metrics['completed'], 3)
+
+    def test_stop_sequence(self):
+        self.thread.submit(hold(1, ticks=100))
+        self.thread.submit(hold(2))
+        self.thread.tick()
+        self.thread.pause()
+        self.thread.stop_sequence()
+        self.thread.tick()
+        self.assertIsNone(self.thread.get_current())
+        self.assertEqual(self.thread.get_metrics()['depth'], 0)
+
+        self.thread.resume()
+        self.thread.tick()
+        self.assertEqual(self.refs(), [1, 1])
+
+    def test_failed_sequence(self):
+        # A tick raising hands the ignored drone back to the controller
+        swarm = FailingSwarm(fail_at=3)
+        log = FakeLog()
+        thread = SwarmThread(swarm, self.ctr, period_ms=10, log=log)
+        thread.submit([Step.do(Step.IGNORE), Step.hold(1, (0, 0, 1))])
+        for k in range(3):
+            thread.tick()
+            self.assertEqual(self.ctr.ignore, set() if k == 2 else {swarm.get_uris()[0]})
+        self.assertEqual(thread.get_metrics()['failed'], 1)
+        self.assertIsNone(thread.get_current())
+        self.assertEqual(log.events, ['sequence_start', 'sequence_failed'])
+
+        # Swarm follows the controller again
+        thread.tick()
+        self.assertEqual(len(swarm.calls), 4)
+
+    def test_full(self):
+        thread = SwarmThread(self.swarm, self.ctr, period_ms=10, maxsize=2)
+        self.assertTrue(thread.submit(hold(1)))
+        self.assertTrue(thread.submit(hold(1)))
+        self.assertFalse(thread.submit(hold(1)))
+        self.assertEqual(thread.get_metrics()['rejected'], 1)
+
+    def test_thread(self):
+        self.thread.start()
+        t0 = time.perf_counter()
+        self.thread.submit(hold(1, ticks=500))
+        time.sleep(0.1)
+        take_off = [Step.take_off(0.05, 1.0), Step.do(Step.RESET), Step.hold(0, (0, 0, 1))]
+        self.thread.submit(take_off, priority=SwarmThread.EMERGENCY)
+        time.sleep(0.15)
+        self.thread.stop()
+        print('Stopped after ' + str((time.perf_counter() - t0)*1000) + ' ms')
+
+        metrics = self.thread.get_metrics()
+        print(metrics)
+        self.assertEqual(metrics['preempted'], 1)
+        self.assertEqual(metrics['completed'], 1)
+        self.assertEqual(self.swarm.calls.count(('velocity', (20, 20))), 5)
+        self.assertEqual(self.ctr.ref, (0, 0, 1))
+
+    def test_emergency_thread(self):
+        # Submitted from another thread while the swarm thread runs, the landing takes over and the preempted sequence
+        # sends nothing after the first setpoint of the landing
+        self.thread.start()
+        self.thread.submit(hold(1, ticks=500), name='long')
+        time.sleep(0.05)
+        self.thread.submit(hold(-1, ticks=5), priority=SwarmThread.EMERGENCY, name='land', preempt=True)
+        time.sleep(0.15)
+        self.thread.stop()
+
+        refs = self.refs()
+        first = refs.index(-1)
+        self.assertGreater(first, 0)
+        self.assertEqual(set(refs[first:]), {-1})
+        self.assertGreaterEqual(len(refs) - first, 5)
+        metrics = self.thread.get_metrics()
+        self.assertEqual(metrics['preempted'], 1)
+        self.assertEqual(metrics['completed'], 1)
+
+    def test_preempt_take_off(self):
+        # Take off advances one tick at a time, an emergency sequence takes over on the next tick
+        self.thread.submit(Sequences.TAKE_OFF_STANDARD)
+        for k in range(3):
+            self.thread.tick()
+        self.thread.submit(hold(0), priority=SwarmThread.EMERGENCY)
+        self.thread.tick()
+        self.assertEqual(self.swarm.calls, [('velocity', (1, 1))]*3 + [('follow', (0, 0, 0))])
+        self.assertEqual(self.thread.get_metrics()['preempted'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import os
+import tempfile
+import time
+import numpy as np
+
+from Controllers import FlockingController, DistanceController
+from Replay import ControllerFactory
+from Sweep import Sweep
+
+
+class TestSweep(unittest.TestCase):
+
+    def test_profile(self):
+        sweep = Sweep(ControllerFactory(FlockingController), profile=Sweep.RAMP_Y, period_ms=100)
+        refs, segments = sweep.get_refs()
+        self.assertEqual(len(refs), 100)
+        self.assertTrue(np.allclose(refs[[0, 20, 40, 59, 60]],
+                                    [(0, 0, 1), (0, 0, 1), (0, 0.5, 1), (0, 0.975, 1), (0, 1, 1)]))
+        self.assertEqual(list(np.unique(segments)), [0, 1, 2])
+
+    def test_simulate(self):
+        sweep = Sweep(ControllerFactory(FlockingController), profile=Sweep.STEP_Z, count=4)
+        result = sweep.simulate({'k': 1})
+        print(result)
+        self.assertLess(result['settling_time'], 5)
+        self.assertLess(result['final_error'], 0.1)
+        self.assertGreater(result['min_distance'], 0.2)
+        self.assertGreater(result['effort'], 0)
+
+        # Without any gain the swarm never reaches the step
+        self.assertTrue(np.isnan(sweep.simulate({'k': 0})['settling_time']))
+
+    def test_run(self):
+        sweep = Sweep(ControllerFactory(DistanceController, period_ms=50), profile=Sweep.STEP_Y, count=4)
+        configs = [{'kp': kp} for kp in (0.5, 1.2, 2)]
+        t0 = time.perf_counter()
+        table = sweep.run(configs, seeds=(0, 1), workers=2)
+        print('Ran ' + str(len(table)) + ' simulations in ' + str((time.perf_counter() - t0)*1000) + ' ms')
+
+        self.assertEqual(len(table), 6)
+        self.assertEqual([(row['kp'], row['seed']) for row in table], [(0.5, 0), (0.5, 1), (1.2, 0), (1.2, 1),
+                                                                       (2, 0), (2, 1)])
+        self.assertEqual(table, sweep.run(configs, seeds=(0, 1), workers=0))
+        self.assertNotIn('error', table[0])
+
+        # Errors are recorded in the table
+        table = sweep.run([{'gain': 1}], workers=0)
+        self.assertIn('error', table[0])
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'sweep.csv')
+            Sweep.write_csv(table, filename)
+            with open(filename) as file:
+                self.assertEqual(file.readline().strip(), 'run,seed,gain,error')
+
+
+if __name__ == '__main__':
+    unittest.main()
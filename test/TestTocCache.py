@@ -0,0 +1,104 @@
+import unittest
+import os
+import tempfile
+import time
+
+from cflib.crazyflie.log import LogTocElement
+from cflib.crazyflie.param import ParamTocElement
+
+from AsyncSwarm import CfFactory
+from CFUtil import CFUtil
+from SimSwarm import SimSwarm
+from TocCacheManager import ManagedTocCache, prewarm
+
+
+def generate_toc():
+    toc = {}
+    for ident, (cls, group, name) in enumerate(((LogTocElement, 'kalman', 'stateX'),
+                                                (LogTocElement, 'kalman', 'stateY'),
+                                                (ParamTocElement, 'kalman', 'resetEstimation'))):
+        element = cls()
+        element.ident = ident
+        element.group = group
+        element.name = name
+        element.ctype = 'float'
+        element.pytype = '<f'
+        element.access = 0
+        if cls is ParamTocElement:
+            element.extended = False
+        toc.setdefault(group, {})[name] = element
+    return toc
+
+
+class TestTocCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.rw = os.path.join(self.tmp.name, 'rw')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_hit_miss(self):
+        cache = ManagedTocCache(rw_cache=self.rw)
+        self.assertIsNone(cache.fetch(0x1234))
+        cache.insert(0x1234, generate_toc())
+        self.assertTrue(cache.contains(0x1234))
+
+        toc = cache.fetch(0x1234)
+        self.assertEqual(toc['kalman']['stateY'].ident, 1)
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 1, 'inserts': 1, 'memory': 1})
+
+        # Every fetch returns its own elements
+        toc['kalman']['stateY'].ident = 10
+        self.assertEqual(cache.fetch(0x1234)['kalman']['stateY'].ident, 1)
+
+    def test_warm_start(self):
+        ManagedTocCache(rw_cache=self.rw).insert(0xABCD, generate_toc())
+
+        # Next session reads the TOC saved by the previous one
+        cache = ManagedTocCache(rw_cache=self.rw)
+        toc = cache.fetch(0xABCD)
+        self.assertIsInstance(toc['kalman']['resetEstimation'], ParamTocElement)
+        self.assertEqual(cache.hits, 1)
+
+        # Read-only fleet cache, nothing is written to it
+        fleet = ManagedTocCache(ro_cache=self.rw)
+        self.assertIsNotNone(fleet.fetch(0xABCD))
+        fleet.insert(0x1, generate_toc())
+        self.assertEqual(len(os.listdir(self.rw)), 1)
+
+        t0 = time.time()
+        for i in range(100):
+            cache.fetch(0xABCD)
+        print('Cached TOC fetch: ' + str((time.time() - t0)*10) + ' ms')
+
+    def test_shared(self):
+        self.assertIs(ManagedTocCache.get_shared(rw_cache=self.rw), ManagedTocCache.get_shared(rw_cache=self.rw))
+        factory = CfFactory(rw_cache=self.rw)
+        first = factory.construct(CFUtil.URI1)
+        second = factory.construct(CFUtil.URI2)
+        self.assertIs(first.cf._toc_cache, factory.toc_cache)
+        self.assertIs(second.cf._toc_cache, factory.toc_cache)
+
+        # Crazyflies built after a failed connection keep the cache
+        old = first.cf
+        self.assertIsNot(CFUtil.rebuild_cf(first), old)
+        self.assertIs(first.cf._toc_cache, factory.toc_cache)
+        CFUtil.rebuild_cf(second, factory)
+        self.assertIs(second.cf._toc_cache, factory.toc_cache)
+
+    def test_rebuild_sim(self):
+        sim = SimSwarm(count=1, connect_delay=5)
+        scf = sim.construct(sim.uris[0])
+        with self.assertRaises(ConnectionError):
+            CFUtil.ext_open_link_cf(scf, timeout=0.1, retries=2, backoff=0.05, factory=sim)
+        self.assertIn('Sim', type(scf.cf).__name__)
+
+    def test_prewarm_unreachable(self):
+        cache = ManagedTocCache(rw_cache=self.rw)
+        self.assertEqual(prewarm(['sim://0'], cache, timeout=0.5, retries=1), {'sim://0': False})
+
+
+if __name__ == '__main__':
+    unittest.main()